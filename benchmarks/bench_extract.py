@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Parse throughput benchmark of the ad page extraction backends in kijiji_rentals_extract.py.
+    
+    Every saved ad page (.html) in the fixtures folder is extracted with each backend,
+    records are checked to be the same across backends, then throughput is reported in
+    ads/sec on a single core. Saved real ad pages can be added to the folder or passed with --fixtures.
+    
+    python benchmarks/bench_extract.py --repeat 200
+
+@author: eric
+"""
+
+import os
+import sys
+import glob
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from kijiji_rentals_extract import BACKENDS, extract_ad_info
+
+
+describe_help = 'python benchmarks/bench_extract.py --repeat 200'
+parser = argparse.ArgumentParser(description=describe_help)
+parser.add_argument('--fixtures', help='Folder of saved ad pages (.html)', type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures'))
+parser.add_argument('--repeat', help='Number of times each page is extracted per backend', type=int, default=200)
+
+HOME_URL = 'https://www.kijiji.ca/'
+
+
+def extract_all(pages, backend):
+    return [ extract_ad_info(content, name, HOME_URL, '2023-11-3', backend=backend) for name, content in pages ]
+
+
+if __name__ == '__main__':
+    
+    args = parser.parse_args()
+    pages = [ (os.path.basename(f), open(f, 'rb').read()) for f in sorted(glob.glob(os.path.join(args.fixtures, '*.html'))) ]
+    if len(pages) == 0:
+        print("No .html files found in %s..."%args.fixtures)
+        exit()
+    
+    # Same fields from every backend (PostingDate defaults to the current time when missing from the page)
+    reference = extract_all(pages, BACKENDS[0])
+    for backend in BACKENDS[1:]:
+        for (name, _), expected, record in zip(pages, reference, extract_all(pages, backend)):
+            expected = { k: v for k, v in (expected or {}).items() if k != 'PostingDate' }
+            record = { k: v for k, v in (record or {}).items() if k != 'PostingDate' }
+            if expected != record:
+                print("%s: %s differs from %s"%(name, backend, BACKENDS[0]))
+                print(set(expected.items()) ^ set(record.items()))
+    
+    print("%s pages, %.1f KB average"%(len(pages), sum(len(c) for _, c in pages) / len(pages) / 1024))
+    print("%8s %16s"%('backend', 'ads/sec/core'))
+    for backend in BACKENDS:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            extract_all(pages, backend)
+        elapsed = time.perf_counter() - start
+        print("%8s %16.1f"%(backend, args.repeat * len(pages) / elapsed))
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Benchmark of the file formats handed between the scraper, process and clean stages
+    (kijiji_rentals_io.py): size, write time, full load time (.csv parsed with the
+    my_dtypes map as kijiji_rentals_clean.py does) and load time of only the columns
+    the clean stage filters on, for .csv, .parquet and .feather.
+
+    python benchmarks/bench_io.py -i ads_processed.csv --copies 20
+
+@author: eric
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from kijiji_rentals_io import read_table, write_table
+from kijiji_rentals_schema import my_dtypes
+
+
+describe_help = 'python benchmarks/bench_io.py -i ads_processed.csv --copies 20'
+parser = argparse.ArgumentParser(description=describe_help)
+parser.add_argument('-i', '--input_file', help='Processed ads (.csv, .parquet or .feather) to write in each format', type=str, default='ads_processed.csv')
+parser.add_argument('--copies', help='Times the ads are repeated to get a larger file', type=int, default=1)
+parser.add_argument('--columns', help='Columns loaded for the projected read', type=str, nargs='+',
+                    default=['Price', 'PricePerBedroom', 'UnitType', 'Agreement-Type', 'City', 'RentalCategory', 'PricePerSqFt', 'AdId', 'Poster'])
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+    df = read_table(args.input_file, dtype=my_dtypes)
+    df = pd.concat([df] * args.copies, ignore_index=True)
+    columns = [ c for c in args.columns if c in df.columns ]
+    print("%s ads, %s columns (%s projected)"%(len(df), len(df.columns), len(columns)))
+
+    folder = tempfile.mkdtemp()
+    try:
+        print("%10s %10s %10s %10s %14s"%('format', 'size MB', 'write s', 'load s', 'projected s'))
+        for extension in ('csv', 'parquet', 'feather'):
+            filename = os.path.join(folder, 'ads.' + extension)
+            _, write_time = timed(write_table, df, filename)
+            _, load_time = timed(read_table, filename, dtype=my_dtypes)
+            _, projected_time = timed(read_table, filename, columns=columns, dtype=my_dtypes)
+            print("%10s %10.1f %10.2f %10.2f %14.2f"%(extension, os.path.getsize(filename) / 1e6, write_time, load_time, projected_time))
+    finally:
+        shutil.rmtree(folder)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Benchmark of the keyword flags/values extracted from ad text in kijiji_rentals_process.py,
+    single pass classifier (kijiji_rentals_keywords.py) against the separate str.extract
+    passes it replaced (kept here as the reference).
+
+    Outputs are checked to be the same on the fixture corpus (fixtures/ad_texts.csv) and on
+    a synthetic history of --ads ads built by mixing its sentences, then throughput is reported.
+
+    python benchmarks/bench_keywords.py --ads 100000
+
+@author: eric
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from kijiji_rentals_keywords import keyword_columns, girls, boys, sublet, students, preference, beds, baths, nums
+
+
+describe_help = 'python benchmarks/bench_keywords.py --ads 100000'
+parser = argparse.ArgumentParser(description=describe_help)
+parser.add_argument('--fixtures', help='.csv of ads with Title, Description and AdURL columns', type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'ad_texts.csv'))
+parser.add_argument('--ads', help='Number of synthetic ads to benchmark', type=int, default=100000)
+parser.add_argument('--seed', help='Seed of the synthetic ads', type=int, default=0)
+
+
+def ad_text(df):
+    urls_expanded = df['AdURL'].str.split('/', expand=True)
+    return (df['Title'].str.lower() + df['Description'].str.lower() + urls_expanded[5].str.lower()).str.replace('\n', '')
+
+def legacy_keyword_columns(text):
+
+    # Separate passes as previously done in kijiji_rentals_process.py
+    df = pd.DataFrame(index=text.index)
+    df['Preference-Male'] = text.str.extract(r'((\b[^fe]%s\b).(\bonly\b))'%('|'.join(boys)), re.DOTALL, expand=False)[0].notnull().astype('bool')
+    df['Preference-Male'] = df['Preference-Male'] | text.str.extract(r'((\bonly\b).(\b[^fe]%s\b))'%('|'.join(boys)), re.DOTALL, expand=False)[0].notnull().astype('bool')
+    df['Preference-Male'] = df['Preference-Male'] | text.str.extract(r'((\bfor\b).(\b[^fe]%s\b))'%('|'.join(boys)), re.DOTALL, expand=False)[0].notnull().astype('bool')
+    df['Preference-Male'] = df['Preference-Male'] | text.str.extract(r'((\bpour\b).(\b[^fe]%s\b))'%('|'.join(boys)), re.DOTALL, expand=False)[0].notnull().astype('bool')
+    df['Preference-Male'] = df['Preference-Male'] | text.str.extract(r'((\b[^fe]%s\b).(\b%s\b))'%('|'.join(boys), '|'.join(preference)), re.DOTALL, expand=False)[0].notnull().astype('bool')
+    df['Preference-Male'] = df['Preference-Male'] | text.str.extract(r'((\bp%s\b).(\b[^fe]%s\b))'%('|'.join(preference), '|'.join(boys)), re.DOTALL, expand=False)[0].notnull().astype('bool')
+    df['Preference-Male'] = df['Preference-Male'] | text.str.extract(r'((\ball\b).(\b[^fe]%s\b))'%('|'.join(boys)), re.DOTALL, expand=False)[0].notnull().astype('bool')
+    df['Preference-Male'] = df['Preference-Male'] | text.str.extract(r'((\bno\b)\s(\b%s\b))'%('|'.join(girls)), re.DOTALL, expand=False)[0].notnull().astype('bool')
+
+    df['Preference-Female'] = text.str.extract(r'((\b%s\b).(\bonly\b))'%('|'.join(girls)), expand=False)[0].notnull().astype('bool')
+    df['Preference-Female'] = df['Preference-Female'] | text.str.extract(r'((\bonly\b).(\b%s\b))'%('|'.join(girls)), re.DOTALL, expand=False)[0].notnull().astype('bool')
+    df['Preference-Female'] = df['Preference-Female'] | text.str.extract(r'((\bfor\b).(\b%s\b))'%('|'.join(girls)), re.DOTALL, expand=False)[0].notnull().astype('bool')
+    df['Preference-Female'] = df['Preference-Female'] | text.str.extract(r'((\bpour\b).(\b%s\b))'%('|'.join(girls)), re.DOTALL, expand=False)[0].notnull().astype('bool')
+    df['Preference-Female'] = df['Preference-Female'] | text.str.extract(r'((\b%s\b).(\b%s\b))'%('|'.join(girls), '|'.join(preference)), re.DOTALL, expand=False)[0].notnull().astype('bool')
+    df['Preference-Female'] = df['Preference-Female'] | text.str.extract(r'((\b%s\b).(\b%s\b))'%('|'.join(preference), '|'.join(girls)), re.DOTALL, expand=False)[0].notnull().astype('bool')
+    df['Preference-Female'] = df['Preference-Female'] | text.str.extract(r'((\ball\b).(\b%s\b))'%('|'.join(girls)), re.DOTALL, expand=False)[0].notnull().astype('bool')
+    df['Preference-Female'] = df['Preference-Female'] | text.str.extract(r'((\bno\b)\s(\b%s\b))'%('|'.join(boys)), re.DOTALL, expand=False)[0].notnull().astype('bool')
+
+    df['Male'] = text.str.extract(r'(\b(%s)\b)'%('|'.join(boys)), re.DOTALL, expand=False)[0].notnull().astype('bool')
+    df['Female'] = text.str.extract(r'(\b(%s)\b)'%('|'.join(girls)), re.DOTALL, expand=False)[0].notnull().astype('bool')
+
+    no_gender_pref = df[(df['Preference-Male'] == True) & (df['Preference-Female'] == True)]
+    df.loc[no_gender_pref.index, ['Preference-Male', 'Preference-Female']] = False
+
+    df['Sublet'] = text.str.extract(r'(\b%s\b)'%('|'.join(sublet)), re.DOTALL, expand=False).notnull().astype('bool')
+    df['Students'] = text.str.extract(r'(\b%s\b)'%('|'.join(students)), re.DOTALL, expand=False).notnull().astype('bool')
+    df['Preference-Any'] = text.str.extract(r'(\b%s\b)'%('|'.join(preference)), re.DOTALL, expand=False).notnull().astype('bool')
+
+    df['Price'] = text.str.extract(r'((\$)(\d+))', re.DOTALL, expand=False)[0]
+    df['BedroomsDigit'] = text.str.extract(r'((\b\d\b).(%s))'%('|'.join(beds)), re.DOTALL, expand=False)[1]
+    df['BedroomsWord'] = text.str.extract(r'((\b%s\b).(%s))'%('|'.join(nums), '|'.join(beds)), re.DOTALL, expand=False)[1]
+    df['BathroomsDigit'] = text.str.extract(r'((\b\d\b).(%s))'%('|'.join(baths)), re.DOTALL, expand=False)[1]
+    df['BathroomsWord'] = text.str.extract(r'((\b%s\b).(%s))'%('|'.join(nums), '|'.join(baths)), re.DOTALL, expand=False)[1]
+    return df
+
+def synthetic_ads(fixtures, n, seed):
+
+    # Titles, urls and description sentences of the fixtures mixed at random
+    r = random.Random(seed)
+    sentences = [ s for d in fixtures['Description'].dropna() for s in re.split(r'(?<=[.!?\n])\s*', d) if s != '' ]
+    titles = fixtures['Title'].tolist()
+    urls = fixtures['AdURL'].tolist()
+    filler = ['close to transit', 'laundry on site', 'heat and hydro included', 'available now', 'call or text', 'non smoking building']
+    descriptions = [ ' '.join(r.choice(sentences) if r.random() < 0.6 else r.choice(filler) for _ in range(r.randint(2, 12))) for _ in range(n) ]
+    return pd.DataFrame({'Title': [ r.choice(titles) for _ in range(n) ], 'Description': descriptions, 'AdURL': [ r.choice(urls) for _ in range(n) ]})
+
+def compare(name, text):
+
+    start = time.perf_counter()
+    expected = legacy_keyword_columns(text)
+    legacy_time = time.perf_counter() - start
+    start = time.perf_counter()
+    result = keyword_columns(text)[expected.columns]
+    new_time = time.perf_counter() - start
+
+    mismatches = [ c for c in expected.columns if not expected[c].equals(result[c]) ]
+    print("%s: %s ads, %s"%(name, len(text), "same output" if len(mismatches) == 0 else "DIFFERENT columns: %s"%mismatches))
+    print("%20s %10.2fs %12.0f ads/sec"%('str.extract passes', legacy_time, len(text) / legacy_time))
+    print("%20s %10.2fs %12.0f ads/sec"%('single pass', new_time, len(text) / new_time))
+    return len(mismatches) == 0
+
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+    fixtures = pd.read_csv(args.fixtures)
+    same = compare('fixtures', ad_text(fixtures))
+    same &= compare('synthetic', ad_text(synthetic_ads(fixtures, args.ads, args.seed)))
+    if not same:
+        sys.exit(1)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Benchmark of the parsing of Price, Size-(sqft), PostingDate and Move-In-Date in
+    kijiji_rentals_process.py: the table of steps applied to distinct values
+    (kijiji_rentals_normalize.py) against the passes over every row it replaced (kept
+    here as the reference).
+
+    The history is synthetic with --ads ads drawn from --distinct raw values per column
+    (English and French formats mixed), outputs are checked to be the same before
+    throughput is reported.
+
+    python benchmarks/bench_parse.py --ads 500000 --distinct 2000
+
+@author: eric
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from kijiji_rentals_normalize import normalize, days_between, fr_month_mapping
+
+
+describe_help = 'python benchmarks/bench_parse.py --ads 500000 --distinct 2000'
+parser = argparse.ArgumentParser(description=describe_help)
+parser.add_argument('--ads', help='Number of synthetic ads', type=int, default=500000)
+parser.add_argument('--distinct', help='Distinct raw values of each column', type=int, default=2000)
+parser.add_argument('--seed', help='Seed of the synthetic ads', type=int, default=0)
+
+columns = ['Price', 'Size-(sqft)', 'PostingDate', 'Move-In-Date', 'PostingDateDaysInAdvance']
+
+
+def legacy_parse(df):
+
+    # Passes over every row as previously done in kijiji_rentals_process.py
+    df['Price'] = df['Price'].str.replace('$', '', regex=False)
+    df['Price'] = df['Price'].str.replace(',', '', regex=False)
+    df['Price'] = df['Price'].str.replace(' ', '', regex=False)
+    df['Price'] = df['Price'].str.replace("\xa0", "", regex=False)
+    df['Price'] = df['Price'].str.replace("Surdemande", "PleaseContact", regex=False)
+    df['Price'] = df['Price'].str.replace('Échange', "Swap/Trade", regex=False)
+    df['Price'] = df['Price'].str.replace('Gratuit', "Free", regex=False)
+    df['Price'].replace(to_replace='PleaseContact', value=np.nan, inplace=True)
+    df['Price'].replace(to_replace='Free', value=np.nan, inplace=True)
+    df['Price'].replace(to_replace='Swap/Trade', value=np.nan, inplace=True)
+    df['Price'] = df['Price'].astype('float32')
+
+    df['PostingDate'] = pd.to_datetime(df['PostingDate'], format='%Y-%m-%dT%H:%M:%S', utc=True)
+
+    for key, value in fr_month_mapping.items():
+        df['Move-In-Date'] = df['Move-In-Date'].str.replace(key, value)
+    en_movein = pd.to_datetime(df['Move-In-Date'], format='%B-%d,-%Y', utc=True, errors='coerce').dt.date
+    fr_movein = pd.to_datetime(df['Move-In-Date'], format='%d-%B-%Y', utc=True, errors='coerce').dt.date
+    df['Move-In-Date'] = en_movein.combine_first(fr_movein)
+    df['Move-In-Date'] = pd.to_datetime(df['Move-In-Date'])
+    df['PostingDateDaysInAdvance'] = (df['Move-In-Date'].dt.date - df['PostingDate'].dt.date).dt.days.astype('Int32')
+
+    df['Size-(sqft)'] = df['Size-(sqft)'].str.replace(',', '', regex=False)
+    df['Size-(sqft)'] = df['Size-(sqft)'].str.replace(' ', '', regex=False)
+    df['Size-(sqft)'] = df['Size-(sqft)'].str.replace("\xa0", "", regex=False).astype('float32')
+    return df
+
+def table_parse(df):
+
+    df = normalize(df)
+    df['PostingDateDaysInAdvance'] = days_between(df['PostingDate'], df['Move-In-Date'])
+    return df
+
+def synthetic_ads(n, distinct, seed):
+
+    r = random.Random(seed)
+    start = pd.Timestamp('2023-01-01')
+    en_months = list(fr_month_mapping.values())
+    fr_months = list(fr_month_mapping.keys())
+
+    def price():
+        if r.random() < 0.03:
+            return r.choice(['Please Contact', 'Sur demande', 'Swap / Trade', 'Échange', 'Gratuit'])
+        value = r.randint(500, 4500)
+        return r.choice(['$%s.00'%format(value, ','), '%s,00\xa0$'%format(value, ',').replace(',', '\xa0')])
+
+    def move_in():
+        day = (start + pd.Timedelta(days=r.randint(0, 500)))
+        if r.random() < 0.5:
+            return '%s-%s,-%s'%(en_months[day.month - 1], day.day, day.year)
+        return '%s-%s-%s'%(day.day, fr_months[day.month - 1], day.year)
+
+    pools = {
+        'Price': [ price() for _ in range(distinct) ] + [None],
+        'Size-(sqft)': [ format(r.randint(300, 3000), ',') for _ in range(distinct) ] + [None],
+        'PostingDate': [ (start + pd.Timedelta(seconds=r.randint(0, 500 * 86400))).strftime('%Y-%m-%dT%H:%M:%S') for _ in range(distinct) ],
+        'Move-In-Date': [ move_in() for _ in range(distinct) ] + [None, 'Not-Available'],
+        }
+    return pd.DataFrame({ c: [ r.choice(pool) for _ in range(n) ] for c, pool in pools.items() })
+
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+    ads = synthetic_ads(args.ads, args.distinct, args.seed)
+    print("%s ads, %s distinct raw values per column"%(len(ads), args.distinct))
+
+    start = time.perf_counter()
+    expected = legacy_parse(ads.copy())
+    legacy_time = time.perf_counter() - start
+    start = time.perf_counter()
+    result = table_parse(ads.copy())
+    table_time = time.perf_counter() - start
+
+    mismatches = [ c for c in columns if not expected[c].equals(result[c]) ]
+    print("same output" if len(mismatches) == 0 else "DIFFERENT columns: %s"%mismatches)
+    print("%20s %10.2fs %12.0f ads/sec"%('every row', legacy_time, len(ads) / legacy_time))
+    print("%20s %10.2fs %12.0f ads/sec"%('distinct values', table_time, len(ads) / table_time))
+    if len(mismatches) > 0:
+        sys.exit(1)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Benchmark of the rate controller of kijiji_rentals_http.py against the local stand-in
+    server in benchmarks/kijiji_server.py with jittery latency and no throttling.
+
+    --requests ad pages are fetched by -w threads sharing one KijijiClient, once with the
+    rate controller as used by the scraper and once with it never slowing down (latency
+    ignored). Without 429/503 responses or a lasting rise of latency both should reach
+    about the same requests/sec, the run fails if the controlled client is below
+    --min_ratio of the uncontrolled one.
+
+    python benchmarks/bench_rate.py --latency 0.1 --jitter 0.08 -w 8 --requests 400
+
+@author: eric
+"""
+
+import os
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from kijiji_server import parser, make_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from kijiji_rentals_http import KijijiClient
+
+
+parser.description = 'python benchmarks/bench_rate.py --latency 0.1 --jitter 0.08 -w 8 --requests 400'
+parser.set_defaults(port=0)
+parser.add_argument('-w', '--workers', help='Number of threads fetching ad pages', type=int, default=8)
+parser.add_argument('--requests', help='Number of ad pages fetched by each client', type=int, default=400)
+parser.add_argument('--min_ratio', help='Lowest accepted requests/sec of the controlled client over the uncontrolled one', type=float, default=0.8)
+
+
+def fetch(client, url):
+    try:
+        client.get(url)
+        return True
+    except Exception:
+        return False
+
+def fetch_all(client, urls, workers):
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        fetched = list(executor.map(lambda url: fetch(client, url), urls))
+    elapsed = time.perf_counter() - start
+    client.close()
+    return len(urls) / elapsed, fetched
+
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+    server, stats = make_server(args)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    home_url = 'http://127.0.0.1:%s/'%server.server_address[1]
+    urls = [ '%sv-apartments-condos/ottawa/apartment-%s/%s'%(home_url, i, i) for i in range(1500000001, 1500000001 + args.requests) ]
+
+    uncontrolled = KijijiClient(pool_size=args.workers)
+    uncontrolled.controller.latency_factor = float('inf')
+    uncontrolled_rate, _ = fetch_all(uncontrolled, urls, args.workers)
+
+    controlled = KijijiClient(pool_size=args.workers)
+    controlled_rate, fetched = fetch_all(controlled, urls, args.workers)
+    rate = controlled.rate()
+    server.shutdown()
+
+    print("%s ad pages, %s workers, %.3fs +/- %.3fs latency, %.0f%% throttled"%(args.requests, args.workers, args.latency, args.jitter, args.throttle_rate * 100))
+    print("%20s %10.1f requests/sec"%('uncontrolled', uncontrolled_rate))
+    print("%20s %10.1f requests/sec (%s in flight allowed at the end, %s failed)"%('rate controller', controlled_rate, rate['concurrency'], fetched.count(False)))
+    print("%20s %10.2f"%('ratio', controlled_rate / uncontrolled_rate))
+    if controlled_rate < args.min_ratio * uncontrolled_rate:
+        sys.exit(1)
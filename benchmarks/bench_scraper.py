@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Description:
+    End-to-end throughput benchmark of kijiji_rentals_scraper.py against the local
+    stand-in server in benchmarks/kijiji_server.py, no requests are sent to kijiji.ca.
+
+    The server runs in this process, the scraper runs as a subprocess writing to a
+    temporary file. Reported are ads/sec (rows saved over wall time), requests/sec,
+    p50/p99 response latency seen by the server (including the injected latency) and
+    peak RSS of the scraper. Arguments not recognized here are passed to the scraper,
+    so configurations can be compared on the same workload.
+
+    python benchmarks/bench_scraper.py --pages 10 --ads_per_page 40 --latency 0.05 -w 8
+    python benchmarks/bench_scraper.py --pages 10 --ads_per_page 40 --latency 0.05 -w 8 --parser lxml --store journal
+
+@author: eric
+"""
+
+import os
+import sys
+import time
+import shutil
+import resource
+import tempfile
+import threading
+import subprocess
+import pandas as pd
+
+from kijiji_server import parser, make_server
+
+
+SCRAPER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'kijiji_rentals_scraper.py')
+
+parser.description = 'python benchmarks/bench_scraper.py --pages 10 --ads_per_page 40 --latency 0.05 -w 8'
+parser.set_defaults(port=0)
+parser.add_argument('--keep', help='Keep the temporary folder with the scraper output', action='store_true', default=False)
+
+
+if __name__ == '__main__':
+
+    args, scraper_args = parser.parse_known_args()
+    server, stats = make_server(args)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    home_url = 'http://127.0.0.1:%s/'%server.server_address[1]
+
+    folder = tempfile.mkdtemp(prefix='kijiji_bench_')
+    filename = os.path.join(folder, 'ads.csv')
+    command = [sys.executable, SCRAPER, '--file', filename, '--home_url', home_url, '--city', 'ottawa'] + scraper_args
+    print("Running %s"%' '.join(command[1:]))
+
+    start = time.perf_counter()
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    if result.returncode != 0:
+        print(result.stderr.decode('utf-8', errors='replace'))
+
+    ads = len(pd.read_csv(filename)) if os.path.isfile(filename) else 0
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == 'darwin':
+        peak_rss /= 1024
+
+    print("%s search pages x %s ads per city, %.3fs latency, %.0f%% errors, %.0f%% throttled"%(args.pages, args.ads_per_page, args.latency, args.error_rate * 100, args.throttle_rate * 100))
+    print("%14s %10.2f"%('seconds', elapsed))
+    print("%14s %10s"%('ads saved', ads))
+    print("%14s %10.1f"%('ads/sec', ads / elapsed))
+    print("%14s %10.1f"%('requests/sec', stats.requests() / elapsed))
+    print("%14s %10.1f"%('p50 ms', stats.percentile(0.50) * 1000))
+    print("%14s %10.1f"%('p99 ms', stats.percentile(0.99) * 1000))
+    print("%14s %10.1f"%('peak RSS MB', peak_rss / 1024))
+    print("%14s %10s"%('responses', ', '.join('%s: %s'%(status, count) for status, count in sorted(stats.status_counts.items()))))
+
+    if args.keep:
+        print("Output kept in %s"%folder)
+    else:
+        shutil.rmtree(folder)
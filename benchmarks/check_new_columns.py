@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Check of columns first found in later raw ads, e.g. when kijiji adds an attribute.
+
+    The first --first ads of a raw file (-r) are saved without the --drop columns and
+    processed, then the next --first ads (with those columns) are added to the raw file and
+    processed with kijiji_rentals_process.py --incremental. The output must have the same
+    columns and values as processing the whole raw file at once.
+
+    The same ads are also run through kijiji_rentals_pipeline.Pipeline as two batches, the
+    first without the --drop columns (as batches of scraped pages have the columns of their
+    own ads). Its processed and cleaned outputs must match kijiji_rentals_process.py and
+    kijiji_rentals_clean.py run on the whole raw file. Exits with 1 if any check fails.
+
+    python benchmarks/check_new_columns.py -r ads.csv --drop Agreement-Type Furnished
+    python benchmarks/check_new_columns.py -r ads.csv --drop Agreement-Type Furnished --extension .parquet
+
+@author: eric
+"""
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import subprocess
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from kijiji_rentals_io import read_table, write_table
+from kijiji_rentals_process import raw_dtypes
+from kijiji_rentals_pipeline import Pipeline
+
+
+PROCESS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'kijiji_rentals_process.py')
+CLEAN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'kijiji_rentals_clean.py')
+
+describe_help = 'python benchmarks/check_new_columns.py -r ads.csv --drop Agreement-Type Furnished'
+parser = argparse.ArgumentParser(description=describe_help)
+parser.add_argument('-r', '--raw_file', help='Raw file of scraped ads', type=str, required=True)
+parser.add_argument('--drop', help='Columns missing from the first ads', type=str, nargs='+', default=['Agreement-Type', 'Furnished'])
+parser.add_argument('--first', help='Number of ads without the --drop columns, the same number of ads follows with them', type=int, default=1000)
+parser.add_argument('--extension', help='Extension of the processed files (.csv, .parquet or .feather)', type=str, default='.csv')
+
+
+def same_ads(df, expected):
+
+    # Same columns (in any order) and values, ads in any order
+    if sorted(df.columns) != sorted(expected.columns):
+        print("Columns differ: %s missing, %s extra"%([ c for c in expected.columns if c not in df.columns ], [ c for c in df.columns if c not in expected.columns ]))
+        return False
+    df = df[expected.columns].astype(str).sort_values('AdId').reset_index(drop=True)
+    expected = expected.astype(str).sort_values('AdId').reset_index(drop=True)
+    return df.equals(expected)
+
+def run(command):
+    print("Running %s"%' '.join(command[1:]))
+    subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+    raw = read_table(args.raw_file, dtype=str)
+    if len(raw) < 2 * args.first:
+        print("%s has %s ads, at least %s are needed"%(args.raw_file, len(raw), 2 * args.first))
+        sys.exit(1)
+
+    folder = tempfile.mkdtemp(prefix='kijiji_columns_')
+    raw_file = os.path.join(folder, 'ads.csv')
+    incremental_file = os.path.join(folder, 'ads_incremental' + args.extension)
+    full_file = os.path.join(folder, 'ads_full' + args.extension)
+    cleaned_file = os.path.join(folder, 'ads_cleaned' + args.extension)
+    pipeline_files = [ os.path.join(folder, 'pipeline_%s%s'%(stage, args.extension)) for stage in ['processed', 'cleaned'] ]
+    try:
+        first = raw.iloc[:args.first].drop(columns=args.drop)
+        write_table(first, raw_file)
+        run([sys.executable, PROCESS, '-r', raw_file, '-o', incremental_file, '--incremental'])
+        write_table(pd.concat([first, raw.iloc[args.first:2 * args.first]], ignore_index=True), raw_file)
+        run([sys.executable, PROCESS, '-r', raw_file, '-o', incremental_file, '--incremental'])
+        run([sys.executable, PROCESS, '-r', raw_file, '-o', full_file])
+
+        df, expected = read_table(incremental_file), read_table(full_file)
+        print("Incremental: %s ads, %s columns. Whole file: %s ads, %s columns"%(len(df), len(df.columns), len(expected), len(expected.columns)))
+        ok = same_ads(df, expected)
+
+        print("Running the pipeline on 2 batches, the first without %s"%' '.join(args.drop))
+        batches = read_table(raw_file, dtype=raw_dtypes)
+        pipeline = Pipeline(*pipeline_files)
+        pipeline.run(batches.iloc[:args.first].drop(columns=args.drop))
+        pipeline.run(batches.iloc[args.first:].reset_index(drop=True))
+        pipeline.close()
+        run([sys.executable, CLEAN, '-i', full_file, '-o', cleaned_file])
+        for stage, filename, expected_file in [('processed', pipeline_files[0], full_file), ('cleaned', pipeline_files[1], cleaned_file)]:
+            df, expected = read_table(filename), read_table(expected_file)
+            print("Pipeline %s: %s ads, %s columns. Separate stages: %s ads, %s columns"%(stage, len(df), len(df.columns), len(expected), len(expected.columns)))
+            ok = same_ads(df, expected) and ok
+    finally:
+        shutil.rmtree(folder)
+
+    print("OK" if ok else "FAILED")
+    if not ok:
+        sys.exit(1)
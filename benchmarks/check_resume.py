@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Check of interrupted crawls of kijiji_rentals_scraper.py against the local stand-in
+    server in benchmarks/kijiji_server.py, no requests are sent to kijiji.ca.
+
+    A crawl of several cities (--cities) is killed (SIGKILL) once every city has
+    --kill_after pages checkpointed. Every page in the checkpoint must have its ads saved
+    (file or journal), then the crawl is resumed with --resume and must end with every ad
+    of every city saved once. Exits with 1 if any check fails. Arguments not recognized
+    here are passed to the scraper.
+
+    python benchmarks/check_resume.py --pages 8 --ads_per_page 20 --cities ottawa toronto
+    python benchmarks/check_resume.py --pages 8 --ads_per_page 20 --cities ottawa toronto --store journal
+
+@author: eric
+"""
+
+import os
+import sys
+import time
+import json
+import shutil
+import signal
+import tempfile
+import threading
+import subprocess
+import pandas as pd
+
+from kijiji_server import parser, make_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from kijiji_rentals_store import journal_path, checkpoint_path, read_journal, read_checkpoint
+
+
+SCRAPER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'kijiji_rentals_scraper.py')
+
+parser.description = 'python benchmarks/check_resume.py --pages 8 --ads_per_page 20 --cities ottawa toronto'
+parser.set_defaults(port=0, pages=8, ads_per_page=20, latency=0.05)
+parser.add_argument('--cities', help='Cities crawled at once', type=str, nargs='+', default=['ottawa', 'toronto'])
+parser.add_argument('--kill_after', help='Pages checkpointed in every city before the crawl is killed', type=int, default=2)
+parser.add_argument('--timeout', help='Seconds to wait for the pages to be checkpointed', type=float, default=120)
+
+
+def saved_ads(filename):
+
+    # Ads in the file and in the journal (not merged yet), with the city of each
+    frames = [pd.DataFrame.from_records(read_journal(journal_path(filename)))]
+    if os.path.isfile(filename):
+        frames.append(pd.read_csv(filename, dtype=str))
+    df = pd.concat(frames, ignore_index=True)
+    if len(df) == 0:
+        return pd.DataFrame(columns=['AdId', 'City'])
+    df['City'] = df['AdURL'].str.split('/', expand=True)[4]
+    return df
+
+def pages_checkpointed(filename, cities):
+    try:
+        checkpoint = read_checkpoint(checkpoint_path(filename))
+    except OSError:
+        return {}
+    if checkpoint is None:
+        return {}
+    return { city: checkpoint['cities'][city]['page_number'] for city in cities if city in checkpoint.get('cities', {}) }
+
+
+if __name__ == '__main__':
+
+    args, scraper_args = parser.parse_known_args()
+    server, stats = make_server(args)
+    # Responses cut short by the killed crawl are expected
+    server.handle_error = lambda request, client_address: None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    home_url = 'http://127.0.0.1:%s/'%server.server_address[1]
+
+    folder = tempfile.mkdtemp(prefix='kijiji_resume_')
+    filename = os.path.join(folder, 'ads.csv')
+    command = [sys.executable, SCRAPER, '--file', filename, '--home_url', home_url, '--city'] + args.cities + scraper_args
+    ok = True
+    try:
+        print("Running %s"%' '.join(command[1:]))
+        crawl = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.perf_counter() + args.timeout
+        pages = {}
+        while crawl.poll() is None and time.perf_counter() < deadline:
+            pages = pages_checkpointed(filename, args.cities)
+            if len(pages) == len(args.cities) and min(pages.values()) >= args.kill_after:
+                break
+            time.sleep(0.05)
+        crawl.send_signal(signal.SIGKILL)
+        crawl.wait()
+        pages = pages_checkpointed(filename, args.cities)
+        print("Killed with pages checkpointed: %s"%json.dumps(pages))
+        if len(pages) < len(args.cities) or min(pages.values()) >= args.pages:
+            print("Crawl was not killed midway, use more --pages or a higher --latency")
+            ok = False
+
+        # Every page checkpointed must be saved, or --resume would skip it
+        saved = saved_ads(filename)
+        for city, page_number in pages.items():
+            n_saved = saved.loc[saved['City'] == city, 'AdId'].nunique()
+            print("%s: %s pages checkpointed, %s ads saved"%(city, page_number, n_saved))
+            if n_saved < page_number * args.ads_per_page:
+                print("%s: ads of checkpointed pages are missing"%city)
+                ok = False
+
+        print("Running %s --resume"%' '.join(command[1:]))
+        subprocess.run(command + ['--resume'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=args.timeout * 5)
+        df = pd.read_csv(filename, dtype=str) if os.path.isfile(filename) else pd.DataFrame(columns=['AdId'])
+        expected = args.pages * args.ads_per_page * len(args.cities)
+        print("After resuming: %s ads saved (%s distinct), %s expected"%(len(df), df['AdId'].nunique(), expected))
+        if len(df) != expected or df['AdId'].nunique() != expected:
+            ok = False
+    finally:
+        server.shutdown()
+        shutil.rmtree(folder)
+
+    print("OK" if ok else "FAILED")
+    if not ok:
+        sys.exit(1)
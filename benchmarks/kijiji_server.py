@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Local stand-in for kijiji.ca to run kijiji_rentals_scraper.py against (--home_url).
+
+    Serves city pages linking to the rentals search of the city, search results pages with
+    a working pagination-next-link chain and embedded listings JSON, and ad pages. Every
+    city has its own ads. Ad pages are
+    synthetic, or recorded pages from a folder (--recorded) served round-robin with their
+    ad id replaced and title tagged so every ad stays unique.
+
+    Latency, server errors (500) and throttling (429 with Retry-After) can be injected.
+
+    python benchmarks/kijiji_server.py --port 8800 --pages 10 --ads_per_page 40 --latency 0.05
+
+@author: eric
+"""
+
+import os
+import re
+import glob
+import json
+import zlib
+import time
+import random
+import threading
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+describe_help = 'python benchmarks/kijiji_server.py --port 8800 --pages 10 --ads_per_page 40'
+parser = argparse.ArgumentParser(description=describe_help)
+parser.add_argument('--port', help='Port to listen on', type=int, default=8800)
+parser.add_argument('--pages', help='Number of search results pages', type=int, default=10)
+parser.add_argument('--ads_per_page', help='Number of ads per search results page', type=int, default=40)
+parser.add_argument('--latency', help='Mean seconds added to every response', type=float, default=0.05)
+parser.add_argument('--jitter', help='Random +/- seconds added to the latency', type=float, default=0.02)
+parser.add_argument('--error_rate', help='Fraction of responses that are 500 errors', type=float, default=0.0)
+parser.add_argument('--throttle_rate', help='Fraction of responses that are 429 Too Many Requests', type=float, default=0.0)
+parser.add_argument('--retry_after', help='Retry-After seconds sent with 429 responses', type=int, default=1)
+parser.add_argument('--recorded', help='Folder of recorded ad pages (.html) to serve instead of synthetic ones', type=str, default=None)
+
+FIRST_AD_ID = 1600000000
+AD_ID_LINK = re.compile(r'(<a class="adId[^"]*"[^>]*>)\d+(</a>)')
+TITLE = re.compile(r'(<h1 class="title[^"]*"[^>]*>)')
+
+
+class ServerStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.status_counts = {}
+
+    def record(self, status, latency):
+        with self.lock:
+            self.latencies.append(latency)
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    def requests(self):
+        return len(self.latencies)
+
+    def percentile(self, q):
+        with self.lock:
+            latencies = sorted(self.latencies)
+        if len(latencies) == 0:
+            return float('nan')
+        return latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+
+
+def synthetic_ad_page(ad_id):
+    r = random.Random(ad_id)
+    bedrooms = r.randint(1, 4)
+    return '''<!DOCTYPE html><html lang="en"><head><title>Ad %(ad_id)s</title></head><body>
+<h1 class="title-4206718449">Bright %(bedrooms)s bedroom apartment #%(ad_id)s</h1>
+<div class="priceWrapper-3915768379"><span class="currentPrice-2842943473"><span>$%(price)s</span></span></div>
+<div class="locationContainer-2867112055"><span class="address-3617944557">%(number)s Bank St, Ottawa, ON K1P 5N%(digit)s</span></div>
+<div class="datePosted-383942873"><time datetime="2023-10-30T14:02:11.000Z">October 30, 2023</time></div>
+<a class="adId-4111206830">%(ad_id)s</a>
+<a class="avatarLink-2184018339" href="/o-profile/%(poster)s/listings/1">Poster</a>
+<div class="titleAttributes-183069789"><ul>
+<li><svg><use xlink:href="#icon-attributes-unittype"></use></svg><span>Apartment</span></li>
+<li><svg><use xlink:href="#icon-attributes-numberbedrooms"></use></svg><span>Bedrooms: %(bedrooms)s</span></li>
+<li><svg><use xlink:href="#icon-attributes-numberbathrooms"></use></svg><span>Bathrooms: 1</span></li>
+</ul></div>
+<ul><li class="attributeGroupContainer-1976342539"><div><h4>Utilities Included</h4><ul>
+<li><svg><use xlink:href="#icon-yes"></use></svg>Hydro</li><li><svg><use xlink:href="#icon-no"></use></svg>Heat</li></ul></div></li>
+<li class="twoLinesAttribute-2452706269"><dl><dt>Parking Included</dt><dd>%(parking)s</dd></dl></li>
+<li class="twoLinesAttribute-2452706269"><dl><dt>Size (sqft)</dt><dd>%(size)s</dd></dl></li>
+<li class="twoLinesAttribute-2452706269"><dl><dt>Move-In Date</dt><dd>November 1, 2023</dd></dl></li>
+</ul>
+<div class="descriptionContainer-231909819"><p>Lovely %(bedrooms)s bedroom unit, close to everything.</p><p>Students welcome, no smoking.</p></div>
+<footer><p>Kijiji</p></footer></body></html>''' % {'ad_id': ad_id, 'bedrooms': bedrooms, 'price': format(r.randint(900, 3500), ','),
+                                                   'number': r.randint(1, 999), 'digit': ad_id % 10, 'poster': 1000 + ad_id % 97,
+                                                   'parking': r.randint(0, 2), 'size': format(r.randint(400, 1500), ',')}
+
+
+class KijijiHandler(BaseHTTPRequestHandler):
+
+    # Set on the class by make_server
+    options = None
+    stats = None
+    recorded = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+
+        start = time.perf_counter()
+        options = self.options
+        time.sleep(max(options.latency + random.uniform(-options.jitter, options.jitter), 0))
+
+        draw = random.random()
+        headers = {}
+        if draw < options.throttle_rate:
+            status, body = 429, '<html><body>Too Many Requests</body></html>'
+            headers['Retry-After'] = str(options.retry_after)
+        elif draw < options.throttle_rate + options.error_rate:
+            status, body = 500, '<html><body>Internal Server Error</body></html>'
+        elif self.path.startswith('/b-for-rent/'):
+            page_number = re.search(r'/page-(\d+)/', self.path)
+            status, body = 200, self.search_page(self.path.split('/')[2], int(page_number.group(1)) if page_number else 1)
+        elif self.path.startswith('/v-'):
+            ad_id = re.search(r'/(\d+)(\?|$)', self.path)
+            if ad_id is None:
+                status, body = 404, '<html><body>Not Found</body></html>'
+            else:
+                status, body = 200, self.ad_page(int(ad_id.group(1)))
+        else:
+            city = self.path.strip('/').split('/')[-1] or 'ottawa'
+            status, body = 200, '<html><body><a href="/b-for-rent/%s/c30349001l1700185">Real Estate for rent</a></body></html>'%city
+
+        content = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(content)
+        self.stats.record(status, time.perf_counter() - start)
+
+    def ad_page(self, ad_id):
+        if len(self.recorded) > 0:
+            page = self.recorded[ad_id % len(self.recorded)]
+            # Unique id and title, or the scraper keeps a single copy of each recorded page
+            page = AD_ID_LINK.sub(lambda m: m.group(1) + str(ad_id) + m.group(2), page, count=1)
+            return TITLE.sub(lambda m: m.group(1) + '#%s '%ad_id, page, count=1)
+        return synthetic_ad_page(ad_id)
+
+    def search_page(self, city, page_number):
+
+        options = self.options
+        host = 'http://%s'%self.headers['Host']
+        first_ad_id = FIRST_AD_ID + zlib.crc32(city.encode('utf-8')) % 1000 * 1000000 + (page_number - 1) * options.ads_per_page
+        ad_ids = range(first_ad_id, first_ad_id + options.ads_per_page)
+
+        ads = ''.join('<li><a href="/v-apartments-condos/%s/apartment-%s/%s">Apartment</a><a href="/v-apartments-condos/%s/apartment-%s/%s?imageNumber=1">Image</a></li>'%(city, i, i, city, i, i) for i in ad_ids)
+        pagination = ''.join('<li data-testid="pagination-list-item"><a href="%s/b-for-rent/%s/page-%s/c30349001l1700185">%s</a></li>'%(host, city, n, n) for n in range(1, options.pages + 1))
+        if page_number < options.pages:
+            pagination += '<li data-testid="pagination-next-link"><a href="%s/b-for-rent/%s/page-%s/c30349001l1700185">Next</a></li>'%(host, city, page_number + 1)
+
+        listings = {}
+        for i in ad_ids:
+            r = random.Random(i)
+            listings['RealEstateListing:%s'%i] = {'__typename': 'RealEstateListing', 'id': str(i), 'title': 'Apartment #%s'%i,
+                                                  'url': '%s/v-apartments-condos/%s/apartment-%s/%s'%(host, city, i, i),
+                                                  'description': 'Lovely unit, close to everything.', 'activationDate': '2023-10-30T14:02:11.000Z',
+                                                  'price': {'amount': r.randint(900, 3500) * 100}, 'location': {'address': '%s Bank St, Ottawa, ON'%r.randint(1, 999)},
+                                                  'posterInfo': {'posterId': str(1000 + i % 97)}}
+        next_data = json.dumps({'props': {'pageProps': {'__APOLLO_STATE__': listings}}})
+
+        return ('<!DOCTYPE html><html lang="en"><head><title>Rentals</title></head><body>'
+                '<ul data-testid="srp-search-list"><li><a href="/v-apartments-condos/ottawa/featured/1500000000">Featured</a></li></ul>'
+                '<ul data-testid="srp-search-list">%s</ul><nav><ul>%s</ul></nav>'
+                '<script id="__NEXT_DATA__" type="application/json">%s</script></body></html>')%(ads, pagination, next_data)
+
+
+def make_server(options, host='127.0.0.1'):
+
+    recorded = []
+    if options.recorded is not None:
+        recorded = [ open(f, encoding='utf-8').read() for f in sorted(glob.glob(os.path.join(options.recorded, '*.html'))) ]
+    handler = type('Handler', (KijijiHandler,), {'options': options, 'stats': ServerStats(), 'recorded': recorded})
+    server = ThreadingHTTPServer((host, options.port), handler)
+    server.daemon_threads = True
+    return server, handler.stats
+
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+    server, stats = make_server(args)
+    print("Serving on http://127.0.0.1:%s/"%server.server_address[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
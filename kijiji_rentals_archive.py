@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Compressed archive of the raw search and ad pages fetched by kijiji_rentals_scraper.py,
+    so ad info can be re-extracted offline (--from_archive) after a change to the extraction
+    without crawling kijiji again.
+
+    The archive is a folder with:
+        pages.pack: append-only file of compressed pages (zstd if zstandard is installed, otherwise zlib)
+        index.jsonl: one line per fetched page with its url, kind ("search" or "ad"), status,
+                     fetch time, sha256 of the raw content and where its bytes are in pages.pack
+
+    Pages are content-addressed, identical content is only stored once.
+
+@author: eric
+"""
+
+import os
+import json
+import zlib
+import hashlib
+import datetime
+import threading
+from collections import namedtuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+ArchivedPage = namedtuple('ArchivedPage', ['url', 'kind', 'status', 'fetched', 'content'])
+
+
+def compress(content):
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=3).compress(content)
+    return 'zlib', zlib.compress(content, 6)
+
+def decompress(codec, data):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError("zstandard is needed to read pages archived with zstd")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+class PageArchive:
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.pack_path = os.path.join(folder, 'pages.pack')
+        self.index_path = os.path.join(folder, 'index.jsonl')
+        self.lock = threading.Lock()
+        self.stored = {}
+        self.pack = None
+        self.index = None
+
+        # Content already stored, by sha256
+        for entry in self.iter_index():
+            self.stored[entry['sha']] = entry
+
+    def iter_index(self):
+
+        if not os.path.isfile(self.index_path):
+            return
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                # Last line may be incomplete if the process died while appending
+                if not line.endswith('\n'):
+                    break
+                yield json.loads(line)
+
+    def open(self):
+        os.makedirs(self.folder, exist_ok=True)
+        self.pack = open(self.pack_path, 'ab')
+        self.index = open(self.index_path, 'a', encoding='utf-8')
+
+    def add(self, url, kind, content, status=200, fetched=None):
+
+        sha = hashlib.sha256(content).hexdigest()
+        entry = {'url': url, 'kind': kind, 'status': status,
+                 'fetched': fetched or datetime.datetime.now(tz=datetime.timezone.utc).isoformat(), 'sha': sha}
+
+        # Compress outside the lock so fetch threads do not wait on each other
+        data = None
+        if sha not in self.stored:
+            codec, data = compress(content)
+
+        with self.lock:
+            if self.pack is None:
+                self.open()
+            if sha in self.stored:
+                stored = self.stored[sha]
+                entry.update(codec=stored['codec'], offset=stored['offset'], length=stored['length'])
+            else:
+                if data is None:
+                    codec, data = compress(content)
+                self.pack.seek(0, os.SEEK_END)
+                entry.update(codec=codec, offset=self.pack.tell(), length=len(data))
+                self.pack.write(data)
+                self.pack.flush()
+                self.stored[sha] = entry
+            # Index line is written after the page bytes so it never points to missing data
+            self.index.write(json.dumps(entry) + '\n')
+            self.index.flush()
+
+    def iter_pages(self, kind=None, status=200):
+
+        if not os.path.isfile(self.pack_path):
+            return
+        with open(self.pack_path, 'rb') as pack:
+            for entry in self.iter_index():
+                if (kind is not None and entry['kind'] != kind) or (status is not None and entry['status'] != status):
+                    continue
+                pack.seek(entry['offset'])
+                content = decompress(entry['codec'], pack.read(entry['length']))
+                yield ArchivedPage(entry['url'], entry['kind'], entry['status'], entry['fetched'], content)
+
+    def close(self):
+        with self.lock:
+            if self.pack is not None:
+                self.pack.close()
+                self.index.close()
+                self.pack = None
+                self.index = None
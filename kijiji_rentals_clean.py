@@ -11,93 +11,36 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import argparse
+from kijiji_rentals_io import read_table, read_columns, write_table
+from kijiji_rentals_schema import my_dtypes, compact_dtypes, read_dtypes, apply_dtypes, print_memory_report
 
 
 describe_help = 'python kijiji_rentals_clean.py --input_file ads_processed.csv --output_file ads_cleaned.csv'
 parser = argparse.ArgumentParser(description=describe_help)
 # User defined options
-parser.add_argument('-i', '--input_file', help='File (.csv) of processed ads to be clean', type=str, default="ads_processed.csv")
-parser.add_argument('-o', '--output_file', help='File (.csv) output', type=str, default='')
-args = parser.parse_args()
+parser.add_argument('-i', '--input_file', help='File (.csv, .parquet or .feather) of processed ads to be clean', type=str, default="ads_processed.csv")
+parser.add_argument('-o', '--output_file', help='File (.csv, .parquet or .feather) output, same format as the input file by default', type=str, default='')
+parser.add_argument('--memory_report', help='Print the memory of each column loaded with the file types and with the compact types used for cleaning', action='store_true', default=False)
+parser.add_argument('--columns', help='Columns to output (default all), only these and the ones filtered on are loaded', type=str, nargs='+', default=None)
 
-if args.output_file == '':
-    args.output_file = args.input_file.replace('_processed.csv', '').split('_')[0] + '_cleaned.csv'
+# Columns the filters below use
+filter_columns = ['Price', 'PricePerBedroom', 'UnitType', 'Agreement-Type', 'City', 'RentalCategory', 'PricePerSqFt', 'AdId', 'Poster']
 
-my_dtypes = {'Price': 'float64',
- 'Location': 'object',
- 'PostingDate': 'object',
- 'Poster': 'object',
- 'AdId': 'object',
- 'ScrapeDate': 'object',
- 'UnitType': 'object',
- 'Bedrooms': 'object',
- 'Bathrooms': 'object',
- 'Appliances-Laundry-(In-Unit)': 'boolean',
- 'Appliances-Dishwasher': 'boolean',
- 'Appliances-Fridge-/-Freezer': 'boolean',
- 'Personal-Outdoor-Space-Balcony': 'boolean',
- 'Amenities-Gym': 'boolean',
- 'Amenities-Bicycle-Parking': 'boolean',
- 'Amenities-Storage-Space': 'boolean',
- 'Amenities-Elevator-in-Building': 'boolean',
- 'Parking-Included': 'float64',
- 'Agreement-Type': 'object',
- 'Move-In-Date': 'object',
- 'Pet-Friendly': 'object',
- 'Size-(sqft)': 'float64',
- 'Furnished': 'boolean',
- 'Air-Conditioning': 'boolean',
- 'Smoking-Permitted': 'object',
- 'Utilities-Included-Hydro': 'boolean',
- 'Utilities-Included-Heat': 'boolean',
- 'Utilities-Included-Water': 'boolean',
- 'Wi-Fi-and-More-Internet': 'boolean',
- 'Wi-Fi-and-More-Cable-/-TV': 'boolean',
- 'Amenities-Pool': 'boolean',
- 'Elevator-Accessibility-Features-Wheelchair-accessible': 'boolean',
- 'Barrier-free-Entrances-and-Ramps': 'boolean',
- 'Visual-Aids': 'boolean',
- 'Accessible-Washrooms-in-Suite': 'boolean',
- 'Appliances-Laundry-(In-Building)': 'boolean',
- 'Personal-Outdoor-Space-Yard': 'boolean',
- 'Amenities-Concierge': 'boolean',
- 'Amenities-24-Hour-Security': 'boolean',
- 'More-Info': 'object',
- 'Elevator-Accessibility-Features-Braille-Labels': 'boolean',
- 'City': 'object',
- 'RentalCategory': 'object',
- 'Commercial': 'boolean',
- 'Residential': 'boolean',
- 'PostingDateDaysInAdvance': 'float64',
- 'Preference-Male': 'bool',
- 'Preference-Female': 'bool',
- 'Male': 'bool',
- 'Female': 'bool',
- 'Sublet': 'bool',
- 'Students': 'bool',
- 'Preference-Any': 'bool',
- 'NumberBedrooms': 'float64',
- 'NumberBathrooms': 'float64',
- 'PricePerBedroom': 'float64',
- 'PricePerSqFt': 'float64',
- 'Elevator-Accessibility-Features-Audio-Prompts': 'boolean'}
 
+def price_ceiling(prices):
+    # Prices above the 99th percentile are extremes (unless below 10000)
+    return max(pd.Series(prices).quantile(q=0.99), 10000)
 
-if __name__ == '__main__':
-    
 
-    # Load data file
-    if os.path.isfile(args.input_file):
-        print("Loading file %s..."%args.input_file)
-        df_raw = pd.read_csv(args.input_file, dtype=my_dtypes)
-        df = df_raw.copy()
-    else:
-        print("%s could not be found..."%args.input_file)
-        exit()
-        
+def clean_ads(df, max_price=None):
+    
+    # Columns filtered on that no ad has (e.g. attributes not found yet) are missing values, with the types ads are held in
+    df = df.assign(**{ c: pd.Series(index=df.index, dtype=compact_dtypes.get(c, 'object')) for c in filter_columns if c not in df.columns })
     
-    # Filter out extremes and missing prices
-    df = df[df['Price'] <= max(df['Price'].quantile(q=0.99), 10000)]
+    # Filter out extremes and missing prices, max_price defaults to the ceiling of the prices in df
+    if max_price is None:
+        max_price = price_ceiling(df['Price'])
+    df = df[df['Price'] <= max_price]
     df = df.dropna(subset=['Price'])
     df = df.dropna(subset=['PricePerBedroom'])
     df = df[~np.isinf(df['PricePerBedroom'])]
@@ -119,5 +62,40 @@ if __name__ == '__main__':
     df = df.drop_duplicates(subset=['AdId', 'Poster', 'City', 'Price'], keep='first')
     df = df.reset_index(drop=True)
     
+    return df
+
+
+if __name__ == '__main__':
+    
+    args = parser.parse_args()
+    
+    if args.output_file == '':
+        root, extension = os.path.splitext(args.input_file)
+        args.output_file = root.replace('_processed', '').split('_')[0] + '_cleaned' + extension
+
+    # Load data file
+    if os.path.isfile(args.input_file):
+        print("Loading file %s..."%args.input_file)
+        # Held with compact types (categoricals, float32), .csv are parsed with them directly
+        columns = None
+        if args.columns is not None:
+            # Columns filtered on that the file does not have are added back as missing values
+            available = read_columns(args.input_file)
+            columns = list(dict.fromkeys(args.columns + [ c for c in filter_columns if c in available ]))
+        if args.memory_report:
+            df = read_table(args.input_file, columns=columns, dtype=my_dtypes)
+            df_compact, _ = apply_dtypes(df.copy(), compact_dtypes)
+            print_memory_report(df, df_compact, 'of loaded ads')
+            df = df_compact
+        else:
+            df = read_table(args.input_file, columns=columns, dtype=read_dtypes(compact_dtypes))
+            df, _ = apply_dtypes(df, compact_dtypes)
+    else:
+        print("%s could not be found..."%args.input_file)
+        exit()
+        
+    
+    df = clean_ads(df)
+    
     print("Writing to file...")
-    df.to_csv(args.output_file, sep=',', header=True, index=False)
\ No newline at end of file
+    write_table(df, args.output_file, columns=args.columns)
\ No newline at end of file
@@ -0,0 +1,500 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Extracts the info of a single kijiji ad page into a record (dict of column: value)
+    for kijiji_rentals_scraper.py.
+
+    Backends:
+        "bs4": BeautifulSoup with html.parser, the original extraction logic
+        "lxml": lxml.html with precompiled XPath queries, same fields several times faster
+
+    ParserPool runs the extraction in worker processes, separate from the network fetches.
+
+    Search results pages also embed their listings as JSON (extract_search_json), which can
+    fill most columns without fetching each ad page.
+
+    Class names on kijiji pages have generated suffixes (e.g. "title-4206718449"), elements
+    are matched on the class prefix with regex (bs4) or contains(@class, ...) (lxml).
+
+@author: eric
+"""
+
+import datetime
+import json
+import re
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, CancelledError
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from bs4 import BeautifulSoup
+from lxml import etree, html
+
+
+BACKENDS = ['bs4', 'lxml']
+
+
+def extract_ad_info(content, ad_url, home_url, scrape_date, backend='bs4', fetched=None):
+
+    if backend == 'lxml':
+        return extract_ad_info_lxml(content, ad_url, home_url, scrape_date, fetched)
+    return extract_ad_info_bs4(content, ad_url, home_url, scrape_date, fetched)
+
+def extract_number(text):
+
+    number = re.search(r'(\d+)', text)
+    if number is None:
+        return np.nan
+    return number.group(1)
+
+def fallback_posting_date(fetched=None):
+    # Ads without a posting date are dated when their page was fetched (ISO time), now if unknown
+    if fetched is None:
+        date = datetime.datetime.now(tz=datetime.timezone.utc)
+    else:
+        date = datetime.datetime.fromisoformat(fetched).astimezone(datetime.timezone.utc)
+    return date.strftime("%Y-%m-%dT%H:%M:%S.%zZ").replace('+0', '')
+
+def extract_ad_info_bs4(content, ad_url, home_url, scrape_date, fetched=None):
+
+    try:
+        ad_soup = BeautifulSoup(content, "html.parser")
+    except Exception as e:
+        print(e)
+        print("Unable to get: %s...\n"%ad_url)
+        return None
+
+    try:
+        title = '_'.join(np.unique(ad_soup.find_all('h1', re.compile("title*"))))
+        price = '_'.join(np.unique(ad_soup.find_all('span', re.compile("currentPrice*"))))
+        location = '_'.join(np.unique(ad_soup.find_all('span', re.compile("address"))))
+        ad_id = '_'.join(np.unique(ad_soup.find_all('a', re.compile("adId*"))))
+        try:
+            ad_post_date = ad_soup.find('div', re.compile("datePosted*")).time["datetime"]
+        except:
+            ad_post_date = fallback_posting_date(fetched)
+        ad_poster_profile = home_url[:-1] + ad_soup.find('a', re.compile("avatarLink*"))["href"]
+
+        descriptions = ad_soup.find_all('p')
+        description = ''
+        for d in descriptions[:-1]:
+            description = description + "\n" + d.get_text()
+
+        # Add listing info to record
+        ad_info = {}
+        ad_info["Title"] = title
+        ad_info["Price"] = price
+        ad_info["Location"] = location
+        ad_info["Description"] = description
+        ad_info["PostingDate"] = ad_post_date
+        ad_info["Poster"] = ad_poster_profile
+        ad_info["AdURL"] = ad_url
+        ad_info['AdId'] = ad_id
+        ad_info["ScrapeDate"] = scrape_date
+    except Exception as e:
+        print(e)
+        print("Unable to parse data from: %s...\n"%ad_url)
+        return None
+
+    try:
+        title_attributes = ad_soup.find('div', re.compile("titleAttributes*"))
+        if title_attributes != None:
+            title_details = title_attributes.find_all('li')
+            for detail in title_details:
+                if 'unittype' in detail.find('use')['xlink:href']:
+                    ad_info["UnitType"] = detail.get_text()
+                elif 'numberbedrooms' in detail.find('use')['xlink:href']:
+                    ad_info["Bedrooms"] = extract_number(detail.get_text()) # detail.get_text().split()[-1]
+                elif 'numberbathrooms' in detail.find('use')['xlink:href']:
+                    ad_info["Bathrooms"] = extract_number(detail.get_text()) # detail.get_text().split()[-1]
+                elif 'furnished' in detail.find('use')['xlink:href']:
+                    ad_info["Furnished"] = detail.get_text().split()[-1]
+                elif 'petsallowed' in detail.find('use')['xlink:href']:
+                    ad_info["PetFriendly"] = detail.get_text().split()[-1]
+        else:
+            title_attributes = ad_soup.find('div', re.compile("attributeList*"))
+            if title_attributes != None:
+                title_details = title_attributes.find_all('ul')
+                for detail_list in title_details:
+                    details = detail_list.find_all('li')
+                    for detail in details:
+                        ad_info['-'.join(detail.find('dt').get_text().split())] = detail.find('dd').get_text()
+
+    except Exception as e:
+        print(e)
+        print("Unable to get unit details from: %s...\n"%ad_url)
+
+    try:
+        ad_attributes = {}
+
+        # Get rental attributes if ad has attribute cards
+        attribute_groups = ad_soup.find_all('li', re.compile("attributeGroupContainer*"))
+        for attributes in attribute_groups:
+            attribute = attributes.find('div')
+            attribute_type = attribute.find('h4').get_text().replace(' ', '-')
+
+            for a in attribute.find_all('li'):
+                if a.get_text() != '':
+                    if a.find('use') == None:
+                        ad_attributes[attribute_type + '-' + a.get_text().replace(' ', '-')] = 'Yes'
+                    elif a.find('use') != None:
+                        if 'yes' in a.find('use')['xlink:href']:
+                            ad_attributes[attribute_type + '-' + a.get_text().replace(' ', '-')] = 'Yes'
+                        elif 'no' in a.find('use')['xlink:href']:
+                            ad_attributes[attribute_type + '-' + a.get_text().replace(' ', '-')] = 'No'
+
+        # Repeat for rental attributes with two-line attributes
+        attribute_twolines = ad_soup.find_all('li', re.compile("twoLinesAttribute*"))
+        for attribute in attribute_twolines:
+            attribute_type = attribute.find("dt").get_text().replace(' ', '-')
+            attribute_details = attribute.find("dd").get_text().replace(' ', '-')
+            ad_attributes[ attribute_type ] = attribute_details
+
+        # Add listing features to record
+        ad_info.update(ad_attributes)
+    except Exception as e:
+        print(e)
+        print("Unable to get ad features for: %s...\n"%ad_url)
+
+    return ad_info
+
+
+def class_xpath(tag, class_prefix):
+    return etree.XPath(".//%s[contains(@class, '%s')]"%(tag, class_prefix))
+
+# Same elements as the bs4 regex class patterns, e.g. re.compile("title*") matches "titl" followed by any "e"
+LXML_TITLE = class_xpath('h1', 'titl')
+LXML_PRICE = class_xpath('span', 'currentPric')
+LXML_LOCATION = class_xpath('span', 'address')
+LXML_AD_ID = class_xpath('a', 'adI')
+LXML_DATE_POSTED = class_xpath('div', 'datePoste')
+LXML_POSTER = class_xpath('a', 'avatarLin')
+LXML_TITLE_ATTRIBUTES = class_xpath('div', 'titleAttribute')
+LXML_ATTRIBUTE_LIST = class_xpath('div', 'attributeLis')
+LXML_ATTRIBUTE_GROUPS = class_xpath('li', 'attributeGroupContaine')
+LXML_TWO_LINES = class_xpath('li', 'twoLinesAttribut')
+LXML_TEXT_NODES = etree.XPath('.//text()')
+
+def lxml_text(element):
+    return etree.tostring(element, method='text', encoding='unicode', with_tail=False)
+
+def lxml_joined_text(elements):
+
+    # Unique text nodes of the elements joined with '_', as np.unique does over bs4 tags
+    texts = set()
+    for element in elements:
+        texts.update(str(t) for t in LXML_TEXT_NODES(element))
+    return '_'.join(sorted(texts))
+
+def lxml_first(elements):
+    return elements[0] if len(elements) > 0 else None
+
+def lxml_use_href(element):
+    return element.find('.//use').attrib['xlink:href']
+
+def extract_ad_info_lxml(content, ad_url, home_url, scrape_date, fetched=None):
+
+    try:
+        ad_tree = html.fromstring(content)
+    except Exception as e:
+        print(e)
+        print("Unable to get: %s...\n"%ad_url)
+        return None
+
+    try:
+        title = lxml_joined_text(LXML_TITLE(ad_tree))
+        price = lxml_joined_text(LXML_PRICE(ad_tree))
+        location = lxml_joined_text(LXML_LOCATION(ad_tree))
+        ad_id = lxml_joined_text(LXML_AD_ID(ad_tree))
+        try:
+            ad_post_date = lxml_first(LXML_DATE_POSTED(ad_tree)).find('.//time').attrib["datetime"]
+        except:
+            ad_post_date = fallback_posting_date(fetched)
+        ad_poster_profile = home_url[:-1] + lxml_first(LXML_POSTER(ad_tree)).attrib["href"]
+
+        descriptions = ad_tree.findall('.//p')
+        description = ''
+        for d in descriptions[:-1]:
+            description = description + "\n" + lxml_text(d)
+
+        # Add listing info to record
+        ad_info = {}
+        ad_info["Title"] = title
+        ad_info["Price"] = price
+        ad_info["Location"] = location
+        ad_info["Description"] = description
+        ad_info["PostingDate"] = ad_post_date
+        ad_info["Poster"] = ad_poster_profile
+        ad_info["AdURL"] = ad_url
+        ad_info['AdId'] = ad_id
+        ad_info["ScrapeDate"] = scrape_date
+    except Exception as e:
+        print(e)
+        print("Unable to parse data from: %s...\n"%ad_url)
+        return None
+
+    try:
+        title_attributes = lxml_first(LXML_TITLE_ATTRIBUTES(ad_tree))
+        if title_attributes is not None:
+            for detail in title_attributes.iterfind('.//li'):
+                use_href = lxml_use_href(detail)
+                if 'unittype' in use_href:
+                    ad_info["UnitType"] = lxml_text(detail)
+                elif 'numberbedrooms' in use_href:
+                    ad_info["Bedrooms"] = extract_number(lxml_text(detail))
+                elif 'numberbathrooms' in use_href:
+                    ad_info["Bathrooms"] = extract_number(lxml_text(detail))
+                elif 'furnished' in use_href:
+                    ad_info["Furnished"] = lxml_text(detail).split()[-1]
+                elif 'petsallowed' in use_href:
+                    ad_info["PetFriendly"] = lxml_text(detail).split()[-1]
+        else:
+            title_attributes = lxml_first(LXML_ATTRIBUTE_LIST(ad_tree))
+            if title_attributes is not None:
+                for detail_list in title_attributes.iterfind('.//ul'):
+                    for detail in detail_list.iterfind('.//li'):
+                        ad_info['-'.join(lxml_text(detail.find('.//dt')).split())] = lxml_text(detail.find('.//dd'))
+
+    except Exception as e:
+        print(e)
+        print("Unable to get unit details from: %s...\n"%ad_url)
+
+    try:
+        ad_attributes = {}
+
+        # Get rental attributes if ad has attribute cards
+        for attributes in LXML_ATTRIBUTE_GROUPS(ad_tree):
+            attribute = attributes.find('.//div')
+            attribute_type = lxml_text(attribute.find('.//h4')).replace(' ', '-')
+
+            for a in attribute.iterfind('.//li'):
+                a_text = lxml_text(a)
+                if a_text != '':
+                    if a.find('.//use') is None:
+                        ad_attributes[attribute_type + '-' + a_text.replace(' ', '-')] = 'Yes'
+                    elif 'yes' in lxml_use_href(a):
+                        ad_attributes[attribute_type + '-' + a_text.replace(' ', '-')] = 'Yes'
+                    elif 'no' in lxml_use_href(a):
+                        ad_attributes[attribute_type + '-' + a_text.replace(' ', '-')] = 'No'
+
+        # Repeat for rental attributes with two-line attributes
+        for attribute in LXML_TWO_LINES(ad_tree):
+            attribute_type = lxml_text(attribute.find('.//dt')).replace(' ', '-')
+            attribute_details = lxml_text(attribute.find('.//dd')).replace(' ', '-')
+            ad_attributes[ attribute_type ] = attribute_details
+
+        # Add listing features to record
+        ad_info.update(ad_attributes)
+    except Exception as e:
+        print(e)
+        print("Unable to get ad features for: %s...\n"%ad_url)
+
+    return ad_info
+
+
+NEXT_DATA = re.compile(rb'<script[^>]*id="__NEXT_DATA__"[^>]*>(.*?)</script>', re.DOTALL)
+
+# Listing attributes with a dedicated column, other attributes are saved as "Attribute-Name" columns
+JSON_ATTRIBUTE_COLUMNS = {'unittype': 'UnitType', 'numberbedrooms': 'Bedrooms', 'numberbathrooms': 'Bathrooms'}
+
+def ad_id_from_url(ad_url):
+
+    # Ad urls end with the ad id, e.g. /v-apartments-condos/ottawa/bright-2-bedroom/1667391234
+    url_id = ad_url.split('?')[0].rstrip('/').split('/')[-1]
+    if url_id.isdigit():
+        return url_id
+    return None
+
+def iter_json_listings(data):
+
+    # Listings can be nested anywhere in the page state, they all have an id, url and title
+    if isinstance(data, dict):
+        if 'id' in data and 'url' in data and 'title' in data:
+            yield data
+        else:
+            for value in data.values():
+                yield from iter_json_listings(value)
+    elif isinstance(data, list):
+        for value in data:
+            yield from iter_json_listings(value)
+
+def json_listing_record(listing, home_url, scrape_date):
+
+    ad_info = {}
+    ad_info["Title"] = listing['title']
+
+    price = listing.get('price')
+    if isinstance(price, dict) and isinstance(price.get('amount'), (int, float)):
+        # Amounts are in cents, formatted like the price shown on ad pages
+        ad_info["Price"] = '$' + format(price['amount'] / 100, ',.2f')
+
+    location = listing.get('location')
+    if isinstance(location, dict) and location.get('address'):
+        ad_info["Location"] = location['address']
+
+    if listing.get('description'):
+        ad_info["Description"] = '\n' + listing['description']
+
+    if listing.get('activationDate'):
+        ad_info["PostingDate"] = listing['activationDate']
+
+    poster = listing.get('posterInfo')
+    if isinstance(poster, dict) and (poster.get('profileUrl') or poster.get('url')):
+        poster_url = poster.get('profileUrl') or poster.get('url')
+        ad_info["Poster"] = poster_url if poster_url.startswith('http') else home_url[:-1] + poster_url
+    elif isinstance(poster, dict) and (poster.get('posterId') or poster.get('sellerId')):
+        # Same profile URL as the avatar link of the ad page
+        ad_info["Poster"] = home_url + 'o-profile/%s/listings/1'%(poster.get('posterId') or poster.get('sellerId'))
+
+    ad_url = listing['url']
+    ad_info["AdURL"] = ad_url if ad_url.startswith('http') else home_url[:-1] + ad_url
+    ad_info['AdId'] = str(listing['id'])
+    ad_info["ScrapeDate"] = scrape_date
+
+    attributes = listing.get('attributes')
+    if isinstance(attributes, dict):
+        attributes = attributes.get('all')
+    for attribute in attributes or []:
+        name = attribute.get('name') or attribute.get('canonicalName')
+        values = attribute.get('values') or attribute.get('canonicalValues') or []
+        if not name or len(values) == 0:
+            continue
+        value = ' '.join(str(v) for v in values)
+        column = JSON_ATTRIBUTE_COLUMNS.get(attribute.get('canonicalName'))
+        if column in ['Bedrooms', 'Bathrooms']:
+            ad_info[column] = extract_number(value)
+        elif column is not None:
+            ad_info[column] = value
+        else:
+            ad_info['-'.join(name.split())] = value.replace(' ', '-')
+
+    return ad_info
+
+def extract_search_json(content, home_url, scrape_date):
+    '''
+    Records of the listings embedded as JSON (__NEXT_DATA__) in a search results page,
+    keyed by ad id. Fields not in the page data are missing from the records.
+    '''
+
+    records = {}
+    next_data = NEXT_DATA.search(content)
+    if next_data is None:
+        return records
+    try:
+        data = json.loads(next_data.group(1))
+    except ValueError:
+        return records
+
+    for listing in iter_json_listings(data):
+        try:
+            ad_info = json_listing_record(listing, home_url, scrape_date)
+        except Exception as e:
+            print(e)
+            print("Unable to parse listing data for ad %s...\n"%listing.get('id'))
+            continue
+        records[ad_info['AdId']] = ad_info
+
+    return records
+
+def has_fields(ad_info, fields):
+    return ad_info is not None and all(isinstance(ad_info.get(f), str) and ad_info.get(f) != '' for f in fields)
+
+
+class ParserPool:
+    '''
+    Parses ad pages in worker processes so parsing is not limited to the core doing the fetching.
+    
+    Raw page content is sent to the workers and records come back in the same order.
+    At most max_pending pages are parsed or waiting at once (backpressure on the fetchers).
+    If a worker process dies the pool is restarted and each affected page is retried once
+    in a process of its own, a page that kills that process too is skipped.
+    
+    The pool can be shared by several threads: a broken pool is only replaced once (by the
+    first thread finding it broken), pages of other threads lost with it are retried the same way.
+    '''
+
+    def __init__(self, workers, backend='bs4', max_pending=None, parse_function=extract_ad_info):
+        self.workers = workers
+        self.backend = backend
+        self.max_pending = max_pending or 2 * workers
+        self.parse_function = parse_function
+        self.executor = None
+        self.lock = threading.Lock()
+        self.start()
+
+    def start(self):
+        # Workers only need this module, spawn avoids forking a process that is running threads
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def restart(self, executor):
+        # Only if executor was not replaced already
+        with self.lock:
+            if self.executor is executor:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.start()
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def parse_alone(self, content, ad_url, home_url, scrape_date, fetched=None):
+        # In a process of its own, a crash can only come from this page
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            return executor.submit(self.parse_function, content, ad_url, home_url, scrape_date, backend=self.backend, fetched=fetched).result()
+
+    def submit(self, content, ad_url, home_url, scrape_date, fetched=None):
+
+        # (future, executor it was sent to)
+        with self.lock:
+            executor = self.executor
+        try:
+            return executor.submit(self.parse_function, content, ad_url, home_url, scrape_date, backend=self.backend, fetched=fetched), executor
+        except (BrokenProcessPool, RuntimeError):
+            # Broken or shut down by another thread meanwhile
+            self.restart(executor)
+            with self.lock:
+                executor = self.executor
+            return executor.submit(self.parse_function, content, ad_url, home_url, scrape_date, backend=self.backend, fetched=fetched), executor
+
+    def result(self, job):
+
+        # None for a page that was not fetched
+        if job is None:
+            return None
+        future, executor, content, ad_url, home_url, scrape_date, fetched = job
+        try:
+            return future.result()
+        except (BrokenProcessPool, CancelledError):
+            print("Parser process crashed, retrying: %s...\n"%ad_url)
+        except Exception as e:
+            print(e)
+            print("Unable to parse data from: %s...\n"%ad_url)
+            return None
+
+        # Retry the page alone to find out if it is the page crashing the parser
+        self.restart(executor)
+        try:
+            return self.parse_alone(content, ad_url, home_url, scrape_date, fetched)
+        except BrokenProcessPool:
+            print("Parser process crashed again, skipping: %s...\n"%ad_url)
+        except Exception as e:
+            print(e)
+            print("Unable to parse data from: %s...\n"%ad_url)
+        return None
+
+    def parse(self, ad_urls, ad_pages, home_url, scrape_date):
+
+        # Pages not fetched (None) are queued too so results keep the order of ad_urls
+        pending = deque()
+        for ad_url, ad_page in zip(ad_urls, ad_pages):
+            if ad_page is None:
+                pending.append(None)
+            else:
+                fetched = getattr(ad_page, 'fetched', None)
+                future, executor = self.submit(ad_page.content, ad_url, home_url, scrape_date, fetched)
+                pending.append((future, executor, ad_page.content, ad_url, home_url, scrape_date, fetched))
+            while len(pending) >= self.max_pending:
+                yield self.result(pending.popleft())
+        while len(pending) > 0:
+            yield self.result(pending.popleft())
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Geocoding of ad locations for kijiji_rentals_process.py (--lat_long) with an on-disk cache.
+
+    Locations are normalized (case, spacing) so the same address is only geocoded once,
+    and each distinct location is looked up in a SQLite cache (e.g. geocodes.sqlite)
+    before querying Nominatim. Every query made is cached, including the ones that found
+    nothing and the default city/country fallback, so repeat runs make no requests and
+    first runs scale with the number of distinct locations instead of ads.
+    
+    Locations can first be resolved offline with a gazetteer file of postal codes, FSAs
+    (first 3 characters of a postal code) and place names with their coordinates, only
+    locations it cannot resolve are geocoded with Nominatim. Accepted files are a GeoNames
+    postal code dump (e.g. CA.txt or CA_full.txt, tab separated) or a .csv with columns
+    key, latitude, longitude. The file is indexed once into sorted arrays of key hashes
+    (e.g. CA.txt.keys.npy, CA.txt.coords.npy) loaded with mmap.
+
+@author: eric
+"""
+
+import os
+import re
+import sqlite3
+import datetime
+import tqdm
+import pandas as pd
+import numpy as np
+
+
+def normalize_location(location):
+
+    if not isinstance(location, str):
+        return None
+    location = re.sub(r'\s+', ' ', location.strip().lower())
+    location = re.sub(r'\s*,\s*', ', ', location).strip(', ')
+    return location if location != '' else None
+
+
+# Canadian postal code, e.g. K1P 5N2 (FSA K1P)
+POSTAL_CODE = r'([A-Z]\d[A-Z]) ?(\d[A-Z]\d)'
+
+
+def gazetteer_key(value):
+
+    # Full postal codes, FSAs and place names are kept apart in the same index
+    value = normalize_location(value)
+    if value is None:
+        return None
+    code = re.fullmatch(POSTAL_CODE, value.upper())
+    if code is not None:
+        return 'postal:' + code.group(1) + code.group(2)
+    if re.fullmatch(r'[A-Z]\d[A-Z]', value.upper()):
+        return 'fsa:' + value.upper()
+    return 'place:' + value
+
+def hash_keys(keys):
+    # 64-bit hashes, the same on every run
+    return pd.util.hash_array(pd.Series(keys, dtype=object).fillna('').to_numpy())
+
+
+class Gazetteer:
+    '''
+    Coordinates of postal codes, FSAs and place names from an offline file.
+    
+    Keys are searched as 64-bit hashes in a sorted array (binary search over the
+    whole column at once), coordinates of repeated keys are averaged (centroid).
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        keys_path = path + '.keys.npy'
+        coords_path = path + '.coords.npy'
+        if not os.path.isfile(keys_path) or os.path.getmtime(keys_path) < os.path.getmtime(path):
+            print("Indexing gazetteer %s..."%path)
+            self.build(keys_path, coords_path)
+        self.keys = np.load(keys_path, mmap_mode='r')
+        self.coords = np.load(coords_path, mmap_mode='r')
+
+    def read_source(self):
+
+        if self.path.endswith('.txt'):
+            # GeoNames: country, postal code, place name, province, province code, ..., latitude, longitude, accuracy
+            geonames = pd.read_csv(self.path, sep='\t', header=None, dtype=str, keep_default_na=False)
+            latitude = geonames[9].astype('float64')
+            longitude = geonames[10].astype('float64')
+            return pd.DataFrame({'key': pd.concat([geonames[1], geonames[2], geonames[2] + ', ' + geonames[4]], ignore_index=True),
+                                 'latitude': pd.concat([latitude] * 3, ignore_index=True),
+                                 'longitude': pd.concat([longitude] * 3, ignore_index=True)})
+        return pd.read_csv(self.path, usecols=['key', 'latitude', 'longitude'], dtype={'key': str})
+
+    def build(self, keys_path, coords_path):
+
+        source = self.read_source()
+        source['key'] = source['key'].map(gazetteer_key)
+        # Full postal codes also give their FSA when the file has no FSA rows for it
+        postal = source[source['key'].str.startswith('postal:', na=False)]
+        fsa = postal.assign(key='fsa:' + postal['key'].str[7:10])
+        fsa = fsa[~fsa['key'].isin(source['key'])]
+        source = pd.concat([source, fsa], ignore_index=True).dropna()
+
+        centroids = source.groupby('key')[['latitude', 'longitude']].mean()
+        hashes = hash_keys(centroids.index)
+        order = np.argsort(hashes)
+        for path, array in ((keys_path, hashes[order]), (coords_path, centroids.to_numpy(dtype='float32')[order])):
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, array)
+            os.replace(path + '.tmp', path)
+
+    def lookup(self, keys):
+
+        # (latitude, longitude) arrays of the keys, NaN where not in the gazetteer
+        keys = pd.Series(keys, dtype=object)
+        hashes = hash_keys(keys)
+        i = np.minimum(np.searchsorted(self.keys, hashes), max(len(self.keys) - 1, 0))
+        found = keys.notna().to_numpy() & (len(self.keys) > 0)
+        if len(self.keys) > 0:
+            found &= np.asarray(self.keys)[i] == hashes
+        coords = np.full((len(keys), 2), np.nan)
+        coords[found] = self.coords[i[found]]
+        return coords
+
+    def locate(self, locations):
+
+        # Postal code first, then its FSA, then the place name (part before the province)
+        locations = pd.Series(locations, dtype=object)
+        postal = locations.str.upper().str.extract(POSTAL_CODE)
+        parts = locations.str.split(',')
+        place = parts.str[-2].where(parts.str.len() > 1, parts.str[0]).str.strip().str.lower()
+
+        coords = self.lookup('postal:' + postal[0] + postal[1])
+        for keys in ('fsa:' + postal[0], 'place:' + place):
+            missing = np.isnan(coords[:, 0])
+            if not missing.any():
+                break
+            coords[missing] = self.lookup(keys[missing])
+        return coords
+
+
+class GeocodeCache:
+    '''
+    SQLite table of normalized location -> latitude, longitude (NULL if nothing was found).
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS geocodes (location TEXT PRIMARY KEY, latitude REAL, longitude REAL, updated TEXT)')
+        self.connection.commit()
+
+    def get_many(self, locations):
+
+        # Cached (latitude, longitude) of each location found in the cache, in batches to stay below SQLite variable limits
+        found = {}
+        locations = list(locations)
+        for i in range(0, len(locations), 500):
+            batch = locations[i:i + 500]
+            rows = self.connection.execute('SELECT location, latitude, longitude FROM geocodes WHERE location IN (%s)'%','.join('?' * len(batch)), batch)
+            for location, latitude, longitude in rows:
+                found[location] = (latitude, longitude)
+        return found
+
+    def get(self, location):
+        return self.get_many([location]).get(location)
+
+    def put(self, location, latitude, longitude):
+        self.connection.execute('INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?)',
+                                (location, latitude, longitude, datetime.datetime.now().isoformat()))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def make_geocoder(timeout=3):
+
+    # Nominatim allows 1 request/sec, errors are raised so they are not cached as "not found"
+    from geopy.geocoders import Nominatim
+    from geopy.extra.rate_limiter import RateLimiter
+    geolocator = Nominatim(user_agent="kijiji", timeout=timeout)
+    return RateLimiter(geolocator.geocode,
+                       max_retries=3,
+                       min_delay_seconds=1,
+                       error_wait_seconds=2,
+                       swallow_exceptions=False)
+
+def cached_geocode(query, cache, geocode):
+
+    # (latitude, longitude) of a normalized query, (None, None) if not found
+    cached = cache.get(query)
+    if cached is not None:
+        return cached
+    loc = geocode(query)
+    coordinates = (loc.latitude, loc.longitude) if loc is not None else (None, None)
+    cache.put(query, *coordinates)
+    return coordinates
+
+def geocode_location(location, cache, geocode, fallback=None):
+
+    # Full location, then without its last part (usually the postal code), then the default city + country
+    queries = [location]
+    if ',' in location:
+        queries.append(location.rsplit(',', 1)[0].strip())
+    if fallback is not None:
+        queries.append(fallback)
+    for query in queries:
+        coordinates = cached_geocode(query, cache, geocode)
+        if coordinates[0] is not None:
+            return coordinates
+
+    return (None, None)
+
+def geocode_locations(locations, cache, geocode=None, fallback=None):
+
+    # Coordinates of each distinct normalized location, only queries not in the cache are sent
+    locations = [ location for location in pd.unique(pd.Series(locations, dtype=object).dropna()) ]
+    coordinates = { location: c for location, c in cache.get_many(locations).items() if c[0] is not None }
+    remaining = [ location for location in locations if location not in coordinates ]
+    print("%s distinct locations, %s found in cache, %s left to geocode..."%(len(locations), len(coordinates), len(remaining)))
+
+    # Locations not found before are resolved from their cached fallbacks without requests
+    fallback = normalize_location(fallback)
+    if len(remaining) > 0 and geocode is None:
+        geocode = make_geocoder()
+    for location in tqdm.tqdm(remaining):
+        try:
+            coordinates[location] = geocode_location(location, cache, geocode, fallback)
+        except Exception as e:
+            # Not cached, retried on the next run
+            print(e)
+            print('Could not retrieve coordinates %s'%location)
+
+    return coordinates
+
+def add_coordinates(df, cache_file, fallback=None, geocode=None, gazetteer=None):
+
+    # Geocode each distinct location once and broadcast the coordinates back to every row
+    codes, locations = pd.factorize(df['Location'].map(normalize_location))
+    coordinates = {}
+    unresolved = locations
+    if gazetteer is not None:
+        coords = gazetteer.locate(locations)
+        resolved = ~np.isnan(coords[:, 0])
+        coordinates = dict(zip(locations[resolved], map(tuple, coords[resolved])))
+        unresolved = locations[~resolved]
+        print("%s of %s distinct locations found in gazetteer"%(resolved.sum(), len(locations)))
+
+    if len(unresolved) > 0:
+        cache = GeocodeCache(cache_file)
+        try:
+            coordinates.update(geocode_locations(unresolved, cache, geocode, fallback))
+        finally:
+            cache.close()
+
+    latitudes = np.array([ coordinates.get(location, (None, None))[0] for location in locations ] + [np.nan], dtype='float64')
+    longitudes = np.array([ coordinates.get(location, (None, None))[1] for location in locations ] + [np.nan], dtype='float64')
+    # Code -1 (missing location) picks the trailing NaN
+    df['Longitude'] = longitudes[codes]
+    df['Latitude'] = latitudes[codes]
+
+    return df
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Shared HTTP client used for all requests made by kijiji_rentals_scraper.py.
+
+    One long-lived requests.Session is kept for the whole run so connections to
+    kijiji.ca are pooled and reused (keep-alive) instead of paying a new TCP+TLS
+    handshake for every page. Connect, read and 5xx errors are retried with
+    exponential backoff, and gzip (and brotli, if installed) responses are
+    decompressed transparently. Responses other than 200 left after the retries raise
+    requests.HTTPError.
+    
+    Requests are paced by an AIMD rate controller shared by all threads: the number of
+    requests in flight and the request rate grow additively while responses are fast
+    and fine, and are cut multiplicatively on 429/503 responses (waiting out any
+    Retry-After) or when the median latency stays well above its baseline. Throttled requests
+    are retried by the client after the wait.
+
+@author: eric
+"""
+
+import time
+import threading
+import email.utils
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# urllib3 only decodes brotli responses when one of these packages is available
+try:
+    import brotli
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    try:
+        import brotlicffi
+        ACCEPT_ENCODING = 'gzip, deflate, br'
+    except ImportError:
+        ACCEPT_ENCODING = 'gzip, deflate'
+
+
+# Responses asking to slow down, handled by the rate controller instead of urllib3
+THROTTLE_STATUS = (429, 503)
+
+
+def retry_after_seconds(value, max_wait=300):
+
+    # Retry-After is either a number of seconds or an HTTP date
+    if value is None:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0), max_wait)
+
+
+class RateController:
+    '''
+    AIMD pacing of requests shared by all fetching threads.
+    
+    limit: number of requests allowed in flight, between 1 and max_concurrency
+    rate: requests/sec allowed to start, None while no limit was needed (or max_rate)
+    
+    Every fine response adds 1/limit to the limit and 1/(rate*latency) to the rate (about
+    one more request in flight per round of requests), a 429/503 halves both and pauses all requests for Retry-After,
+    a sustained rise of latency cuts both by a quarter.
+    Decreases happen at most once per latency period so a burst of throttled responses
+    counts as one signal.
+    
+    latency is the median of the last `samples` response times, so jitter of single responses
+    is not a signal. Its baseline is the lowest median seen, rising by `drift` per response
+    so it follows lasting changes (e.g. a slower network). Latency is a signal when a full
+    window of responses since the last decrease has its median above latency_factor times
+    the baseline.
+    '''
+
+    def __init__(self, max_concurrency, max_rate=None, latency_factor=3.0, window=10, samples=20, drift=0.01):
+        self.max_concurrency = max(max_concurrency, 1)
+        self.max_rate = max_rate
+        self.latency_factor = latency_factor
+        self.window = window
+        self.drift = drift
+        self.limit = float(self.max_concurrency)
+        self.rate = max_rate
+        self.in_flight = 0
+        self.next_start = 0
+        self.paused_until = 0
+        self.last_decrease = 0
+        self.latency = None
+        self.base_latency = None
+        self.latencies = deque(maxlen=max(samples, 1))
+        self.completed = deque()
+        self.throttled = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                wait = max(self.paused_until, self.next_start if self.rate is not None else 0) - now
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    break
+                self.condition.wait(timeout=wait if wait > 0 else None)
+            self.in_flight += 1
+            if self.rate is not None:
+                self.next_start = max(now, self.next_start) + 1 / self.rate
+        return now
+
+    def release(self, started, status=None, retry_after=None):
+
+        with self.condition:
+            now = time.monotonic()
+            self.in_flight -= 1
+            self.completed.append(now)
+            while self.completed[0] < now - self.window:
+                self.completed.popleft()
+
+            if status in THROTTLE_STATUS:
+                self.throttled += 1
+                if retry_after is not None:
+                    self.paused_until = max(self.paused_until, now + retry_after)
+                self.decrease(now, 0.5)
+            elif status is not None:
+                self.latencies.append(now - started)
+                self.latency = sorted(self.latencies)[len(self.latencies) // 2]
+                # Only a full window is compared to the baseline before this window, then the baseline follows it
+                congested = False
+                if len(self.latencies) == self.latencies.maxlen:
+                    congested = self.base_latency is not None and self.latency > self.latency_factor * self.base_latency
+                    self.base_latency = self.latency if self.base_latency is None else min(self.base_latency * (1 + self.drift), self.latency)
+                if congested:
+                    self.decrease(now, 0.75)
+                    # Next signal from responses at the lowered rate only
+                    self.latencies.clear()
+                else:
+                    self.increase()
+            self.condition.notify_all()
+
+    def decrease(self, now, factor):
+
+        # Once per latency period, responses already in flight reflect the old rate
+        if now - self.last_decrease < (self.latency or 1):
+            return
+        self.last_decrease = now
+        self.limit = max(self.limit * factor, 1)
+        # Cut from the rate actually reached if it is below the allowed rate
+        rates = [ rate for rate in (self.rate, self.measured_rate(now)) if rate ]
+        self.rate = max(min(rates, default=1) * factor, 0.1)
+
+    def increase(self):
+
+        self.limit = min(self.limit + 1 / self.limit, self.max_concurrency)
+        if self.rate is not None:
+            # One more request per latency period, as many more in flight as with the limit
+            self.rate += 1 / (self.rate * max(self.latency or 1, 0.01))
+            # Back to unpaced once the rate is no longer what limits the requests
+            if self.max_rate is not None:
+                self.rate = min(self.rate, self.max_rate)
+            elif self.rate > 2 * self.measured_rate(time.monotonic()) + 1:
+                self.rate = None
+
+    def measured_rate(self, now):
+        if len(self.completed) < 2:
+            return 0
+        return len(self.completed) / max(min(self.window, now - self.completed[0]), 1e-3)
+
+    def snapshot(self):
+        with self.condition:
+            return {'rate': self.measured_rate(time.monotonic()), 'rate_limit': self.rate, 'concurrency': int(self.limit),
+                    'in_flight': self.in_flight, 'latency': self.latency, 'throttled': self.throttled}
+
+
+class KijijiClient:
+
+    def __init__(self, pool_size=10, retries=3, backoff_factor=0.5, connect_timeout=10, read_timeout=120, max_rate=None):
+
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.controller = RateController(pool_size, max_rate=max_rate)
+
+        retry = Retry(total=retries,
+                      connect=retries,
+                      read=retries,
+                      status=retries,
+                      backoff_factor=backoff_factor,
+                      status_forcelist=(500, 502, 504),
+                      allowed_methods=frozenset(['GET', 'HEAD']),
+                      respect_retry_after_header=False,
+                      raise_on_status=False)
+        # pool_maxsize is the number of connections kept open per host, should be >= number of workers
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry, pool_block=True)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Accept-Encoding': ACCEPT_ENCODING})
+
+    def get(self, url, **kwargs):
+
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(self.retries + 1):
+            started = self.controller.acquire()
+            try:
+                response = self.session.get(url, **kwargs)
+            except Exception:
+                self.controller.release(started)
+                raise
+            self.controller.release(started, response.status_code, retry_after_seconds(response.headers.get('Retry-After')))
+            # Throttled requests are sent again once the controller allows it
+            if response.status_code not in THROTTLE_STATUS:
+                break
+
+        # Error pages (still throttled or 5xx after all retries, 404...) are never parsed as pages
+        if response.status_code != 200:
+            raise requests.HTTPError("%s response for %s"%(response.status_code, url), response=response)
+        return response
+
+    def rate(self):
+        return self.controller.snapshot()
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Reading/writing the ad tables handed between kijiji_rentals_scraper.py,
+    kijiji_rentals_process.py and kijiji_rentals_clean.py, the format is chosen by the
+    file extension:
+        .csv: text, types are inferred again by every reader
+        .parquet: columnar, compressed, types stored in the file (needs pyarrow)
+        .feather/.arrow: Arrow IPC file, the fastest to load (needs pyarrow)
+
+    Columnar files keep datetimes, booleans and numbers as written and only the columns
+    asked for are read. Text columns holding a mix of values (e.g. False and 'Limited')
+    are stored as strings, the same as they come back from a .csv.
+
+@author: eric
+"""
+
+import os
+import csv
+import json
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.feather
+except ImportError:
+    pa = None
+
+
+COLUMNAR_FORMATS = ('parquet', 'feather')
+
+
+def file_format(filename):
+
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.parquet':
+        file_format = 'parquet'
+    elif extension in ('.feather', '.arrow'):
+        file_format = 'feather'
+    else:
+        file_format = 'csv'
+    if file_format in COLUMNAR_FORMATS and pa is None:
+        raise ImportError("pyarrow is needed to read/write %s files"%file_format)
+    return file_format
+
+def text_values(series, keep_datetimes=True):
+
+    # Values as str (None if missing) unless they are all datetimes
+    if keep_datetimes and pd.api.types.infer_dtype(series, skipna=True) in ('datetime', 'datetime64'):
+        return series
+    return series.astype(str).where(series.notna(), None)
+
+def to_arrow(df, schema=None):
+
+    df = df.copy()
+    for c in df.columns:
+        if schema is not None and df[c].isna().all():
+            # Columns without any value in this chunk are missing values of any type
+            df[c] = pd.Series(None, index=df.index, dtype=object)
+        # Columns of python objects or categoricals, or stored as text by the first chunk
+        elif df[c].dtype == object or isinstance(df[c].dtype, pd.CategoricalDtype) or (schema is not None and schema.field(c).type == pa.string()):
+            df[c] = text_values(df[c].astype(object), schema is None or pa.types.is_timestamp(schema.field(c).type))
+    table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+    if schema is None:
+        # Columns without any value in the first chunk are stored as text
+        schema = pa.schema([ pa.field(field.name, pa.string()) if field.type == pa.null() else field for field in table.schema ], metadata=table.schema.metadata)
+        table = table.cast(schema)
+    return table
+
+def read_schema(filename):
+
+    # Arrow schema of a columnar file
+    if file_format(filename) == 'parquet':
+        return pq.read_schema(filename)
+    with pa.memory_map(filename) as source:
+        return pa.ipc.open_file(source).schema
+
+def read_columns(filename):
+
+    if file_format(filename) in COLUMNAR_FORMATS:
+        return read_schema(filename).names
+    return list(pd.read_csv(filename, nrows=0).columns)
+
+def read_table(filename, columns=None, dtype=None):
+
+    # dtype only applies to .csv, columnar files already have their types
+    if file_format(filename) == 'parquet':
+        return pd.read_parquet(filename, columns=columns)
+    if file_format(filename) == 'feather':
+        return pd.read_feather(filename, columns=columns)
+    return pd.read_csv(filename, usecols=columns, dtype=dtype)
+
+def iter_table(filename, chunksize, columns=None, dtype=None):
+
+    # Frames of at most chunksize rows
+    if file_format(filename) == 'parquet':
+        for batch in pq.ParquetFile(filename).iter_batches(batch_size=chunksize, columns=columns):
+            yield pa.Table.from_batches([batch]).to_pandas()
+    elif file_format(filename) == 'feather':
+        with pa.memory_map(filename) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                table = pa.Table.from_batches([reader.get_batch(i)])
+                if columns is not None:
+                    table = table.select(columns)
+                for start in range(0, table.num_rows, chunksize):
+                    yield table.slice(start, chunksize).to_pandas()
+    else:
+        for chunk in pd.read_csv(filename, usecols=columns, dtype=dtype, chunksize=chunksize):
+            yield chunk
+
+def set_fields(schema, df):
+
+    # Schema with the fields of the columns of df (replaced, or appended if new), with their pandas metadata so they read back with the same types
+    fields = to_arrow(df).schema
+    names = list(df.columns)
+    metadata = dict(schema.metadata or {})
+    if b'pandas' in metadata and fields.metadata is not None and b'pandas' in fields.metadata:
+        pandas_metadata = json.loads(metadata[b'pandas'])
+        columns = { c['name']: c for c in json.loads(fields.metadata[b'pandas'])['columns'] if c['name'] in names }
+        pandas_metadata['columns'] = [ columns.pop(c['name'], c) for c in pandas_metadata['columns'] ] + list(columns.values())
+        metadata[b'pandas'] = json.dumps(pandas_metadata).encode('utf-8')
+    return pa.schema([ fields.field(f.name) if f.name in names else f for f in schema ] + [ fields.field(c) for c in names if c not in schema.names ], metadata=metadata)
+
+def write_table(df, filename, columns=None):
+
+    # Written to a temporary file first so the file is never left half written
+    if columns is not None:
+        df = df[columns]
+    tmp_filename = filename + '.tmp'
+    if file_format(filename) == 'parquet':
+        pq.write_table(to_arrow(df), tmp_filename)
+    elif file_format(filename) == 'feather':
+        pa.feather.write_feather(to_arrow(df), tmp_filename)
+    else:
+        with open(tmp_filename, 'w', encoding='utf-8', newline='') as f:
+            df.to_csv(f, sep=',', header=True, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
+
+class TableWriter:
+    '''
+    Table written one chunk at a time.
+
+    .csv chunks are appended to the file. Columnar chunks are written as row groups
+    (record batches) of a temporary file replacing the file on close, with append=True
+    the rows already in the file are copied over first. Chunks are given the columns of
+    the first chunk (or of the existing file), columns only found in a later chunk are
+    added at the end and the rows already written get them as missing values. Columnar
+    columns without any value so far (stored as text) get the type of the first values
+    written to them. The file is rewritten once for each chunk adding or typing columns.
+    '''
+
+    def __init__(self, filename, append=False):
+        self.filename = filename
+        self.format = file_format(filename)
+        self.append = append and os.path.isfile(filename)
+        self.columns = read_columns(filename) if self.append else None
+        self.schema = None
+        self.writer = None
+        self.sink = None
+        # Columnar columns without any value written yet
+        self.untyped = []
+
+    def open(self, schema):
+
+        self.schema = schema
+        if self.format == 'parquet':
+            self.writer = pq.ParquetWriter(self.filename + '.tmp', schema)
+        else:
+            self.sink = pa.OSFile(self.filename + '.tmp', 'wb')
+            self.writer = pa.ipc.new_file(self.sink, schema, options=pa.ipc.IpcWriteOptions(compression='lz4'))
+        if self.append:
+            for chunk in iter_table(self.filename, 100000):
+                self.writer.write_table(to_arrow(chunk.reindex(columns=schema.names), self.schema))
+
+    def widen(self, df, added, typed):
+
+        # Columns added are appended to every row written so far (or already in the file) as missing values,
+        # columns typed (only missing values so far) get the type of their values in df
+        if self.format == 'csv':
+            if self.append:
+                with open(self.filename, 'r', encoding='utf-8', newline='') as f_in, open(self.filename + '.tmp', 'w', encoding='utf-8', newline='') as f_out:
+                    writer = csv.writer(f_out, lineterminator='\n')
+                    for i, row in enumerate(csv.reader(f_in)):
+                        writer.writerow(row + (added if i == 0 else [''] * len(added)))
+                os.replace(self.filename + '.tmp', self.filename)
+        else:
+            schema = self.schema
+            if self.writer is not None:
+                # Rows written so far are completed into the file, then copied over with the new schema
+                self.close()
+                self.writer, self.sink = None, None
+                self.append = True
+            elif self.append:
+                schema = read_schema(self.filename)
+            if schema is not None:
+                schema = set_fields(schema, df[added + typed])
+            self.schema = schema
+            self.untyped = [ c for c in self.untyped if c not in typed ] + [ c for c in added if df[c].isna().all() ]
+        self.columns = self.columns + added
+
+    def write(self, df):
+
+        if self.columns is None:
+            self.columns = list(df.columns)
+        added = [ c for c in df.columns if c not in self.columns ]
+        typed = [ c for c in self.untyped if c in df.columns and df[c].notna().any() ]
+        if len(added) > 0 or len(typed) > 0:
+            self.widen(df, added, typed)
+        df = df.reindex(columns=self.columns)
+        if self.format == 'csv':
+            header = not self.append
+            df.to_csv(self.filename, sep=',', header=header, index=False, mode='a' if self.append else 'w')
+            self.append = True
+            return
+        if self.writer is None:
+            if self.schema is None and not self.append:
+                self.untyped = [ c for c in df.columns if df[c].isna().all() ]
+            # Types of an existing file are kept
+            self.open(self.schema or (read_schema(self.filename) if self.append else to_arrow(df).schema))
+        self.writer.write_table(to_arrow(df, self.schema))
+
+    def close(self):
+
+        if self.writer is None:
+            return
+        self.writer.close()
+        if self.sink is not None:
+            self.sink.close()
+        os.replace(self.filename + '.tmp', self.filename)
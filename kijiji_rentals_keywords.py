@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Keyword flags and values extracted from ad text (title + description + url) by
+    kijiji_rentals_process.py: gender/student/sublet preferences, number of bedrooms and
+    bathrooms written in the text and a price written as $N.
+
+    Each rule is a regular expression (the same ones the process stage always used) with
+    the keywords it needs. Every text is first checked once for all keywords (plain
+    substring checks), which rules out most rules, then the rules left are searched:
+    the ones of a flag as one alternation (a flag is True if any of them matches), the
+    ones extracting a value on their own (value of the leftmost match). Results are the
+    same as searching every rule separately over every text.
+
+@author: eric
+"""
+
+import re
+import numpy as np
+import pandas as pd
+
+
+# Keywords to regex search (including possible typos)
+girls = ['girl', 'girls', 'female', 'females', 'woman', 'women', 'lady', 'ladies',
+         'femme', 'filles', 'fille', 'femmes']
+boys = ['boy', 'boys', 'male', 'males', 'man', 'men', 'guy', 'guys',
+        'garçon', 'garçons', 'homme', 'hommes']
+sublet = ['sublet', 'sublets', 'subletting' 'subleting', 'sous-louer', 'sous-location']
+students = ['student', 'students', 'étudiant', 'étudiants']
+preference = ["prefer", 'preference', 'prefered', 'preferred', 'préférer', 'préférence', 'préféré', 'exclusively', 'exclusivement']
+beds = ['bed', 'beds', 'bedroom', 'bedrooms', 'chambre', 'chambres']
+baths = ['bath', 'baths', 'bathroom', 'bathrooms', 'salle de bains', 'bains']
+nums = ['one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten']
+
+# (column, pattern, regex flags, group to extract or None for a flag, keywords), a flag is True if any of its patterns match
+# A pattern can only match texts containing one of each list of keywords, the others are not searched with it
+RULES = [
+    ('Preference-Male', r'((\b[^fe]%s\b).(\bonly\b))'%('|'.join(boys)), re.DOTALL, None, [boys, ['only']]),
+    ('Preference-Male', r'((\bonly\b).(\b[^fe]%s\b))'%('|'.join(boys)), re.DOTALL, None, [boys, ['only']]),
+    ('Preference-Male', r'((\bfor\b).(\b[^fe]%s\b))'%('|'.join(boys)), re.DOTALL, None, [boys, ['for']]),
+    ('Preference-Male', r'((\bpour\b).(\b[^fe]%s\b))'%('|'.join(boys)), re.DOTALL, None, [boys, ['pour']]),
+    ('Preference-Male', r'((\b[^fe]%s\b).(\b%s\b))'%('|'.join(boys), '|'.join(preference)), re.DOTALL, None, [boys, preference]),
+    ('Preference-Male', r'((\bp%s\b).(\b[^fe]%s\b))'%('|'.join(preference), '|'.join(boys)), re.DOTALL, None, [boys, preference]),
+    ('Preference-Male', r'((\ball\b).(\b[^fe]%s\b))'%('|'.join(boys)), re.DOTALL, None, [boys, ['all']]),
+    ('Preference-Male', r'((\bno\b)\s(\b%s\b))'%('|'.join(girls)), re.DOTALL, None, [girls, ['no']]),
+    ('Preference-Female', r'((\b%s\b).(\bonly\b))'%('|'.join(girls)), 0, None, [girls, ['only']]),
+    ('Preference-Female', r'((\bonly\b).(\b%s\b))'%('|'.join(girls)), re.DOTALL, None, [girls, ['only']]),
+    ('Preference-Female', r'((\bfor\b).(\b%s\b))'%('|'.join(girls)), re.DOTALL, None, [girls, ['for']]),
+    ('Preference-Female', r'((\bpour\b).(\b%s\b))'%('|'.join(girls)), re.DOTALL, None, [girls, ['pour']]),
+    ('Preference-Female', r'((\b%s\b).(\b%s\b))'%('|'.join(girls), '|'.join(preference)), re.DOTALL, None, [girls, preference]),
+    ('Preference-Female', r'((\b%s\b).(\b%s\b))'%('|'.join(preference), '|'.join(girls)), re.DOTALL, None, [girls, preference]),
+    ('Preference-Female', r'((\ball\b).(\b%s\b))'%('|'.join(girls)), re.DOTALL, None, [girls, ['all']]),
+    ('Preference-Female', r'((\bno\b)\s(\b%s\b))'%('|'.join(boys)), re.DOTALL, None, [boys, ['no']]),
+    ('Male', r'(\b(%s)\b)'%('|'.join(boys)), re.DOTALL, None, [boys]),
+    ('Female', r'(\b(%s)\b)'%('|'.join(girls)), re.DOTALL, None, [girls]),
+    ('Sublet', r'(\b%s\b)'%('|'.join(sublet)), re.DOTALL, None, [sublet]),
+    ('Students', r'(\b%s\b)'%('|'.join(students)), re.DOTALL, None, [students]),
+    ('Preference-Any', r'(\b%s\b)'%('|'.join(preference)), re.DOTALL, None, [preference]),
+    ('Price', r'((\$)(\d+))', re.DOTALL, 1, [['$']]),
+    ('BedroomsDigit', r'((\b\d\b).(%s))'%('|'.join(beds)), re.DOTALL, 2, [beds]),
+    ('BedroomsWord', r'((\b%s\b).(%s))'%('|'.join(nums), '|'.join(beds)), re.DOTALL, 2, [beds, nums]),
+    ('BathroomsDigit', r'((\b\d\b).(%s))'%('|'.join(baths)), re.DOTALL, 2, [baths]),
+    ('BathroomsWord', r'((\b%s\b).(%s))'%('|'.join(nums), '|'.join(baths)), re.DOTALL, 2, [baths, nums]),
+    ]
+
+
+class KeywordClassifier:
+    '''
+    All rules in one pass over the texts.
+
+    classify returns a boolean array (texts x flag columns) and, for the rules extracting
+    a value, an object array of the value from the leftmost match (None if no match).
+    '''
+
+    def __init__(self, rules=RULES):
+        self.rules = rules
+        self.flag_columns = list(dict.fromkeys(column for column, _, _, group, _ in rules if group is None))
+        self.value_columns = [ column for column, _, _, group, _ in rules if group is not None ]
+        self.patterns = [ re.compile(pattern, flags) for _, pattern, flags, _, _ in rules ]
+        self.keywords = sorted(set(keyword for *_, keywords in rules for any_of in keywords for keyword in any_of))
+        # Rules as lists of keyword sets, one of each set must be in the text
+        self.required = [ [ frozenset(any_of) for any_of in keywords ] for *_, keywords in rules ]
+        self.compiled = {}
+
+    def combined(self, rules):
+
+        # Alternation of the rules of a flag, compiled once per set of rules
+        if rules not in self.compiled:
+            alternatives = []
+            for i in rules:
+                _, pattern, flags, _, _ = self.rules[i]
+                # Flags scoped to each rule
+                alternatives.append('(?%s:%s)'%('s' if flags & re.DOTALL else '-s', pattern))
+            self.compiled[rules] = re.compile('|'.join(alternatives))
+        return self.compiled[rules]
+
+    def classify_one(self, text, flags, values):
+
+        present = { keyword for keyword in self.keywords if keyword in text }
+        candidates = {}
+        for i, required in enumerate(self.required):
+            if all(not present.isdisjoint(any_of) for any_of in required):
+                candidates.setdefault(self.rules[i][0], []).append(i)
+
+        for column, rules in candidates.items():
+            group = self.rules[rules[0]][3]
+            if group is None:
+                flags[self.flag_columns.index(column)] = self.combined(tuple(rules)).search(text) is not None
+            else:
+                match = self.patterns[rules[0]].search(text)
+                if match is not None:
+                    values[self.value_columns.index(column)] = match.group(group)
+
+    def classify(self, texts):
+
+        flags = np.zeros((len(texts), len(self.flag_columns)), dtype=bool)
+        values = np.full((len(texts), len(self.value_columns)), None, dtype=object)
+        for i, text in enumerate(texts):
+            if isinstance(text, str):
+                self.classify_one(text, flags[i], values[i])
+        return flags, values
+
+    def classify_frame(self, text):
+
+        # DataFrame of flag columns (bool) and value columns (NaN if no match), same index as text
+        flags, values = self.classify(text.to_numpy(dtype=object))
+        df = pd.DataFrame(flags, columns=self.flag_columns, index=text.index)
+        for j, column in enumerate(self.value_columns):
+            df[column] = pd.Series(values[:, j], index=text.index, dtype=object).fillna(np.nan)
+        return df
+
+
+classifier = KeywordClassifier()
+
+
+def keyword_columns(text):
+
+    df = classifier.classify_frame(text)
+    # Set False if any ads identified with both male+female
+    both = df['Preference-Male'] & df['Preference-Female']
+    df.loc[both, ['Preference-Male', 'Preference-Female']] = False
+    return df
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Translation and normalization of raw ad values (French to English, prices, sizes,
+    parking, move-in dates) for kijiji_rentals_process.py, driven by one table of steps.
+
+    Each column is factorized once (distinct values + a code per row), its steps are
+    applied in order to the distinct values only, then the result is broadcast back to
+    every row through the codes. Cost depends on the number of distinct values instead
+    of rows x mappings, results are the same as applying each step to the whole column.
+
+@author: eric
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# French column names of ads browsed in French
+fr_en_translation = {
+    'Services-inclus-Électricité': 'Utilities-Included-Hydro',
+    'Services-inclus-Chauffage': 'Utilities-Included-Heat',
+    'Services-inclus-Eau': 'Utilities-Included-Water',
+    'Wi-Fi-et-plus-Internet': 'Wi-Fi-and-More-Internet',
+    'Électroménagers-Réfrigérateur-/-congélateur': 'Appliances-Fridge-/-Freezer',
+    'Espace-extérieur-privé-Balcon': 'Personal-Outdoor-Space-Balcony',
+    "Commodités-dans-l'immeuble-Salle-de-sport": 'Amenities-Gym',
+    "Commodités-dans-l'immeuble-Piscine": 'Amenities-Pool',
+    "Commodités-dans-l'immeuble-Stationnement-pour-vélos": 'Amenities-Bicycle-Parking',
+    "Commodités-dans-l'immeuble-Ascenseur": 'Amenities-Elevator-in-Building',
+    'Stationnement-inclus': 'Parking-Included',
+    'Durée-du-bail': 'Agreement-Type',
+    "Date-d'emménagement": 'Move-In-Date',
+    'Animaux-acceptés': 'Pet-Friendly',
+    'Taille-(pieds-carrés)': 'Size-(sqft)',
+    'Meublé': 'Furnished',
+    'Air-conditionné': 'Air-Conditioning',
+    'Fumeurs-acceptés': 'Smoking-Permitted',
+    "Électroménagers-Buanderie-(dans-l'appartement)": 'Appliances-Laundry-(In-Unit)',
+    'Électroménagers-Lave-vaisselle': 'Appliances-Dishwasher',
+    "Commodités-dans-l'immeuble-Concierge": 'Amenities-Concierge',
+    "Commodités-dans-l'immeuble-Sécurité-24-heures-sur-24": 'Amenities-24-Hour-Security',
+    "Commodités-dans-l'immeuble-espace-de-stockage": 'Amenities-Storage-Space',
+    "Entrées-et-rampes-d'accès-sans-obstacle": 'Barrier-free-Entrances-and-Ramps',
+    'Aides-visuelles': 'Visual-Aids',
+    'Toilettes-accessibles': 'Accessible-Washrooms-in-Suite',
+    'Ascenseurs-accessibles-Accessible-en-fauteuil-roulant': 'Elevator-Accessibility-Features-Wheelchair-accessible',
+    'Chambres-à-coucher': 'Bedrooms',
+    'Salles-de-bain': 'Bathrooms',
+    'Autre-Info': 'More-Info',
+    "Électroménagers-Buanderie-(dans-l'immeuble)": 'Appliances-Laundry-(In-Building)',
+    'Espace-extérieur-privé-Jardin': 'Personal-Outdoor-Space-Yard',
+    'Ascenseurs-accessibles-Affichage-en-braille': 'Elevator-Accessibility-Features-Braille-Labels',
+    'Ascenseurs-accessibles-Messages-sonores': 'Elevator-Accessibility-Features-Audio-Prompts',
+    'Wi-Fi-et-plus-Câble-/-télé': 'Wi-Fi-and-More-Cable-/-TV'
+    }
+
+
+# Values translated/modified in every text column
+value_mapping = {
+    'Not-Available': False,
+    'Not Available': False,
+    'Non-disponible': False,
+    'Non disponible': False,
+    'Yes': True,
+    'Oui': True,
+    'No': False,
+    'Non': False,
+    "Seulement-à-l'extérieur": 'Outdoors-only',
+    'Stationnement': 'Parking',
+    'Entreposage': 'Storage',
+    'Limité': 'Limited',
+    'Au-mois': 'Month-to-month',
+    '1-an': '1-Year',
+    '½': '1/2',
+    'Studio': 'Bachelor/Studio',
+    'Appartement': 'Apartment',
+    'Maison': 'House',
+    'Maison en rangée': 'Townhouse',
+    'Sous-sol': 'Basement'
+    }
+
+fr_month_mapping = {
+    'janvier': 'January',
+    'février': 'February',
+    'mars': 'March',
+    'avril': 'April',
+    'mai': 'May',
+    'juin': 'June',
+    'juillet': 'July',
+    'août': 'August',
+    'septembre': 'September',
+    'octobre': 'October',
+    'novembre': 'November',
+    'décembre': 'December'
+    }
+
+# (column or '*' for every text column, operation, argument), applied in this order:
+#     remove: substrings removed
+#     replace: substrings replaced (in order of the mapping)
+#     missing: whole values set to NaN
+#     map: whole values mapped, others kept
+#     extract: first group of a regex (NaN if no match)
+#     datetime: parsed with the first of the formats that matches (NaT if none), UTC or not
+#     astype: converted to a type
+NORMALIZATION = [
+    ('Price', 'remove', ['$', ',', ' ', '\xa0']),
+    ('Price', 'replace', {'Surdemande': 'PleaseContact', 'Échange': 'Swap/Trade', 'Gratuit': 'Free'}),
+    ('Price', 'missing', ['PleaseContact', 'Free', 'Swap/Trade']),
+    ('Price', 'astype', 'float32'),
+    ('PostingDate', 'datetime', (['%Y-%m-%dT%H:%M:%S'], True)),
+    ('*', 'map', value_mapping),
+    ('Parking-Included', 'extract', r'(\d+)'),
+    ('Parking-Included', 'astype', 'float16'),
+    ('Move-In-Date', 'replace', fr_month_mapping),
+    ('Move-In-Date', 'datetime', (['%B-%d,-%Y', '%d-%B-%Y'], False)),
+    ('Size-(sqft)', 'remove', [',', ' ', '\xa0']),
+    ('Size-(sqft)', 'astype', 'float32'),
+    ]
+
+
+def translate_columns(df):
+
+    # French columns merged into their English column (or renamed)
+    for key, value in fr_en_translation.items():
+        if key in df.columns and value in df.columns:
+            df[value] = df[value].combine_first(df[key])
+            df.drop(columns=key, inplace=True)
+    df.rename(mapper=fr_en_translation, axis=1, inplace=True)
+    return df
+
+def apply_step(values, operation, argument):
+
+    if operation == 'remove':
+        for substring in argument:
+            values = values.str.replace(substring, '', regex=False)
+    elif operation == 'replace':
+        for key, value in argument.items():
+            values = values.str.replace(key, value, regex=False)
+    elif operation == 'missing':
+        values = values.where(~values.isin(argument))
+    elif operation == 'map':
+        values = values.map(argument).fillna(values)
+    elif operation == 'extract':
+        values = values.str.extract(argument, expand=False)
+    elif operation == 'datetime':
+        formats, utc = argument
+        parsed = pd.to_datetime(values, format=formats[0], utc=utc, errors='coerce')
+        for date_format in formats[1:]:
+            parsed = parsed.fillna(pd.to_datetime(values, format=date_format, utc=utc, errors='coerce'))
+        values = parsed
+    elif operation == 'astype':
+        values = values.astype(argument)
+    else:
+        raise ValueError("Unknown normalization %s"%operation)
+    return values
+
+def normalize_column(series, steps):
+
+    codes, uniques = pd.factorize(series)
+    values = pd.Series(uniques)
+    dtype = None
+    for column, operation, argument in steps:
+        # '*' steps only apply while the values are text
+        if column == '*' and values.dtype != object:
+            continue
+        values = apply_step(values, operation, argument)
+        if operation == 'astype':
+            dtype = argument
+
+    # Code -1 (missing value) gives NaN
+    result = pd.Series(values.reindex(codes).to_numpy(), index=series.index, name=series.name)
+    if dtype is not None:
+        return result.astype(dtype)
+    if result.dtype == object:
+        # Values left unchanged keep their original object (e.g. 1 and 1.0 share a code)
+        unchanged = np.array([ type(a) is type(b) and a == b for a, b in zip(values, uniques) ] + [False])
+        result = result.where(~unchanged[codes], series)
+    return result
+
+def normalize(df, table=NORMALIZATION):
+
+    # All steps of each column in table order, '*' steps apply to every column of text (object) values
+    text_columns = set(df.columns[df.dtypes == 'object'])
+    for c in df.columns:
+        steps = [ step for step in table if step[0] == c or (step[0] == '*' and c in text_columns) ]
+        if len(steps) > 0:
+            df[c] = normalize_column(df[c], steps)
+    return df
+
+def days_between(start, end):
+
+    # Whole days from the date of start (UTC) to the date of end
+    start = start.dt.tz_localize(None) if start.dt.tz is not None else start
+    return (end.dt.normalize() - start.dt.normalize()).dt.days.astype('Int32')
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Scrapes, processes and cleans ads in a single run. The ads of every page saved by
+    kijiji_rentals_scraper.py are passed on as they arrive, in batches of at most
+    --batch_size ads (or after --batch_seconds), to the processing of
+    kijiji_rentals_process.py and the cleaning of kijiji_rentals_clean.py, each batch is
+    appended to --processed_file and --cleaned_file. Neither stage reads a file written by
+    the previous one.
+
+    All options of kijiji_rentals_scraper.py apply (the raw file is still --file, --store
+    defaults to journal here so the raw file is not rewritten after every page).
+    With --from_raw the ads already in --file are streamed through both stages instead of
+    crawling, same as kijiji_rentals_process.py --incremental then kijiji_rentals_clean.py.
+
+    Ads of a journal left by an interrupted run are passed through both stages on the next
+    run (or with --compact). With --store rewrite pages go straight to the raw file, after an
+    interrupted run its ads are processed and cleaned with --from_raw.
+
+    Processed ads already in --processed_file are skipped (same as --incremental). The price
+    ceiling of the cleaning (99th percentile of prices, at least 10000) is taken over all
+    processed ads so far, ads already cleaned are not filtered again when it moves.
+    .csv outputs can be read after every batch, .parquet/.feather are complete at the end of the run.
+
+    python kijiji_rentals_pipeline.py -f ads.csv -c h-ottawa/1700185 -w 8
+
+@author: eric
+"""
+
+import os
+import time
+import queue
+import argparse
+import threading
+import numpy as np
+import kijiji_rentals_scraper as scraper
+from kijiji_rentals_io import file_format, read_table, iter_table, text_values, TableWriter
+from kijiji_rentals_process import ChunkProcessor, raw_dtypes, geocode_parser, coordinates_function
+from kijiji_rentals_clean import clean_ads, price_ceiling
+from kijiji_rentals_schema import compact_dtypes, apply_dtypes
+
+
+describe_help = 'python kijiji_rentals_pipeline.py --file ads.csv --city ottawa'
+parser = argparse.ArgumentParser(description=describe_help, parents=[scraper.parser, geocode_parser], conflict_handler='resolve')
+# User defined options
+parser.add_argument('--processed_file', help='File (.csv, .parquet or .feather) processed ads are appended to, ads_processed.csv for ads.csv by default', type=str, default='')
+parser.add_argument('--cleaned_file', help='File (.csv, .parquet or .feather) cleaned ads are appended to, ads_cleaned.csv for ads.csv by default', type=str, default='')
+parser.add_argument('--batch_size', help='Maximum number of ads processed and cleaned at once', type=int, default=200)
+parser.add_argument('--batch_seconds', help='Seconds an ad waits at most for its batch to fill', type=float, default=5)
+parser.add_argument('--from_raw', help='Process and clean the ads of --file instead of crawling', action='store_true', default=False)
+parser.set_defaults(store='journal')
+
+
+def stage_file(raw_file, stage):
+    # Same names as kijiji_rentals_process.py/kijiji_rentals_clean.py give by default
+    root, extension = os.path.splitext(raw_file)
+    return root.split('_')[0] + '_' + stage + extension
+
+
+def raw_frame(records):
+
+    # Records of the scraper typed as they are read back from the raw file
+    df = scraper.add_city(scraper.records_to_frame(records))
+    for c in df.columns:
+        if df[c].dtype == object or c in raw_dtypes:
+            df[c] = text_values(df[c].astype(object), keep_datetimes=c not in raw_dtypes)
+    return df
+
+
+def record_batches(record_queue, batch_size, batch_seconds):
+
+    # (records, time the first one arrived) of at most batch_size records, until None is queued
+    batch, arrived = [], None
+    while True:
+        try:
+            records = record_queue.get(timeout=None if arrived is None else max(arrived + batch_seconds - time.perf_counter(), 0))
+        except queue.Empty:
+            records = []
+        if records is None:
+            break
+        if arrived is None and len(records) > 0:
+            arrived = time.perf_counter()
+        batch += records
+        while len(batch) >= batch_size:
+            yield batch[:batch_size], arrived
+            batch = batch[batch_size:]
+        if len(batch) > 0 and time.perf_counter() >= arrived + batch_seconds:
+            yield batch, arrived
+            batch = []
+        if len(batch) == 0:
+            arrived = None
+    if len(batch) > 0:
+        yield batch, arrived
+
+
+class Pipeline:
+    '''
+    Raw ads processed and cleaned one batch at a time.
+
+    Processed ads are appended by a ChunkProcessor of kijiji_rentals_process.py (duplicates
+    of ads already written are removed), then given the compact types the clean stage would
+    load them from the processed file with, cleaned and appended to the cleaned file.
+    '''
+
+    def __init__(self, processed_file, cleaned_file, coordinates=None):
+        # Prices of the ads processed by previous runs, kept for the price ceiling
+        self.prices = np.empty(0, dtype='float32')
+        if os.path.isfile(processed_file):
+            self.prices = read_table(processed_file, columns=['Price'])['Price'].to_numpy(dtype='float32')
+        self.processor = ChunkProcessor(processed_file, incremental=True, coordinates=coordinates)
+        self.cleaned = TableWriter(cleaned_file, append=True)
+        # Categories loaded from a .csv are the text written (e.g. of dates)
+        self.text_categories = file_format(processed_file) == 'csv'
+        self.n_cleaned = 0
+
+    def run(self, raw):
+
+        processed = self.processor.process(raw)
+        if processed is None:
+            return 0, 0
+        df = processed.copy()
+        if self.text_categories:
+            for c in df.columns:
+                if compact_dtypes.get(c) == 'category' and df[c].dtype == object:
+                    df[c] = text_values(df[c], keep_datetimes=False)
+        df, _ = apply_dtypes(df, compact_dtypes)
+        self.prices = np.concatenate([self.prices, df['Price'].to_numpy(dtype='float32')])
+        df = clean_ads(df, price_ceiling(self.prices))
+        self.cleaned.write(df)
+        self.n_cleaned += len(df)
+        return len(processed), len(df)
+
+    def close(self):
+        self.processor.close()
+        self.cleaned.close()
+
+
+def run_stream(pipeline, record_queue, batch_size, batch_seconds):
+
+    # Consumer: runs each batch of scraped ads through the pipeline while the crawl continues
+    for records, arrived in record_batches(record_queue, batch_size, batch_seconds):
+        try:
+            n_processed, n_cleaned = pipeline.run(raw_frame(records))
+            print("Pipeline: %s scraped ads, %s processed, %s cleaned, written %.1fs after scraping"%(len(records), n_processed, n_cleaned, time.perf_counter() - arrived))
+        except Exception as e:
+            print(e)
+            print("Unable to process/clean %s scraped ads, they are still saved to the raw file...\n"%len(records))
+
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+    args.processed_file = args.processed_file or stage_file(args.file, 'processed')
+    args.cleaned_file = args.cleaned_file or stage_file(args.file, 'cleaned')
+
+    pipeline = Pipeline(args.processed_file, args.cleaned_file, coordinates_function(args))
+    start = time.perf_counter()
+    if args.from_raw:
+        if not os.path.isfile(args.file):
+            print("%s could not be found..."%args.file)
+            exit()
+        print("Processing and cleaning raw file %s in batches of %s ads..."%(args.file, args.batch_size))
+        for chunk in iter_table(args.file, args.batch_size, dtype=raw_dtypes):
+            pipeline.run(chunk)
+    else:
+        record_queue = queue.Queue()
+        worker = threading.Thread(target=run_stream, args=(pipeline, record_queue, args.batch_size, args.batch_seconds), daemon=True)
+        worker.start()
+        try:
+            scraper.main(args, on_page=record_queue.put)
+        finally:
+            # Batches left are processed before the outputs are closed
+            record_queue.put(None)
+            while worker.is_alive():
+                worker.join(timeout=0.5)
+    pipeline.close()
+
+    elapsed = time.perf_counter() - start
+    print("Pipeline: %s raw ads, %s processed to %s, %s cleaned to %s in %.0fs"%(pipeline.processor.n_raw, pipeline.processor.n_written, args.processed_file,
+                                                                                   pipeline.n_cleaned, args.cleaned_file, elapsed))
+    print("Done!")
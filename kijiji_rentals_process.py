@@ -17,163 +17,54 @@ Description:
 """
 
 import os
-import datetime
-import time
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import tqdm
-import time
-import re
-from geopy.geocoders import Nominatim
-from geopy.extra.rate_limiter import RateLimiter
 #from timezonefinder import TimezoneFinder
+from kijiji_rentals_geocode import Gazetteer, add_coordinates
+from kijiji_rentals_keywords import keyword_columns
+from kijiji_rentals_normalize import fr_en_translation, translate_columns, normalize, days_between
+from kijiji_rentals_schema import my_dtypes, compact_dtypes, apply_dtypes, print_memory_report
+from kijiji_rentals_io import read_table, iter_table, write_table, read_columns, TableWriter
 import argparse
 
 
+# Coordinates options, also used by kijiji_rentals_pipeline.py
+geocode_parser = argparse.ArgumentParser(add_help=False)
+geocode_parser.add_argument('--lat_long', help='Flag if want to get latitudes/longitudes (takes long time), will keep "Location" column either way.', action='store_true', default=False)
+geocode_parser.add_argument('--default_city', help='City to default to for long/lat coordinates if ad location is unsearchable', type=str, default="")
+geocode_parser.add_argument('--country', help='Country to default to for long/lat coordinates if ad location is unsearchable', type=str, default="Canada")
+geocode_parser.add_argument('--gazetteer', help='Offline file of postal codes/FSAs/place names with coordinates (GeoNames CA.txt or .csv with key,latitude,longitude), Nominatim is only queried for locations not found in it', type=str, default=None)
+geocode_parser.add_argument('--geocode_cache', help='SQLite file caching coordinates of every location geocoded, reused by later runs', type=str, default='geocodes.sqlite')
+
 describe_help = 'python kijiji_rentals_process.py --raw_file ads.csv --output_file ads_cleaned.csv'
-parser = argparse.ArgumentParser(description=describe_help)
+parser = argparse.ArgumentParser(description=describe_help, parents=[geocode_parser])
 # User defined options
-parser.add_argument('-r', '--raw_file', help='File (.csv) of ads info to process', type=str, default="ads.csv")
-parser.add_argument('-o', '--output_file', help='File (.csv) for processed ad data', type=str, default='')
-parser.add_argument('--city', help='City to default to for long/lat coordinates if ad location is unsearchable', type=str, default="")
-parser.add_argument('--country', help='Country to default to for long/lat coordinates if ad location is unsearchable', type=str, default="Canada")
-parser.add_argument('--lat_long', help='Flag if want to get latitudes/longitudes (takes long time), will keep "Location" column either way.', action='store_true', default=False)
-args = parser.parse_args()
-
-if args.output_file == '':
-    args.output_file = args.raw_file.replace('.csv', '').split('_')[0] + '_processed.csv'
+parser.add_argument('-r', '--raw_file', help='File (.csv, .parquet or .feather) of ads info to process', type=str, default="ads.csv")
+parser.add_argument('-o', '--output_file', help='File (.csv, .parquet or .feather) for processed ad data, same format as the raw file by default', type=str, default='')
+parser.add_argument('--city', help='Same as --default_city', dest='default_city', type=str, default="")
+parser.add_argument('--chunksize', help='Process the raw file this many ads at a time and append them to the output file (memory depends on chunk size instead of file size)', type=int, default=None)
+parser.add_argument('--incremental', help='Only process raw ads whose AdId is not in the output file yet and append them to it', action='store_true', default=False)
+parser.add_argument('--memory_report', help='Print the memory of each processed column with the file types it is held and written with, and what the compact types of the clean stage (categoricals, float32) would take, for every chunk with --chunksize/--incremental', action='store_true', default=False)
 
-my_dtypes = {'Price': 'float64',
- 'Location': 'object',
- 'PostingDate': 'object',
- 'Poster': 'object',
- 'AdId': 'object',
- 'ScrapeDate': 'object',
- 'UnitType': 'object',
- 'Bedrooms': 'object',
- 'Bathrooms': 'object',
- 'Appliances-Laundry-(In-Unit)': 'boolean',
- 'Appliances-Dishwasher': 'boolean',
- 'Appliances-Fridge-/-Freezer': 'boolean',
- 'Personal-Outdoor-Space-Balcony': 'boolean',
- 'Amenities-Gym': 'boolean',
- 'Amenities-Bicycle-Parking': 'boolean',
- 'Amenities-Storage-Space': 'boolean',
- 'Amenities-Elevator-in-Building': 'boolean',
- 'Parking-Included': 'float64',
- 'Agreement-Type': 'object',
- 'Move-In-Date': 'object',
- 'Pet-Friendly': 'object',
- 'Size-(sqft)': 'float64',
- 'Furnished': 'boolean',
- 'Air-Conditioning': 'boolean',
- 'Smoking-Permitted': 'object',
- 'Utilities-Included-Hydro': 'boolean',
- 'Utilities-Included-Heat': 'boolean',
- 'Utilities-Included-Water': 'boolean',
- 'Wi-Fi-and-More-Internet': 'boolean',
- 'Wi-Fi-and-More-Cable-/-TV': 'boolean',
- 'Amenities-Pool': 'boolean',
- 'Elevator-Accessibility-Features-Wheelchair-accessible': 'boolean',
- 'Barrier-free-Entrances-and-Ramps': 'boolean',
- 'Visual-Aids': 'boolean',
- 'Accessible-Washrooms-in-Suite': 'boolean',
- 'Appliances-Laundry-(In-Building)': 'boolean',
- 'Personal-Outdoor-Space-Yard': 'boolean',
- 'Amenities-Concierge': 'boolean',
- 'Amenities-24-Hour-Security': 'boolean',
- 'More-Info': 'object',
- 'Elevator-Accessibility-Features-Braille-Labels': 'boolean',
- 'City': 'object',
- 'RentalCategory': 'object',
- 'Commercial': 'boolean',
- 'Residential': 'boolean',
- 'PostingDateDaysInAdvance': 'float64',
- 'Preference-Male': 'bool',
- 'Preference-Female': 'bool',
- 'Male': 'bool',
- 'Female': 'bool',
- 'Sublet': 'bool',
- 'Students': 'bool',
- 'Preference-Any': 'bool',
- 'NumberBedrooms': 'float64',
- 'NumberBathrooms': 'float64',
- 'PricePerBedroom': 'float64',
- 'PricePerSqFt': 'float64',
- 'Elevator-Accessibility-Features-Audio-Prompts': 'boolean'}
 
+# Raw columns formatted as text, read as str so every chunk (or file) has the same types
+text_columns = ['Title', 'Description', 'AdURL', 'Price', 'Bedrooms', 'Bathrooms', 'Size-(sqft)', 'Parking-Included', 'Move-In-Date']
+raw_dtypes = { c: 'str' for c in text_columns + [ key for key, value in fr_en_translation.items() if value in text_columns ] }
+# AdIds are compared with the ones of the output file by --incremental
+raw_dtypes['AdId'] = 'str'
 
-fr_en_translation = {
-    'Services-inclus-Électricité': 'Utilities-Included-Hydro',
-    'Services-inclus-Chauffage': 'Utilities-Included-Heat',
-    'Services-inclus-Eau': 'Utilities-Included-Water',
-    'Wi-Fi-et-plus-Internet': 'Wi-Fi-and-More-Internet',
-    'Électroménagers-Réfrigérateur-/-congélateur': 'Appliances-Fridge-/-Freezer',
-    'Espace-extérieur-privé-Balcon': 'Personal-Outdoor-Space-Balcony',
-    "Commodités-dans-l'immeuble-Salle-de-sport": 'Amenities-Gym',
-    "Commodités-dans-l'immeuble-Piscine": 'Amenities-Pool',
-    "Commodités-dans-l'immeuble-Stationnement-pour-vélos": 'Amenities-Bicycle-Parking',
-    "Commodités-dans-l'immeuble-Ascenseur": 'Amenities-Elevator-in-Building',
-    'Stationnement-inclus': 'Parking-Included',
-    'Durée-du-bail': 'Agreement-Type',
-    "Date-d'emménagement": 'Move-In-Date',
-    'Animaux-acceptés': 'Pet-Friendly',
-    'Taille-(pieds-carrés)': 'Size-(sqft)',
-    'Meublé': 'Furnished',
-    'Air-conditionné': 'Air-Conditioning',
-    'Fumeurs-acceptés': 'Smoking-Permitted',
-    "Électroménagers-Buanderie-(dans-l'appartement)": 'Appliances-Laundry-(In-Unit)',
-    'Électroménagers-Lave-vaisselle': 'Appliances-Dishwasher',
-    "Commodités-dans-l'immeuble-Concierge": 'Amenities-Concierge',
-    "Commodités-dans-l'immeuble-Sécurité-24-heures-sur-24": 'Amenities-24-Hour-Security',
-    "Commodités-dans-l'immeuble-espace-de-stockage": 'Amenities-Storage-Space',
-    "Entrées-et-rampes-d'accès-sans-obstacle": 'Barrier-free-Entrances-and-Ramps',
-    'Aides-visuelles': 'Visual-Aids',
-    'Toilettes-accessibles': 'Accessible-Washrooms-in-Suite',
-    'Ascenseurs-accessibles-Accessible-en-fauteuil-roulant': 'Elevator-Accessibility-Features-Wheelchair-accessible',
-    'Chambres-à-coucher': 'Bedrooms',
-    'Salles-de-bain': 'Bathrooms',
-    'Autre-Info': 'More-Info',
-    "Électroménagers-Buanderie-(dans-l'immeuble)": 'Appliances-Laundry-(In-Building)',
-    'Espace-extérieur-privé-Jardin': 'Personal-Outdoor-Space-Yard',
-    'Ascenseurs-accessibles-Affichage-en-braille': 'Elevator-Accessibility-Features-Braille-Labels',
-    'Ascenseurs-accessibles-Messages-sonores': 'Elevator-Accessibility-Features-Audio-Prompts',
-    'Wi-Fi-et-plus-Câble-/-télé': 'Wi-Fi-and-More-Cable-/-TV'
-    }
+# Columns identifying a duplicate ad
+duplicate_subset = ['AdId', 'Poster', 'City', 'Price']
 
 
-def get_coordinates(df):
-    geolocator = Nominatim(user_agent="kijiji", timeout=3)
-    geocode = RateLimiter(geolocator.geocode,
-                          max_retries=3, 
-                          min_delay_seconds=1, 
-                          error_wait_seconds=2,
-                          swallow_exceptions=True)
-    # Iterate over locations
-    for i in tqdm.tqdm(df.index):
-        # Ignore if coordinates already exist
-        if np.isnan(df.loc[i, 'Longitude']) and np.isnan(df.loc[i, 'Latitude']):
-            try:
-                loc = geolocator.geocode(df['Location'][i])
-                time.sleep(1)
-                # Try again without postal code if nothing returned
-                if loc == None:
-                    loc = geolocator.geocode(','.join(df['Location'][i].split(',')[:-1]))
-                    time.sleep(1)
-                # If still no coordinates, use default city + country
-                if loc == None:
-                    loc = geolocator.geocode(args.city.capitalize() + ', ' + args.country.capitalize())
-                    time.sleep(1)
-                df.loc[i, 'Longitude'] = loc.longitude
-                df.loc[i, 'Latitude'] = loc.latitude
-                
-            except Exception as e:
-                print(e)
-                print('Could not retrieve coordinates %s'%df['Location'][i])
-                continue
-        
-    return df
+def coordinates_function(args):
+    # Function adding Longitude/Latitude to processed ads with the options of geocode_parser, None without --lat_long
+    if not args.lat_long:
+        return None
+    # Distinct locations are looked up in --gazetteer first, the others geocoded once and cached in --geocode_cache for later runs
+    gazetteer = Gazetteer(args.gazetteer) if args.gazetteer is not None else None
+    fallback = args.default_city.capitalize() + ', ' + args.country.capitalize()
+    return lambda df: add_coordinates(df, args.geocode_cache, fallback=fallback, gazetteer=gazetteer)
 
 
 def anonymize_values(series):
@@ -182,25 +73,13 @@ def anonymize_values(series):
     return series
 
 
-if __name__ == '__main__':
+def process_ads(df):
     
     # Main df columns are pd.DataFrame(columns=["Title", "Price", "Location", "Description", "PostingDate", "Poster", "AdURL", "AdId", "ScrapeDate"])
-    
-    # Load raw data file
-    if os.path.isfile(args.raw_file):
-        print("Loading raw file %s..."%args.raw_file)
-        df_raw = pd.read_csv(args.raw_file)
-        df = df_raw.copy()
-    else:
-        print("%s could not be found..."%args.raw_file)
-        exit()
+    # Every step only depends on the row itself, df can be the whole raw file or a chunk of it
 
     # Apply translation mapping
-    for key, value in fr_en_translation.items():
-        if key in df.columns and value in df.columns:
-            df[value] = df[value].combine_first(df[key])
-            df.drop(columns=key, inplace=True)
-    df.rename(mapper=fr_en_translation, axis=1, inplace=True)
+    df = translate_columns(df)
     
     # Categorize rental ad by listing group
     urls_expanded = df['AdURL'].str.split('/', expand=True)
@@ -231,150 +110,33 @@ if __name__ == '__main__':
     text = (df['Title'].str.lower() + df['Description'].str.lower() + urls_expanded[5].str.lower()).str.replace('\n', '')
     df.drop(columns=['Title', 'Description', 'AdURL'], inplace=True)
     #df['Text'] = text
+    # All keyword flags/values (see kijiji_rentals_keywords.py) in one pass over the text
+    keywords = keyword_columns(text)
     
-    # Format Price
-    df['Price'] = df['Price'].fillna(text.str.extract(r'((\$)(\d+))', re.DOTALL, expand=False)[0])
-    df['Price'] = df['Price'].str.replace('$', '', regex=False)
-    df['Price'] = df['Price'].str.replace(',', '', regex=False)
-    df['Price'] = df['Price'].str.replace(' ', '', regex=False)
-    df['Price'] = df['Price'].str.replace("\xa0", "", regex=False)
-    # Translate
-    df['Price'] = df['Price'].str.replace("Surdemande", "PleaseContact", regex=False)
-    df['Price'] = df['Price'].str.replace('Échange', "Swap/Trade", regex=False)
-    df['Price'] = df['Price'].str.replace('Gratuit', "Free", regex=False)
-    # Replace
-    df['Price'].replace(to_replace='PleaseContact', value=np.nan, inplace=True)
-    df['Price'].replace(to_replace='Free', value=np.nan, inplace=True)
-    df['Price'].replace(to_replace='Swap/Trade', value=np.nan, inplace=True)
-    df['Price'] = df['Price'].astype('float32')
-    
-    
-    # Format PostingDate
-    df['PostingDate'] = pd.to_datetime(df['PostingDate'], format='%Y-%m-%dT%H:%M:%S', utc=True)
-    
-    # Modify/translate values
-    value_mapping = {
-        'Not-Available': False,
-        'Not Available': False,
-        'Non-disponible': False,
-        'Non disponible': False,
-        'Yes': True,
-        'Oui': True,
-        'No': False,
-        'Non': False,
-        "Seulement-à-l'extérieur": 'Outdoors-only',
-        'Stationnement': 'Parking',
-        'Entreposage': 'Storage',
-        'Limité': 'Limited',
-        'Au-mois': 'Month-to-month',
-        '1-an': '1-Year',
-        '½': '1/2',
-        'Studio': 'Bachelor/Studio',
-        'Appartement': 'Apartment',
-        'Maison': 'House',
-        'Maison en rangée': 'Townhouse',
-        'Sous-sol': 'Basement'
-               }
-    
-    for c in df.columns[df.dtypes == 'object']:
-        df[c] = df[c].map(value_mapping).fillna(df[c])
-        
-    # Format number of Parking-Included
-    if 'Parking-Included' in df.columns:
-        df['Parking-Included'] = df['Parking-Included'].str.extract(r'(\d+)')
-        df['Parking-Included'] = df['Parking-Included'].astype('float16')
-
-    # Format Move-In-Date
-    fr_month_mapping = {
-        'janvier': 'January',
-        'février': 'February',
-        'mars': 'March',
-        'avril': 'April',
-        'mai': 'May',
-        'juin': 'June',
-        'juillet': 'July',
-        'août': 'August',
-        'septembre': 'September',
-        'octobre': 'October',
-        'novembre': 'November',
-        'décembre': 'December'
-        }
+    # Price written in the text when missing
+    df['Price'] = df['Price'].fillna(keywords['Price'])
+    
+    # Format Price and PostingDate, modify/translate values, format number of Parking-Included, format Move-In-Date
+    # (French months, English or French format), format size (see kijiji_rentals_normalize.py), each on the distinct values of the column
+    df = normalize(df)
     
     if 'Move-In-Date' in df.columns:
-        for key, value in fr_month_mapping.items():
-            df['Move-In-Date'] = df['Move-In-Date'].str.replace(key, value)
-        en_movein = pd.to_datetime(df['Move-In-Date'], format='%B-%d,-%Y', utc=True, errors='coerce').dt.date
-        fr_movein = pd.to_datetime(df['Move-In-Date'], format='%d-%B-%Y', utc=True, errors='coerce').dt.date
-        df['Move-In-Date'] = en_movein.combine_first(fr_movein)
-        df['Move-In-Date'] = pd.to_datetime(df['Move-In-Date'])
-    
-        df['PostingDateDaysInAdvance'] = (df['Move-In-Date'].dt.date - df['PostingDate'].dt.date).dt.days.astype('Int32')
-    
-    # Format size
-    df['Size-(sqft)'] = df['Size-(sqft)'].str.replace(',', '', regex=False)
-    df['Size-(sqft)'] = df['Size-(sqft)'].str.replace(' ', '', regex=False)
-    df['Size-(sqft)'] = df['Size-(sqft)'].str.replace("\xa0", "", regex=False).astype('float32')
-    
-    
-    # Keywords to regex search (including possible typos)
-    girls = ['girl', 'girls', 'female', 'females', 'woman', 'women', 'lady', 'ladies',
-             'femme', 'filles', 'fille', 'femmes']
-    boys = ['boy', 'boys', 'male', 'males', 'man', 'men', 'guy', 'guys',
-            'garçon', 'garçons', 'homme', 'hommes']
-    sublet = ['sublet', 'sublets', 'subletting' 'subleting', 'sous-louer', 'sous-location']
-    students = ['student', 'students', 'étudiant', 'étudiants']
-    preference = ["prefer", 'preference', 'prefered', 'preferred', 'préférer', 'préférence', 'préféré', 'exclusively', 'exclusivement']
-
-
-    # Find Preference-Male
-    df['Preference-Male'] = text.str.extract(r'((\b[^fe]%s\b).(\bonly\b))'%('|'.join(boys)), re.DOTALL, expand=False)[0].notnull().astype('bool')
-    df['Preference-Male'] = df['Preference-Male'] | text.str.extract(r'((\bonly\b).(\b[^fe]%s\b))'%('|'.join(boys)), re.DOTALL, expand=False)[0].notnull().astype('bool')
-    df['Preference-Male'] = df['Preference-Male'] | text.str.extract(r'((\bfor\b).(\b[^fe]%s\b))'%('|'.join(boys)), re.DOTALL, expand=False)[0].notnull().astype('bool')
-    df['Preference-Male'] = df['Preference-Male'] | text.str.extract(r'((\bpour\b).(\b[^fe]%s\b))'%('|'.join(boys)), re.DOTALL, expand=False)[0].notnull().astype('bool')
-    df['Preference-Male'] = df['Preference-Male'] | text.str.extract(r'((\b[^fe]%s\b).(\b%s\b))'%('|'.join(boys), '|'.join(preference)), re.DOTALL, expand=False)[0].notnull().astype('bool')
-    df['Preference-Male'] = df['Preference-Male'] | text.str.extract(r'((\bp%s\b).(\b[^fe]%s\b))'%('|'.join(preference), '|'.join(boys)), re.DOTALL, expand=False)[0].notnull().astype('bool')          
-    df['Preference-Male'] = df['Preference-Male'] | text.str.extract(r'((\ball\b).(\b[^fe]%s\b))'%('|'.join(boys)), re.DOTALL, expand=False)[0].notnull().astype('bool') 
-    df['Preference-Male'] = df['Preference-Male'] | text.str.extract(r'((\bno\b)\s(\b%s\b))'%('|'.join(girls)), re.DOTALL, expand=False)[0].notnull().astype('bool')
-    
-    # Find Preference-Female
-    df['Preference-Female'] = text.str.extract(r'((\b%s\b).(\bonly\b))'%('|'.join(girls)), expand=False)[0].notnull().astype('bool')
-    df['Preference-Female'] = df['Preference-Female'] | text.str.extract(r'((\bonly\b).(\b%s\b))'%('|'.join(girls)), re.DOTALL, expand=False)[0].notnull().astype('bool')
-    df['Preference-Female'] = df['Preference-Female'] | text.str.extract(r'((\bfor\b).(\b%s\b))'%('|'.join(girls)), re.DOTALL, expand=False)[0].notnull().astype('bool')
-    df['Preference-Female'] = df['Preference-Female'] | text.str.extract(r'((\bpour\b).(\b%s\b))'%('|'.join(girls)), re.DOTALL, expand=False)[0].notnull().astype('bool')
-    df['Preference-Female'] = df['Preference-Female'] | text.str.extract(r'((\b%s\b).(\b%s\b))'%('|'.join(girls), '|'.join(preference)), re.DOTALL, expand=False)[0].notnull().astype('bool')
-    df['Preference-Female'] = df['Preference-Female'] | text.str.extract(r'((\b%s\b).(\b%s\b))'%('|'.join(preference), '|'.join(girls)), re.DOTALL, expand=False)[0].notnull().astype('bool')          
-    df['Preference-Female'] = df['Preference-Female'] | text.str.extract(r'((\ball\b).(\b%s\b))'%('|'.join(girls)), re.DOTALL, expand=False)[0].notnull().astype('bool')
-    df['Preference-Female'] = df['Preference-Female'] | text.str.extract(r'((\bno\b)\s(\b%s\b))'%('|'.join(boys)), re.DOTALL, expand=False)[0].notnull().astype('bool')
-    
-    # Any keywords contained
-    df['Male'] = text.str.extract(r'(\b(%s)\b)'%('|'.join(boys)), re.DOTALL, expand=False)[0].notnull().astype('bool')
-    df['Female'] = text.str.extract(r'(\b(%s)\b)'%('|'.join(girls)), re.DOTALL, expand=False)[0].notnull().astype('bool')
-    
-    # Set False if any ads identified with both male+female
-    no_gender_pref = df[(df['Preference-Male'] == True) & (df['Preference-Female'] == True)]
-    df.loc[no_gender_pref.index, ['Preference-Male', 'Preference-Female']] = False
-    
-    # Find Sublets
-    df['Sublet'] = text.str.extract(r'(\b%s\b)'%('|'.join(sublet)), re.DOTALL, expand=False).notnull().astype('bool')
-    
-    # Find Students
-    df['Students'] = text.str.extract(r'(\b%s\b)'%('|'.join(students)), re.DOTALL, expand=False).notnull().astype('bool')
-    
-    # Find Preference-Other
-    df['Preference-Any'] = text.str.extract(r'(\b%s\b)'%('|'.join(preference)), re.DOTALL, expand=False).notnull().astype('bool')
+        df['PostingDateDaysInAdvance'] = days_between(df['PostingDate'], df['Move-In-Date'])
+    
+    
+    # Find Preference-Male/Preference-Female (False if both), any keywords contained, Sublets, Students, Preference-Other
+    for c in ['Preference-Male', 'Preference-Female', 'Male', 'Female', 'Sublet', 'Students', 'Preference-Any']:
+        df[c] = keywords[c]
     
     
     # Format bedrooms
-    beds = ['bed', 'beds', 'bedroom', 'bedrooms', 'chambre', 'chambres']
-    baths = ['bath', 'baths', 'bathroom', 'bathrooms', 'salle de bains', 'bains']
     num_map = {'1.0': '1', '2.0': '2', '3.0': '3', '4.0': '4', '5.0': '5', '6.0': '6', '7.0': '7', '8.0': '8', '9.0': '9',
                'one': '1', 'two': '2', 'three': '3', 'four': '4', 'five': '5', 'six': '6', 'seven': '7', 'eight': '8', 'nine': '9', 'ten': '10'}
-    nums = ['one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten']
     
     # Infer number of beds from text and fill nan
     df['Bedrooms'] = df['Bedrooms'].map(num_map).fillna(df['Bedrooms'])
-    df['Bedrooms'] = df['Bedrooms'].fillna(text.str.extract(r'((\b\d\b).(%s))'%('|'.join(beds)), re.DOTALL, expand=False)[1])
-    df['Bedrooms'] = df['Bedrooms'].fillna(text.str.extract(r'((\b%s\b).(%s))'%('|'.join(nums), '|'.join(beds)), re.DOTALL, expand=False)[1])
+    df['Bedrooms'] = df['Bedrooms'].fillna(keywords['BedroomsDigit'])
+    df['Bedrooms'] = df['Bedrooms'].fillna(keywords['BedroomsWord'])
     df['Bedrooms'] = df['Bedrooms'].map(num_map).fillna(df['Bedrooms'])
     df['NumberBedrooms'] = df['Bedrooms'].astype('str')
     df['NumberBedrooms'] = df['NumberBedrooms'].str.replace('Bachelor/Studio', '1')
@@ -383,8 +145,8 @@ if __name__ == '__main__':
     df['NumberBedrooms'] = (df['NumberBedrooms'].str.extract(r'(\d)')[0].astype('Int16') + df['NumberBedrooms'].str.extract(r'(\d)*(\+)')[1].notnull().astype('Int16'))
     df['NumberBedrooms'] = df['NumberBedrooms'].astype('Int16')
     
-    df['Bathrooms'] = df['Bathrooms'].fillna(text.str.extract(r'((\b\d\b).(%s))'%('|'.join(baths)), re.DOTALL, expand=False)[1])
-    df['Bathrooms'] = df['Bathrooms'].fillna(text.str.extract(r'((\b%s\b).(%s))'%('|'.join(nums), '|'.join(baths)), re.DOTALL, expand=False)[1])
+    df['Bathrooms'] = df['Bathrooms'].fillna(keywords['BathroomsDigit'])
+    df['Bathrooms'] = df['Bathrooms'].fillna(keywords['BathroomsWord'])
     df['Bathrooms'] = df['Bathrooms'].map(num_map).fillna(df['Bathrooms'])
     df['NumberBathrooms'] = (df['Bathrooms'].astype('str').str.extract(r'(\d)\.(\d)')[0] + '.' + df['Bathrooms'].astype('str').str.extract(r'(\d)\.(\d)')[1]).astype('float16')
     df['NumberBathrooms'] = df['NumberBathrooms'].fillna(df['Bathrooms'].astype(str).str.extract(r'(\d)').astype('float16')[0])
@@ -394,37 +156,149 @@ if __name__ == '__main__':
     
     df['PricePerSqFt'] = (df['Price'] / df['Size-(sqft)']).round(decimals=0)
     
+    return df
+
+
+def key_hashes(df):
+    # 64-bit hashes of the duplicate subset, compared as text so chunks with different inferred types agree
+    return pd.util.hash_pandas_object(df[duplicate_subset].astype(str), index=False).to_numpy()
+
+
+def ad_id_hashes(ad_ids):
+    return pd.util.hash_array(pd.Series(ad_ids, dtype=object).astype(str).to_numpy())
+
+
+def load_processed(output_file):
+    
+    # Columns, sorted key hashes and sorted AdId hashes of ads already in the output file
+    processed = read_table(output_file, columns=duplicate_subset, dtype=str)
+    return read_columns(output_file), np.unique(key_hashes(processed)), np.unique(ad_id_hashes(processed['AdId']))
+
+
+class ChunkProcessor:
+    '''
+    Raw ads processed and appended to the output file one chunk at a time.
+    
+    Only a sorted array of the key hashes already written is kept between chunks, duplicates
+    of ads written from previous chunks (or already in the output file with incremental=True)
+    are removed. Columns first found in a later chunk are added to the output file.
+    coordinates is a function adding Longitude/Latitude to a processed chunk.
+    '''
+    
+    def __init__(self, output_file, incremental=False, coordinates=None):
+        self.output_file = output_file
+        self.coordinates = coordinates
+        self.written = np.empty(0, dtype=np.uint64)
+        self.processed_ids = None
+        self.columns = None
+        if incremental and os.path.isfile(output_file):
+            self.columns, self.written, self.processed_ids = load_processed(output_file)
+            print("%s ads already processed in %s"%(len(self.processed_ids), output_file))
+        self.writer = TableWriter(output_file, append=self.processed_ids is not None)
+        self.n_raw, self.n_written = 0, 0
+    
+    def process(self, chunk):
+        
+        # Processed ads written from the chunk
+        self.n_raw += len(chunk)
+        if self.processed_ids is not None:
+            # Skip raw ads already processed before any other work
+            chunk = chunk[~np.isin(ad_id_hashes(chunk['AdId']), self.processed_ids)].reset_index(drop=True)
+            if len(chunk) == 0:
+                return None
+        df, cols = apply_dtypes(process_ads(chunk), my_dtypes)
+        
+        # Remove duplicates within the chunk and of ads written from previous chunks (keys as written)
+        hashes = key_hashes(df)
+        keep = ~pd.Series(hashes).duplicated(keep='first').to_numpy() & ~np.isin(hashes, self.written)
+        df = df[keep].reset_index(drop=True)
+        self.written = np.union1d(self.written, hashes[keep])
+        
+        if self.coordinates is not None:
+            df = self.coordinates(df)
+            df['Longitude'] = df['Longitude'].astype('float32')
+            df['Latitude'] = df['Latitude'].astype('float32')
+            cols = list(df.columns)
+        if self.columns is None:
+            self.columns = cols
+        # Columns new to the output file are added to it, ads already written have them missing
+        added = [ c for c in cols if c not in self.columns ]
+        if len(added) > 0:
+            print("Adding columns to %s: %s"%(self.output_file, added))
+            self.columns = self.columns + added
+        df = df.reindex(columns=self.columns)
+        self.writer.write(df)
+        self.n_written += len(df)
+        return df
+    
+    def close(self):
+        self.writer.close()
+
+
+def process_chunks(raw_file, output_file, chunksize, coordinates=None, incremental=False, memory_report=False):
+    
+    # Only one chunk and a sorted array of the key hashes already written are in memory at once
+    processor = ChunkProcessor(output_file, incremental, coordinates)
+    for chunk in iter_table(raw_file, chunksize, dtype=raw_dtypes):
+        df = processor.process(chunk)
+        if memory_report and df is not None:
+            print_memory_report(df, apply_dtypes(df.copy(), compact_dtypes)[0], 'of processed chunk')
+        print("%s raw ads processed, %s written..."%(processor.n_raw, processor.n_written))
+    processor.close()
+    
+    if processor.n_written == 0:
+        print("No new ads to process")
+
+
+if __name__ == '__main__':
+    
+    args = parser.parse_args()
+    coordinates = coordinates_function(args)
+    
+    if args.output_file == '':
+        root, extension = os.path.splitext(args.raw_file)
+        args.output_file = root.split('_')[0] + '_processed' + extension
+    
+    if not os.path.isfile(args.raw_file):
+        print("%s could not be found..."%args.raw_file)
+        exit()
+    
+    if args.chunksize is not None or args.incremental:
+        chunksize = args.chunksize if args.chunksize is not None else 100000
+        print("Processing raw file %s in chunks of %s ads..."%(args.raw_file, chunksize))
+        process_chunks(args.raw_file, args.output_file, chunksize, coordinates, args.incremental, args.memory_report)
+        print("Done!")
+        exit()
+    
+    # Load raw data file
+    print("Loading raw file %s..."%args.raw_file)
+    df = read_table(args.raw_file, dtype=raw_dtypes)
+    df = process_ads(df)
+    
     # Remove duplicates
-    df = df.drop_duplicates(subset=['AdId', 'Poster', 'City', 'Price'], keep='first', ignore_index=True)
+    df = df.drop_duplicates(subset=duplicate_subset, keep='first', ignore_index=True)
     
     # Convert datatypes
-    #df['Poster'] = df['Poster'].astype(str)
-    #df['AdId'] = df['AdId'].astype(str)
-    #df = df.convert_dtypes()
-    cols = [ c for c in df.columns if c in my_dtypes.keys() ]
-    for c in cols:
-        df[c] = df[c].astype(my_dtypes[c])
+    df, cols = apply_dtypes(df, my_dtypes)
+    if args.memory_report:
+        print_memory_report(df[cols], apply_dtypes(df[cols].copy(), compact_dtypes)[0], 'of processed ads')
     
     
     print("Writing to file...")
-    df.to_csv(args.output_file, sep=',', header=True, index=False, columns=cols)
+    write_table(df, args.output_file, columns=cols)
     
     if args.lat_long:
         print("Continuing to get longitude/latitude info...")
         # Format Location coordinates for map visualizations
-        df['Longitude'] = np.nan
-        df['Latitude'] = np.nan
-        print("Grab a coffee, this will take some time!\n")
-        while df['Longitude'].isna().any() and df['Latitude'].isna().any():
-            print("Querying coordinates...")
-            df = get_coordinates(df)
+        print("Querying coordinates...")
+        df = coordinates(df)
         df['Longitude'] = df['Longitude'].astype('float32')
         df['Latitude'] = df['Latitude'].astype('float32')
 
         # Write final data to file
         print("Writing to file...")
-        df = df.drop_duplicates(subset=['AdId', 'Poster', 'City', 'Price'], keep='first', ignore_index=True)
-        df.to_csv(args.output_file, sep=',', header=True, index=False)
+        df = df.drop_duplicates(subset=duplicate_subset, keep='first', ignore_index=True)
+        write_table(df, args.output_file)
     
     print("Done!")
     
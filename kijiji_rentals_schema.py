@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Column types of processed ads, shared by kijiji_rentals_process.py and
+    kijiji_rentals_clean.py.
+
+    my_dtypes are the types processed files are written and read with. compact_dtypes
+    hold the same data in less memory: repeated strings (city, unit type, poster, ...)
+    as categoricals, posting dates as datetimes and measures as float32. Flags stay bool or
+    nullable boolean (1 byte per value, plus 1 byte for the missing mask).
+
+@author: eric
+"""
+
+import pandas as pd
+
+
+my_dtypes = {'Price': 'float64',
+ 'Location': 'object',
+ 'PostingDate': 'object',
+ 'Poster': 'object',
+ 'AdId': 'object',
+ 'ScrapeDate': 'object',
+ 'UnitType': 'object',
+ 'Bedrooms': 'object',
+ 'Bathrooms': 'object',
+ 'Appliances-Laundry-(In-Unit)': 'boolean',
+ 'Appliances-Dishwasher': 'boolean',
+ 'Appliances-Fridge-/-Freezer': 'boolean',
+ 'Personal-Outdoor-Space-Balcony': 'boolean',
+ 'Amenities-Gym': 'boolean',
+ 'Amenities-Bicycle-Parking': 'boolean',
+ 'Amenities-Storage-Space': 'boolean',
+ 'Amenities-Elevator-in-Building': 'boolean',
+ 'Parking-Included': 'float64',
+ 'Agreement-Type': 'object',
+ 'Move-In-Date': 'object',
+ 'Pet-Friendly': 'object',
+ 'Size-(sqft)': 'float64',
+ 'Furnished': 'boolean',
+ 'Air-Conditioning': 'boolean',
+ 'Smoking-Permitted': 'object',
+ 'Utilities-Included-Hydro': 'boolean',
+ 'Utilities-Included-Heat': 'boolean',
+ 'Utilities-Included-Water': 'boolean',
+ 'Wi-Fi-and-More-Internet': 'boolean',
+ 'Wi-Fi-and-More-Cable-/-TV': 'boolean',
+ 'Amenities-Pool': 'boolean',
+ 'Elevator-Accessibility-Features-Wheelchair-accessible': 'boolean',
+ 'Barrier-free-Entrances-and-Ramps': 'boolean',
+ 'Visual-Aids': 'boolean',
+ 'Accessible-Washrooms-in-Suite': 'boolean',
+ 'Appliances-Laundry-(In-Building)': 'boolean',
+ 'Personal-Outdoor-Space-Yard': 'boolean',
+ 'Amenities-Concierge': 'boolean',
+ 'Amenities-24-Hour-Security': 'boolean',
+ 'More-Info': 'object',
+ 'Elevator-Accessibility-Features-Braille-Labels': 'boolean',
+ 'City': 'object',
+ 'RentalCategory': 'object',
+ 'Commercial': 'boolean',
+ 'Residential': 'boolean',
+ 'PostingDateDaysInAdvance': 'float64',
+ 'Preference-Male': 'bool',
+ 'Preference-Female': 'bool',
+ 'Male': 'bool',
+ 'Female': 'bool',
+ 'Sublet': 'bool',
+ 'Students': 'bool',
+ 'Preference-Any': 'bool',
+ 'NumberBedrooms': 'float64',
+ 'NumberBathrooms': 'float64',
+ 'PricePerBedroom': 'float64',
+ 'PricePerSqFt': 'float64',
+ 'Elevator-Accessibility-Features-Audio-Prompts': 'boolean'}
+
+# Low cardinality text, stored once per distinct value
+categorical_columns = ['Poster', 'ScrapeDate', 'UnitType', 'Bedrooms', 'Bathrooms', 'Agreement-Type', 'Move-In-Date',
+                       'Pet-Friendly', 'Smoking-Permitted', 'City', 'RentalCategory']
+
+compact_dtypes = dict(my_dtypes)
+compact_dtypes.update({ c: 'category' for c in categorical_columns })
+compact_dtypes.update({ c: 'float32' for c, dtype in my_dtypes.items() if dtype == 'float64' })
+compact_dtypes['PostingDate'] = 'datetime64[ns, UTC]'
+
+
+def read_dtypes(dtypes):
+    # Types pd.read_csv can parse directly, datetimes are converted after reading
+    return { c: dtype for c, dtype in dtypes.items() if not dtype.startswith('datetime') }
+
+def apply_dtypes(df, dtypes=my_dtypes):
+
+    # Columns of df with a type in dtypes, converted
+    cols = [ c for c in df.columns if c in dtypes.keys() ]
+    for c in cols:
+        if dtypes[c].startswith('datetime') and not pd.api.types.is_datetime64_any_dtype(df[c]):
+            df[c] = pd.to_datetime(df[c], utc=dtypes[c].endswith('UTC]'))
+        else:
+            df[c] = df[c].astype(dtypes[c])
+    return df, cols
+
+def print_memory_report(before, after, title=''):
+
+    # Per-column memory (MB) and type of two versions of the same frame
+    after = after.reindex(columns=before.columns)
+    report = pd.DataFrame({'before MB': before.memory_usage(index=False, deep=True) / 1e6,
+                           'after MB': after.memory_usage(index=False, deep=True) / 1e6,
+                           'before': before.dtypes.astype(str),
+                           'after': after.dtypes.astype(str)})
+    report = report.sort_values('before MB', ascending=False)
+    print("Memory %s(%s rows):"%(title + ' ' if title != '' else '', len(before)))
+    print(report.to_string(float_format='{:.2f}'.format))
+    print("Total: %.1f MB -> %.1f MB"%(report['before MB'].sum(), report['after MB'].sum()))
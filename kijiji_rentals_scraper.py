@@ -10,273 +10,642 @@ Description:
         "Title", "Price", "Location", "Description", "PostingDate", "Poster", "AdURL", "ScrapeDate"
     
     Subsequent running of the script will add the new listings to the provided file.
+    
+    Ad pages can be fetched concurrently with --workers N (N requests in flight at once).
+    Search result pages are crawled in a separate thread and queued ahead (--prefetch_pages)
+    so collecting ads never waits on a search page request.
+    
+    The crawl position is checkpointed after every saved page, an interrupted crawl
+    continues from the next page with --resume (ads already saved are skipped).
+    
+    Several cities (--city a b c or --cities_file) are crawled concurrently as independent
+    shards (--shards at once), each with its own search pages crawler and --workers ad fetchers.
+    Ads of all cities are merged into the file once at the end, duplicates removed across cities,
+    until then every page is appended to the journal (as with --store journal).
 
 
 version: 2 (updated for Kijiji website changes from v1 compatibility)
 
 
 TODO:
-    Make run parallel with multiprocessing since it takes ~2.5 hours on first run (at 88 pages, 40 ads/page)
+    First run takes ~2.5 hours with a single worker (at 88 pages, 40 ads/page), use --workers to speed up
 
 @author: eric
 """
 
 import os
 import datetime
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
 import pandas as pd
-import numpy as np
 import time
 import re
 import tqdm
 import argparse
+import queue
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from concurrent.futures import ThreadPoolExecutor
+from kijiji_rentals_http import KijijiClient
+from kijiji_rentals_extract import BACKENDS, ParserPool, extract_ad_info, extract_search_json, ad_id_from_url, has_fields
+from kijiji_rentals_archive import PageArchive
+from kijiji_rentals_io import read_table, write_table
+from kijiji_rentals_store import journal_path, append_journal, read_journal, checkpoint_path, write_checkpoint, read_checkpoint, index_path, SeenIndex
 
 
 describe_help = 'python kijiji_rentals_scraper.py --file ads.csv --city ottawa'
 parser = argparse.ArgumentParser(description=describe_help)
 # User defined options
-parser.add_argument('-f', '--file', help='File (.csv) to update results, will create if nonexisting', type=str, default="ads.csv")
-parser.add_argument('-c', '--city', help='City to search ads', type=str, default="")
-args = parser.parse_args()
+parser.add_argument('-f', '--file', help='File (.csv, .parquet or .feather) to update results, will create if nonexisting', type=str, default="ads.csv")
+parser.add_argument('-c', '--city', help='Cities to search ads (URL extension after the homepage)', type=str, nargs='+', default=None)
+parser.add_argument('--cities_file', help='File with one city to search ads per line', type=str, default=None)
+parser.add_argument('--shards', help='Number of cities crawled at once (default: all)', type=int, default=None)
+parser.add_argument('--home_url', help='Kijiji homepage to crawl (e.g. a local stand-in server for benchmarks)', type=str, default='https://www.kijiji.ca/')
+parser.add_argument('-w', '--workers', help='Number of ad pages to fetch concurrently (per city)', type=int, default=1)
+parser.add_argument('--pool_size', help='Number of pooled connections kept open to kijiji.ca (default: number of workers of all shards)', type=int, default=None)
+parser.add_argument('--retries', help='Number of retries on connect, read and 5xx errors', type=int, default=3)
+parser.add_argument('--connect_timeout', help='Seconds to wait to establish a connection', type=float, default=10)
+parser.add_argument('--read_timeout', help='Seconds to wait for a response', type=float, default=120)
+parser.add_argument('--max_rate', help='Ceiling on requests/sec, requests are otherwise paced adaptively (slowed down on 429/503 and rising latency)', type=float, default=None)
+parser.add_argument('--parser', help='Backend used to extract ad info from ad pages', type=str, choices=BACKENDS, default='bs4')
+parser.add_argument('--parse_workers', help='Number of processes parsing ad pages (0 parses in the main process)', type=int, default=0)
+parser.add_argument('--search_json', help='Take ad info from the JSON embedded in search pages, only fetching ad pages of ads missing --json_fields', action='store_true', default=False)
+parser.add_argument('--json_fields', help='Fields that must be in the search page JSON to skip fetching the ad page', type=str, nargs='+', default=["Title", "Price", "Location", "Description", "PostingDate", "Poster"])
+parser.add_argument('--prefetch_pages', help='Number of search result pages fetched ahead of the ads being collected', type=int, default=2)
+parser.add_argument('--store', help='"rewrite" rewrites the file after every page (a single city, several are journaled), "journal" appends each page to a journal merged into the file at the end of the run', type=str, choices=['rewrite', 'journal'], default='rewrite')
+parser.add_argument('--delta', help='Request newest ads first and stop paginating after --delta_threshold consecutive ads already saved', action='store_true', default=False)
+parser.add_argument('--delta_threshold', help='Number of consecutive known ads that ends a --delta crawl', type=int, default=40)
+parser.add_argument('--archive', help='Folder to save every fetched search and ad page to (compressed)', type=str, default=None)
+parser.add_argument('--from_archive', help='Re-extract ad info from the pages saved in this archive folder instead of crawling, no network requests', type=str, default=None)
+parser.add_argument('--resume', help='Continue an interrupted crawl from the page after the last one saved', action='store_true', default=False)
+parser.add_argument('--compact', help='Merge a leftover journal into the file, remove duplicates and exit', action='store_true', default=False)
 
+# Columns saved for every ad, attribute columns found on ad pages follow these
+AD_COLUMNS = ["Title", "Price", "Location", "Description", "PostingDate", "Poster", "AdURL", "AdId", "ScrapeDate"]
 
-def collect_ads_info(ad_links, df_new):
+
+def fetch_ad_page(ad_url):
     
-    row = df_new.shape[0]
-    for ad in tqdm.tqdm(ad_links):
-        
+    try:
+        ad_page = client.get(ad_url)
+    except Exception as e:
+        print(e)
+        print("Unable to get: %s...\n"%ad_url)
+        return None
+    
+    # Fetch time is the PostingDate of ads without one, kept in the archive so re-extraction gives the same
+    ad_page.fetched = datetime.datetime.now(tz=datetime.timezone.utc).isoformat()
+    if archive is not None:
+        archive.add(ad_url, 'ad', ad_page.content, status=ad_page.status_code, fetched=ad_page.fetched)
+    
+    return ad_page
+
+def collect_ads_info(ad_urls, workers=1, json_records=None, show_progress=True):
+    
+    # Ads with all needed fields in the search page JSON do not need their ad page
+    json_records = json_records or {}
+    json_ads = { ad_url: json_records.get(ad_id_from_url(ad_url)) for ad_url in ad_urls }
+    fetch_urls = [ ad_url for ad_url in ad_urls if not has_fields(json_ads[ad_url], args.json_fields) ]
+    if len(json_records) > 0 and show_progress:
+        print("%s of %s ads taken from search page data without fetching the ad page"%(len(ad_urls) - len(fetch_urls), len(ad_urls)))
+    
+    # Fetch ad pages concurrently, results are kept in the same order as ad_urls
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        ad_pages = executor.map(fetch_ad_page, fetch_urls)
+        fetched_records = { ad_info['AdURL']: ad_info for ad_info in parse_ads_info(fetch_urls, ad_pages, show_progress) }
+    
+    records = []
+    for ad_url in ad_urls:
+        ad_info = fetched_records.get(ad_url)
+        json_info = json_ads[ad_url]
+        if json_info is not None:
+            json_info = dict(json_info, AdURL=ad_url)
+            if ad_info is None:
+                ad_info = json_info
+            else:
+                # Fields missing from the ad page are filled from the search page JSON
+                for column, value in json_info.items():
+                    ad_info.setdefault(column, value)
+        if ad_info is not None:
+            records.append(ad_info)
+    
+    return records
+
+def parse_ads_info(ad_urls, ad_pages, show_progress=True):
+    
+    # Parse in worker processes if available, otherwise here as pages are fetched
+    if parser_pool is not None:
+        ad_infos = parser_pool.parse(ad_urls, ad_pages, HOME_URL, scrape_date)
+    else:
+        ad_infos = ( extract_ad_info(ad_page.content, ad_url, HOME_URL, scrape_date, backend=args.parser, fetched=getattr(ad_page, 'fetched', None))
+                     if ad_page is not None else None for ad_url, ad_page in zip(ad_urls, ad_pages) )
+    
+    # One record (dict of column: value) per ad, turned into a DataFrame in one batch by records_to_frame
+    records = []
+    for ad_info in tqdm.tqdm(ad_infos, total=len(ad_urls), disable=not show_progress):
+        if ad_info is not None:
+            records.append(ad_info)
+    
+    return records
+
+def records_to_frame(records):
+    
+    # Build the DataFrame in one go, columns are the ad columns followed by attributes in order of appearance
+    if len(records) == 0:
+        return pd.DataFrame(columns=AD_COLUMNS)
+    df = pd.DataFrame.from_records(records)
+    columns = AD_COLUMNS + [ c for c in df.columns if c not in AD_COLUMNS ]
+    return df.reindex(columns=columns)
+
+
+def get_ad_urls(soup):
+    
+    ad_urls = []
+    # Get list of ads
+    ad_list = soup.find_all('ul', {'data-testid': 'srp-search-list'})
+    
+    # ad_list contains 2 elements, first is "featured" ads, second is all relevant ads
+    for ads in ad_list[1:]:
+        ad_links = ads.find_all("a", href=True)
         # ignore links to images
-        if 'http' in ad['href'] and 'imageNumber=' in ad['href']:
-            continue
+        ad_urls += [ HOME_URL[:-1] + ad['href'] for ad in ad_links if 'http' not in ad['href'] and 'imageNumber=' not in ad['href'] ]
+    
+    return ad_urls
 
-        ad_url = HOME_URL[:-1] + ad['href']
-        
+def get_next_page_url(soup):
+    
+    # To get next page ads
+    try:
+        next_html = soup.find('li', {'data-testid': 'pagination-next-link'})
+        if next_html != None:
+            return next_html.find('a', href=True)['href']
+    except:
+        print("No more pages...or run again if failed...")
+        with open('htmlerror.txt', 'w') as f:
+            f.write(str(soup))
+    
+    return None
+
+def get_last_page_number(soup):
+    
+    # Highest page number shown in the pagination links, None if not found
+    page_numbers = [ int(li.get_text().strip()) for li in soup.find_all('li', {'data-testid': re.compile('pagination')}) if li.get_text().strip().isdigit() ]
+    if len(page_numbers) == 0:
+        return None
+    return max(page_numbers)
+
+def sort_newest_first(url):
+    
+    url_parts = urlsplit(url)
+    query = dict(parse_qsl(url_parts.query))
+    query['sort'] = 'dateDesc'
+    return urlunsplit(url_parts._replace(query=urlencode(query)))
+
+def put_until_stopped(page_queue, item, stop_event):
+    
+    # Block while the queue is full, but give up if the consumer has stopped
+    while not stop_event.is_set():
         try:
-            session = requests.Session()
-            retry = Retry(connect=3, backoff_factor=0.5)
-            adapter = HTTPAdapter(max_retries=retry)
-            session.mount('http://', adapter)
-            ad_page = requests.get(ad_url, timeout=120)
-            ad_soup = BeautifulSoup(ad_page.content, "html.parser")
-            #time.sleep(3)
-        except Exception as e:
-            print(e)
-            print("Unable to get: %s...\n"%ad_url)
+            page_queue.put(item, timeout=1)
+            return True
+        except queue.Full:
             continue
-        
-        try:
-            title = '_'.join(np.unique(ad_soup.find_all('h1', re.compile("title*"))))
-            price = '_'.join(np.unique(ad_soup.find_all('span', re.compile("currentPrice*"))))
-            location = '_'.join(np.unique(ad_soup.find_all('span', re.compile("address"))))
-            ad_id = '_'.join(np.unique(ad_soup.find_all('a', re.compile("adId*"))))
+    
+    return False
+
+def crawl_search_pages(rentals_url, page_queue, stop_event, seen, crawl_stats, delta_threshold=None, search_json=False, page_number=1):
+    
+    # Producer: walks the search result pages and queues the ad urls of each page
+    # With delta_threshold, stops once that many consecutive ads (newest first) are already known
+    consecutive_known = 0
+    try:
+        while rentals_url is not None and not stop_event.is_set():
             try:
-                ad_post_date = ad_soup.find('div', re.compile("datePosted*")).time["datetime"]
-            except:
-                ad_post_date = datetime.datetime.now(tz=datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%zZ").replace('+0', '')
-            ad_poster_profile = HOME_URL[:-1] + ad_soup.find('a', re.compile("avatarLink*"))["href"]
+                page = client.get(rentals_url)
+                if archive is not None:
+                    archive.add(rentals_url, 'search', page.content, status=page.status_code)
+                soup = BeautifulSoup(page.content, "html.parser")
+            except Exception as e:
+                print(e)
+                print("Unable to get page %s: %s...\n"%(page_number, rentals_url))
+                break
             
-            descriptions = ad_soup.find_all('p')
-            description = ''
-            for d in descriptions[:-1]:
-                description = description + "\n" + d.get_text()
+            crawl_stats['pages'] = page_number
+            if page_number == 1:
+                crawl_stats['last_page'] = get_last_page_number(soup)
             
-            # Add listing info to df
-            df_new.loc[row, "Title"] = title
-            df_new.loc[row, "Price"] = price
-            df_new.loc[row, "Location"] = location
-            df_new.loc[row, "Description"] = description
-            df_new.loc[row, "PostingDate"] = ad_post_date
-            df_new.loc[row, "Poster"] = ad_poster_profile
-            df_new.loc[row, "AdURL"] = ad_url
-            df_new.loc[row, 'AdId'] = ad_id
-            df_new.loc[row, "ScrapeDate"] = scrape_date
-        except Exception as e:
-            print(e)
-            print("Unable to parse data from: %s...\n"%ad_url)
-            row += 1
-            continue
+            # Remove any if already exist in old data
+            ad_urls = []
+            for ad_url in get_ad_urls(soup):
+                if seen.is_known(ad_url):
+                    crawl_stats['known_ads'] += 1
+                    consecutive_known += 1
+                else:
+                    ad_urls.append(ad_url)
+                    consecutive_known = 0
+            
+            # Listings embedded in the page, kept only for the ads to collect
+            json_records = {}
+            if search_json:
+                json_records = extract_search_json(page.content, HOME_URL, scrape_date)
+                ad_ids = set(ad_id_from_url(ad_url) for ad_url in ad_urls)
+                json_records = { ad_id: ad_info for ad_id, ad_info in json_records.items() if ad_id in ad_ids }
+            
+            next_url = get_next_page_url(soup)
+            if delta_threshold is not None and consecutive_known >= delta_threshold:
+                crawl_stats['stopped_early'] = next_url is not None
+                next_url = None
+            
+            if not put_until_stopped(page_queue, (page_number, rentals_url, next_url, ad_urls, json_records), stop_event):
+                break
+            
+            rentals_url = next_url
+            page_number += 1
         
-        try:
-            title_attributes = ad_soup.find('div', re.compile("titleAttributes*"))
-            if title_attributes != None:
-                title_details = title_attributes.find_all('li')
-                for detail in title_details:
-                    if 'unittype' in detail.find('use')['xlink:href']:
-                        df_new.loc[row, "UnitType"] = detail.get_text()
-                    elif 'numberbedrooms' in detail.find('use')['xlink:href']:
-                        df_new.loc[row, "Bedrooms"] = pd.Series(detail.get_text()).str.extract(r'(\d+)')[0][0] # detail.get_text().split()[-1]
-                    elif 'numberbathrooms' in detail.find('use')['xlink:href']:
-                        df_new.loc[row, "Bathrooms"] = pd.Series(detail.get_text()).str.extract(r'(\d+)')[0][0] # detail.get_text().split()[-1]
-                    elif 'furnished' in detail.find('use')['xlink:href']:
-                        df_new.loc[row, "Furnished"] = detail.get_text().split()[-1]
-                    elif 'petsallowed' in detail.find('use')['xlink:href']:
-                        df_new.loc[row, "PetFriendly"] = detail.get_text().split()[-1]
-            else:
-                title_attributes = ad_soup.find('div', re.compile("attributeList*"))
-                if title_attributes != None:
-                    title_details = title_attributes.find_all('ul')
-                    for detail_list in title_details:
-                        details = detail_list.find_all('li')
-                        for detail in details:
-                            df_new.loc[row, '-'.join(detail.find('dt').get_text().split())] = detail.find('dd').get_text()
+        # Reached the last page (not stopped or failed)
+        crawl_stats['finished'] = rentals_url is None
+    finally:
+        # Signal there are no more pages
+        put_until_stopped(page_queue, None, stop_event)
 
-        except Exception as e:
-            print(e)
-            print("Unable to get unit details from: %s...\n"%ad_url)
+def read_cities(cities, cities_file):
+    
+    # Cities given with --city followed by the ones in --cities_file, without repeats
+    cities = list(cities or [])
+    if cities_file is not None:
+        with open(cities_file, 'r', encoding='utf-8') as f:
+            cities += [ line.strip() for line in f if line.strip() != '' and not line.startswith('#') ]
+    if len(cities) == 0:
+        cities = [""]
+    
+    return list(dict.fromkeys(cities))
+
+def find_rentals_url(city):
+    
+    page = client.get(HOME_URL + city)
+    soup = BeautifulSoup(page.content, "html.parser")
+    
+    # Get url extension for rental listings - page 1
+    try:
+        rentals_links = [i for i in soup.find_all(href=True) if 'for-rent' in i['href']]
+        return HOME_URL[:-1] + rentals_links[0]['href']
+    except IndexError:
+        print("Check URL of city %s and input --city with URL after %s"%(city, HOME_URL))
+    
+    return None
+
+def save_page(city, page_number, page_url, next_url, records):
+    
+    # Pages collected by all shards are saved one at a time
+    with save_lock:
+        for record in records:
+            seen.add(record['AdURL'], record['AdId'])
+        if args.store == 'journal':
+            append_journal(journal_path(args.file), page_number, records)
+        else:
+            # Only a single city rewrites the file after every page, several cities are always journaled
+            new_frames.append(records_to_frame(records))
+            write_data(df_old, new_frames, args.file, seen)
         
-        try:
-            ad_attributes = {}
+        # Checkpoint only once the page is saved, next_url is None once the city is finished
+        checkpoint['cities'][city] = {'page_number': page_number, 'page_url': page_url, 'next_url': next_url}
+        write_checkpoint(checkpoint_path(args.file), checkpoint)
+    
+    if page_handler is not None:
+        page_handler(records)
+
+def crawl_city(city, stop_event, crawl_stats, resume_from=None, label=''):
+    
+    # One shard: search pages are crawled in a separate thread and queued ahead, ads are collected here
+    crawl_stats['start'] = time.perf_counter()
+    if resume_from is not None:
+        # Continue after the last page saved
+        rentals_url = resume_from['next_url']
+        first_page = resume_from['page_number'] + 1
+        print("%sResuming from page %s..."%(label, first_page))
+    else:
+        rentals_url = find_rentals_url(city)
+        if rentals_url is None:
+            return
+        if args.delta:
+            rentals_url = sort_newest_first(rentals_url)
+        first_page = 1
+    
+    page_queue = queue.Queue(maxsize=max(args.prefetch_pages, 1))
+    crawler_stop = threading.Event()
+    crawler = threading.Thread(target=crawl_search_pages,
+                               args=(rentals_url, page_queue, crawler_stop, seen, crawl_stats, args.delta_threshold if args.delta else None, args.search_json, first_page),
+                               daemon=True)
+    crawler.start()
+    
+    try:
+        while not stop_event.is_set():
+            try:
+                queued_page = page_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            if queued_page is None:
+                crawl_stats['complete'] = crawl_stats['finished']
+                break
             
-            # Get rental attributes if ad has attribute cards
-            attribute_groups = ad_soup.find_all('li', re.compile("attributeGroupContainer*"))
-            for attributes in attribute_groups:
-                attribute = attributes.find('div')
-                attribute_type = attribute.find('h4').get_text().replace(' ', '-')
-                
-                for a in attribute.find_all('li'):
-                    if a.get_text() != '':
-                        if a.find('use') == None:
-                            ad_attributes[attribute_type + '-' + a.get_text().replace(' ', '-')] = 'Yes'
-                        elif a.find('use') != None:
-                            if 'yes' in a.find('use')['xlink:href']:
-                                ad_attributes[attribute_type + '-' + a.get_text().replace(' ', '-')] = 'Yes'
-                            elif 'no' in a.find('use')['xlink:href']:
-                                ad_attributes[attribute_type + '-' + a.get_text().replace(' ', '-')] = 'No'
-    
-            # Repeat for rental attributes with two-line attributes      
-            attribute_twolines = ad_soup.find_all('li', re.compile("twoLinesAttribute*"))
-            for attribute in attribute_twolines:
-                attribute_type = attribute.find("dt").get_text().replace(' ', '-')
-                attribute_details = attribute.find("dd").get_text().replace(' ', '-')
-                ad_attributes[ attribute_type ] = attribute_details
-                
-            # Add listing features to df
-            for feature, value in ad_attributes.items():
-                df_new.loc[row, feature] = value
+            page_number, page_url, next_url, ad_urls, json_records = queued_page
+            try:
+                if label == '':
+                    print("Page %s\n"%page_number)
+                records = collect_ads_info(ad_urls, workers=args.workers, json_records=json_records, show_progress=label == '')
+                save_page(city, page_number, page_url, next_url, records)
+                crawl_stats['ads'] += len(records)
+                if label != '':
+                    elapsed = time.perf_counter() - crawl_stats['start']
+                    print("%sPage %s: %s new ads, %s in %.0fs (%.1f ads/sec), %s"%(label, page_number, len(records), crawl_stats['ads'], elapsed, crawl_stats['ads'] / elapsed, rate_summary()))
+                else:
+                    print(rate_summary())
+            except ConnectionError as e:
+                print(e)
+    finally:
+        crawl_stats['end'] = time.perf_counter()
+        crawler_stop.set()
+
+def crawl_cities(city_queue, stop_event, city_stats, resume_from, show_labels):
+    
+    # Shard worker, crawls one city after another until none are left
+    while not stop_event.is_set():
+        try:
+            city = city_queue.get_nowait()
+        except queue.Empty:
+            return
+        try:
+            crawl_city(city, stop_event, city_stats[city], resume_from.get(city), "[%s] "%city if show_labels else '')
         except Exception as e:
             print(e)
-            print("Unable to get ad features for: %s...\n"%ad_url)
-            row += 1
-            continue
-        
-        row += 1
+            print("Unable to crawl city %s...\n"%city)
+
+def rate_summary():
+    
+    # Current pacing of requests by the client's rate controller
+    rate = client.rate()
+    return "%.1f requests/sec (%s, %s in flight allowed, %s throttled)"%(rate['rate'], "limit %.1f/sec"%rate['rate_limit'] if rate['rate_limit'] is not None else "no rate limit",
+                                                                       rate['concurrency'], rate['throttled'])
+
+def print_crawl_stats(crawl_stats, label=''):
+    
+    elapsed = crawl_stats['end'] - crawl_stats['start'] if crawl_stats['end'] is not None else 0
+    print("%sFetched %s search pages, skipped %s known ads, collected %s ads in %.0fs (%.1f ads/sec)"%(label, crawl_stats['pages'], crawl_stats['known_ads'], crawl_stats['ads'], elapsed, crawl_stats['ads'] / elapsed if elapsed > 0 else 0))
+    if crawl_stats['stopped_early']:
+        if crawl_stats['last_page'] is not None:
+            print("%sDelta crawl stopped early, saved %s search page requests"%(label, crawl_stats['last_page'] - crawl_stats['pages']))
+        else:
+            print("%sDelta crawl stopped early at page %s"%(label, crawl_stats['pages']))
+
+def extract_archive(folder, batch_size=1000):
+    
+    # Re-extract all archived ad pages, ScrapeDate is the date each page was fetched
+    page_archive = PageArchive(folder)
+    records = []
+    batch = []
+    for page in page_archive.iter_pages(kind='ad'):
+        batch.append(page)
+        if len(batch) == batch_size:
+            records += parse_archived_pages(batch)
+            batch = []
+    records += parse_archived_pages(batch)
+    
+    return records
+
+def parse_archived_pages(pages):
+    
+    scrape_dates = {}
+    for page in pages:
+        fetched = datetime.datetime.fromisoformat(page.fetched).astimezone()
+        scrape_dates[page.url] = "%s-%s-%s"%(fetched.year, fetched.month, fetched.day)
+    
+    records = parse_ads_info([ page.url for page in pages ], pages)
+    for ad_info in records:
+        ad_info["ScrapeDate"] = scrape_dates[ad_info["AdURL"]]
     
-    return df_new
+    return records
 
-def write_data(df_old, df_new, filename):
+def load_checkpoint(filename, home_url):
+    
+    # Crawl position of each city saved by a previous run, empty if there is none to resume
+    checkpoint = read_checkpoint(checkpoint_path(filename))
+    if checkpoint is None or 'cities' not in checkpoint:
+        print("No checkpoint to resume from, starting from page 1...")
+        return {}
+    if checkpoint['home_url'] != home_url:
+        print("Checkpoint is for %s, starting from page 1..."%checkpoint['home_url'])
+        return {}
+    
+    return checkpoint['cities']
+
+def load_data(filename):
+    
+    # Load previously saved file
+    if os.path.isfile(filename):
+        print("Loading %s..."%filename)
+        return read_table(filename)
+    
+    print("Creating save file %s..."%filename)
+    return pd.DataFrame(columns=AD_COLUMNS)
+
+def load_seen_index(filename):
+    
+    # Index of saved ads, rebuilt from the file when missing or older than the file
+    path = index_path(filename)
+    if os.path.isfile(path) and (not os.path.isfile(filename) or os.path.getmtime(path) < os.path.getmtime(filename)):
+        os.remove(path)
+    seen = SeenIndex(path)
+    if not os.path.isfile(path) and os.path.isfile(filename):
+        print("Building index of saved ads...")
+        seen.add_frame(read_table(filename, columns=['AdURL', 'AdId'], dtype=str))
+        seen.save()
+    
+    return seen
+
+def add_city(df):
+    
+    # City is the part of the ad url after the category
+    cities = df['AdURL'].str.split('/', expand=True)
+    df['City'] = cities[4]
+    return df
+
+def write_data(df_old, new_frames, filename, seen=None):
     
     print("Updating file, removing duplicate listings...")
     # Add updates to old data
-    df = pd.concat([df_old, df_new], ignore_index=True)
+    df = pd.concat([df_old] + new_frames, ignore_index=True)
     # Remove duplicates
     df.drop_duplicates(subset=['AdURL'], ignore_index=True, inplace=True)
     df.drop_duplicates(subset=['AdId'], ignore_index=True, inplace=True)
     df.drop_duplicates(subset=['Title', 'Location', 'Poster', 'Description'], ignore_index=True, inplace=True)
     
-    cities = df['AdURL'].str.split('/', expand=True)
-    df['City'] = cities[4]
+    df = add_city(df)
     
     print("Writing to file...")
-    df.to_csv(filename, sep=',', header=True, index=False)
+    write_table(df, filename)
+    
+    # Index is saved after the file so it is never older than the file, ads are added to it as they are collected
+    if seen is not None:
+        seen.save()
+    
+    return df
+
+def compact_journal(filename, seen):
+    
+    # Merge journaled pages into the file once, then start a new journal
+    journal = journal_path(filename)
+    records = read_journal(journal)
+    df = None
+    if len(records) > 0:
+        # Journaled by a run that may have died before saving the index
+        df_new = records_to_frame(records)
+        seen.add_frame(df_new)
+        df = write_data(load_data(filename), [df_new], filename, seen)
+    if os.path.isfile(journal):
+        os.remove(journal)
     
     return df
 
 
-if __name__ == '__main__':
+def main(arguments, on_page=None):
     
+    # Crawl state is shared by the crawling threads as module globals
+    global args, scrape_date, seen, HOME_URL, archive, parser_pool, df_old, cities, checkpoint, client, new_frames, save_lock, page_handler
+    args = arguments
+    # Called with the records of every saved page (e.g. by kijiji_rentals_pipeline.py)
+    page_handler = on_page
     scrape_date = "%s-%s-%s"%(datetime.datetime.now().year, datetime.datetime.now().month, datetime.datetime.now().day)
     
-    # Load previously saved file
-    if os.path.isfile(args.file):
-        print("Loading %s..."%args.file)
-        df_old = pd.read_csv(args.file)
-    else:
-        print("Creating save file %s..."%args.file)
-        #df_old = pd.DataFrame(columns=["Title", "Price", "Date", "Location", "Description", "NearestIntersection", "Bedrooms", "Link"])
-        df_old = pd.DataFrame(columns=["Title", "Price", "Location", "Description", "PostingDate", "Poster", "AdURL", "AdId", "ScrapeDate"])
-        
-        
-    print("Fetching kijiji.ca...")
+    # Index of previously saved ads, used to skip known listings
+    seen = load_seen_index(args.file)
+    
+    # Pages journaled by a run that did not finish are merged first
+    if os.path.isfile(journal_path(args.file)):
+        print("Merging journal left by previous run...")
+        # Its ads may not have reached page_handler before the run stopped, ads it already has are skipped by it
+        recovered = read_journal(journal_path(args.file))
+        compact_journal(args.file, seen)
+        if page_handler is not None and len(recovered) > 0:
+            page_handler(recovered)
+    if args.compact:
+        if page_handler is None:
+            print("Done!")
+        return
+    
     # Kijiji homepage
-    HOME_URL = 'https://www.kijiji.ca/'
-    session = requests.Session()
-    retry = Retry(connect=3, backoff_factor=0.5)
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount('http://', adapter)
-    page = requests.get(HOME_URL + args.city, timeout=120)
-    soup = BeautifulSoup(page.content, "html.parser")
+    HOME_URL = args.home_url.rstrip('/') + '/'
+    archive = None
+    parser_pool = None
+    if args.parse_workers > 0:
+        parser_pool = ParserPool(args.parse_workers, backend=args.parser)
     
-    # Get url extension for rental listings - page 1
-    try:
-        rentals_links = [i for i in soup.find_all(href=True) if 'for-rent' in i['href']]
-        rentals_url = HOME_URL[:-1] + rentals_links[0]['href']
-    except IndexError:
-        print("Check URL of city and input --city with URL after %s"%HOME_URL)
-        exit()
+    if args.from_archive is not None:
+        print("Extracting ads from archive %s..."%args.from_archive)
+        records = extract_archive(args.from_archive)
+        print("Extracted %s ads"%len(records))
+        df_new = records_to_frame(records)
+        seen.add_frame(df_new)
+        write_data(load_data(args.file), [df_new], args.file, seen)
+        if page_handler is not None:
+            page_handler(records)
+        if parser_pool is not None:
+            parser_pool.close()
+        if page_handler is None:
+            print("Done!")
+        return
+    
+    if args.archive is not None:
+        archive = PageArchive(args.archive)
+    
+    cities = read_cities(args.city, args.cities_file)
+    shards = min(args.shards or len(cities), len(cities))
+    
+    # Crawl position of every city, carried over from the checkpoint when resuming
+    checkpoint = {'home_url': HOME_URL, 'cities': {}}
+    resume_from = {}
+    if args.resume:
+        checkpoint['cities'] = load_checkpoint(args.file, HOME_URL)
+        for city in list(cities):
+            if city in checkpoint['cities'] and checkpoint['cities'][city]['next_url'] is None:
+                print("%s already reached the last page, skipping..."%(city or HOME_URL))
+                cities.remove(city)
+            elif city in checkpoint['cities']:
+                resume_from[city] = checkpoint['cities'][city]
+    
+    # Several cities are merged into the file once at the end, their pages are journaled so every page checkpointed is saved
+    if args.store == 'rewrite' and len(cities) > 1:
+        print("Crawling %s cities, saving pages to the journal %s..."%(len(cities), journal_path(args.file)))
+        args.store = 'journal'
     
-    # DataFrame to save rental info
-    df_new = pd.DataFrame(columns=["Title", "Price", "Location", "Description", "PostingDate", "Poster", "AdURL", "AdId", "ScrapeDate"])
+    # Previously saved file is only needed up front when rewriting it after every page
+    if args.store == 'rewrite':
+        df_old = load_data(args.file)
     
-    # Start collecting ads page-by-page
+    print("Fetching kijiji.ca...")
+    # Single pooled client shared by all fetches (and threads) for the whole run
+    client = KijijiClient(pool_size=args.pool_size or max(args.workers, 1) * max(shards, 1),
+                          retries=args.retries,
+                          connect_timeout=args.connect_timeout,
+                          read_timeout=args.read_timeout,
+                          max_rate=args.max_rate)
+    
+    # DataFrames of rental info, one per page of ads
+    new_frames = []
+    save_lock = threading.Lock()
+    
+    # Start collecting ads page-by-page, each shard crawls one city at a time
     print("Fetching rental listings...")
-    done = False
-    page_number = 1
+    stop_event = threading.Event()
+    city_queue = queue.Queue()
+    city_stats = {}
+    for city in cities:
+        city_queue.put(city)
+        city_stats[city] = {'pages': 0, 'last_page': None, 'known_ads': 0, 'stopped_early': False, 'finished': False,
+                            'complete': False, 'ads': 0, 'start': None, 'end': None}
+    threads = [ threading.Thread(target=crawl_cities, args=(city_queue, stop_event, city_stats, resume_from, len(cities) > 1), daemon=True)
+                for _ in range(shards) ]
+    for thread in threads:
+        thread.start()
+    
     print("Grab a coffee, this will take some time!\n")
-    while not done:
-        
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=0.5)
+    except KeyboardInterrupt:
+        print("Stopping after the pages being collected, interrupt again to stop now...")
+        stop_event.set()
         try:
-            print("Page %s\n"%page_number)
-            session = requests.Session()
-            retry = Retry(connect=3, backoff_factor=0.5)
-            adapter = HTTPAdapter(max_retries=retry)
-            session.mount('http://', adapter)
-            page = requests.get(rentals_url, timeout=120)
-            soup = BeautifulSoup(page.content, "html.parser")
-            
-            # Get list of ads
-            ad_list = soup.find_all('ul', {'data-testid': 'srp-search-list'})
-            
-            # ad_list contains 2 elements, first is "featured" ads, second is all relevant ads
-            for element in range(1, len(ad_list)):
-                ads = soup.find_all('ul', {'data-testid': 'srp-search-list'})[element]
-                ad_links = ads.find_all("a", href=True)
-                ad_links = [ ad for ad in ad_links if 'http' not in ad['href'] and 'imageNumber=' not in ad['href'] ]
-                
-                # Remove any if already exist in old data
-                ad_links = [ ad for ad in ad_links if str(HOME_URL[:-1] + ad['href']) not in df_old['AdURL'].values ]
-                
-                df_new = collect_ads_info(ad_links, df_new)
-                
-            # To get next page ads
-            try:
-                next_html = soup.find('li', {'data-testid': 'pagination-next-link'})
-                if next_html != None:
-                    rentals_url = next_html.find('a', href=True)['href']
-                else:
-                    done = True
-            except:
-                print("No more pages...or run again if failed...")
-                with open('htmlerror.txt', 'w') as f:
-                    f.write(str(soup))
-                done = True
-            
-            page_number += 1
-            
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=0.5)
         except KeyboardInterrupt:
-            done = True
-        
-        except ConnectionError as e:
-            print(e)
-            
-        finally:
-            # Write to file in case errors or ending session
-            df = write_data(df_old, df_new, args.file)
+            pass
+    stop_event.set()
+    
+    for city in cities:
+        if city_stats[city]['start'] is not None:
+            print_crawl_stats(city_stats[city], "[%s] "%city if len(cities) > 1 else '')
+    print("Requests: %s"%rate_summary())
     
-    # Write to file
-    df = write_data(df_old, df_new, args.file)
-    print("Done!")
+    # Write to file, ads of all cities merged at once
+    with save_lock:
+        if args.store == 'journal':
+            compact_journal(args.file, seen)
+        else:
+            write_data(df_old, new_frames, args.file, seen)
+    # Nothing left to resume once every city reached its last page
+    if all(city_stats[city]['complete'] for city in cities) and os.path.isfile(checkpoint_path(args.file)):
+        os.remove(checkpoint_path(args.file))
+    client.close()
+    if parser_pool is not None:
+        parser_pool.close()
+    if archive is not None:
+        archive.close()
+    # Callers passing on_page print their own once done with the pages
+    if page_handler is None:
+        print("Done!")
 
+
+if __name__ == '__main__':
     
+    main(parser.parse_args())
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Incremental storage helpers for kijiji_rentals_scraper.py.
+
+    New ads of each page are appended to a journal file next to the saved .csv
+    (e.g. ads.csv.journal) instead of rewriting the whole .csv on every page.
+    Each line of the journal holds all records of one page as JSON, written with a
+    single write and fsync, so a crash can only lose a partially written last line,
+    which is ignored when reading back. The journal is merged into the .csv
+    (compaction) once at the end of a run.
+    
+    AdURLs and AdIds already saved are kept in a small index of 64-bit hashes
+    (e.g. ads.csv.seen.npy) so known ads can be skipped without loading the .csv.
+    
+    The crawl position (last search page saved and the url of the next one) is kept in
+    a checkpoint file (e.g. ads.csv.checkpoint.json) so an interrupted crawl can resume.
+
+@author: eric
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+from kijiji_rentals_extract import ad_id_from_url
+
+
+def journal_path(filename):
+    return filename + '.journal'
+
+def append_journal(path, page_number, records):
+
+    if len(records) == 0:
+        return
+    line = json.dumps({'page': page_number, 'records': records}, ensure_ascii=False, default=str) + '\n'
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+
+def read_journal(path):
+
+    records = []
+    if not os.path.isfile(path):
+        return records
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            # Last line may be incomplete if the process died while appending
+            if not line.endswith('\n'):
+                break
+            try:
+                records += json.loads(line)['records']
+            except ValueError:
+                break
+
+    return records
+
+def checkpoint_path(filename):
+    return filename + '.checkpoint.json'
+
+def write_checkpoint(path, checkpoint):
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def read_checkpoint(path):
+
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except ValueError:
+        return None
+
+def index_path(filename):
+    return filename + '.seen.npy'
+
+def hash_key(key):
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def ad_keys(ad_url, ad_id=None):
+
+    # An ad is known by its url and by its id, the id is also the last part of the url
+    keys = ['url:' + ad_url]
+    url_id = ad_id_from_url(ad_url)
+    if url_id is not None:
+        keys.append('id:' + url_id)
+    if isinstance(ad_id, str) and ad_id != '':
+        keys.append('id:' + ad_id)
+    return keys
+
+
+class SeenIndex:
+    '''
+    Set of 64-bit hashes of AdURLs and AdIds already saved.
+    
+    Hashes saved on disk are a sorted array loaded with mmap (searched with binary
+    search), hashes added during the run are kept in a set until saved.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.new_hashes = set()
+        if os.path.isfile(path):
+            self.hashes = np.load(path, mmap_mode='r')
+
+    def __len__(self):
+        return len(self.hashes) + len(self.new_hashes)
+
+    def contains_key(self, key):
+        h = hash_key(key)
+        if h in self.new_hashes:
+            return True
+        h = np.uint64(h)
+        i = np.searchsorted(self.hashes, h)
+        return i < len(self.hashes) and self.hashes[i] == h
+
+    def is_known(self, ad_url, ad_id=None):
+        return any(self.contains_key(key) for key in ad_keys(ad_url, ad_id))
+
+    def add(self, ad_url, ad_id=None):
+        for key in ad_keys(ad_url, ad_id):
+            self.new_hashes.add(hash_key(key))
+
+    def add_frame(self, df):
+        for ad_url, ad_id in zip(df['AdURL'], df['AdId']):
+            if isinstance(ad_url, str):
+                self.add(ad_url, ad_id)
+
+    def save(self):
+
+        if len(self.new_hashes) > 0:
+            new_hashes = np.fromiter(self.new_hashes, dtype=np.uint64, count=len(self.new_hashes))
+            self.hashes = np.union1d(np.asarray(self.hashes), new_hashes)
+            self.new_hashes = set()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, self.hashes)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.hashes = np.load(self.path, mmap_mode='r')